@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Vectorized Python port of read_op.F90: OP mixture file -> op_ros.data, op_pla.data, border.data.
+
+The whole OP text block is parsed into one array, the Planck/Rosseland means
+are log-transformed once, and every temperature is interpolated onto all
+target densities with a single searchsorted. With the default grid the
+outputs match read_op.F90 (built with the Makefile) byte for byte:
+- op_ros.data, op_pla.data: Fortran unformatted big-endian, (nt, nd) then t, d, data
+- border.data: per OP temperature, the first and last tabulated log rho
+
+Usage:
+  python3 ingest_op.py [mixv.gs98 ...] [--out-dir .] [--nrho 256] [--dtmp 0.05]
+With several mixture files each one is written to <out-dir>/<file stem>/.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Shared Fortran record writer lives in the hybrid package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hybrid.opacity_io import SourceTable, fortran_list_int, fortran_list_real, write_opacity_file  # noqa: E402
+
+# Value of cells not covered by the OP data (as initialised in read_op.F90)
+NO_DATA = -100.0
+# OP temperature index i stands for log T = DTMP_OP * i
+DTMP_OP = 0.025
+
+_libm_log10 = np.frompyfunc(math.log10, 1, 1)
+
+
+class OPTemperature(NamedTuple):
+    """Tabulated densities and log10 means at one OP temperature."""
+
+    log_t: float
+    rho: np.ndarray  # log10 rho as tabulated
+    log_pla: np.ndarray
+    log_ros: np.ndarray
+
+
+def log10(x: np.ndarray) -> np.ndarray:
+    """log10 evaluated with the C library, as gfortran does (NumPy's SIMD log10 can differ in the last bit)."""
+    return _libm_log10(np.asarray(x, dtype=np.float64)).astype(np.float64)
+
+
+def parse_mix(path: Path) -> Tuple[str, List[OPTemperature]]:
+    """Parse an OP mixture file (e.g. mixv.gs98) in bulk.
+
+    Returns the heading line and one OPTemperature per temperature block.
+    """
+    text = path.read_text()
+    head, _, body = text.partition("\n")
+    v = np.array(body.split(), dtype=np.float64)
+    nel, ite1, ite2, ite3 = (int(x) for x in v[:4])
+    pos = 4 + 2 * nel
+    blocks = []
+    for i in range(ite1, ite2 + 1, ite3):
+        ite, jne1, jne2, jne3 = (int(x) for x in v[pos : pos + 4])
+        if ite != i:
+            raise ValueError(f"{path}: expected temperature index {i}, found {ite}")
+        n = len(range(jne1, jne2 + 1, jne3))
+        rows = v[pos + 4 : pos + 4 + 4 * n]
+        if rows.size != 4 * n:
+            raise ValueError(f"{path}: truncated block at temperature index {i}")
+        rows = rows.reshape(n, 4)
+        pos += 4 + 4 * n
+        blocks.append(OPTemperature(DTMP_OP * i, rows[:, 1].copy(), rows[:, 2].copy(), rows[:, 3].copy()))
+    # log-transform all blocks at once
+    sizes = np.cumsum([0] + [b.rho.size for b in blocks])
+    logs = log10(np.concatenate([np.concatenate([b.log_pla, b.log_ros]) for b in blocks]))
+    out = []
+    for k, b in enumerate(blocks):
+        seg = logs[2 * sizes[k] : 2 * sizes[k + 1]]
+        out.append(b._replace(log_pla=seg[: b.rho.size], log_ros=seg[b.rho.size :]))
+    return head, out
+
+
+def interpolate_rows(blocks: List[OPTemperature], rho: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Interpolate each temperature's log means linearly in log rho onto ``rho``.
+
+    Densities outside the tabulated range take the end values, as in read_op.F90.
+    Returns (pla, ros) of shape (len(blocks), len(rho)).
+    """
+    pla = np.empty((len(blocks), rho.size))
+    ros = np.empty((len(blocks), rho.size))
+    for k, b in enumerate(blocks):
+        r = b.rho
+        # index of the first tabulated density above rho (the exit of the scan loop),
+        # or the last one when none is above
+        jc = np.minimum(np.searchsorted(r, rho, side="right"), r.size - 1)
+        jc = np.maximum(jc, 1)
+        r0 = r[jc - 1]
+        r1 = r[jc]
+        below = rho < r[0]
+        above = rho > r[-1]
+        for src, dst in ((b.log_pla, pla), (b.log_ros, ros)):
+            val = ((rho - r0) * src[jc] + (r1 - rho) * src[jc - 1]) / (r1 - r0)
+            val[below] = src[0]
+            val[above] = src[-1]
+            dst[k] = val
+    return pla, ros
+
+
+def target_grid(
+    tmp_min: float = 0.5, tmp_max: float = 8.0, dtmp: float = 0.05,
+    rho_min: float = -22.0, rho_max: float = 8.0, nrho: int = 256,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """log T and log rho axes of the output tables, computed as in read_op.F90."""
+    drho = (rho_max - rho_min) / (nrho - 1)
+    rho = rho_min + drho * np.arange(nrho, dtype=np.float64)
+    nt = int((tmp_max - tmp_min) / dtmp) + 1
+    tmp = tmp_min + dtmp * np.arange(nt, dtype=np.float64)
+    return tmp, rho
+
+
+def ingest(
+    mix_path: Path, out_dir: Path, tmp: np.ndarray, rho: np.ndarray
+) -> Tuple[SourceTable, SourceTable]:
+    """Build op_ros.data, op_pla.data and border.data in ``out_dir`` from one mixture file."""
+    _, blocks = parse_mix(mix_path)
+    dtmp = tmp[1] - tmp[0]
+    log_t = np.array([b.log_t for b in blocks])
+    rows = np.rint((log_t - tmp[0]) / dtmp).astype(int)
+    if np.any(np.abs(tmp[0] + dtmp * rows - log_t) > 1e-6 * dtmp) or rows.min() < 0 or rows.max() >= tmp.size:
+        raise ValueError(f"{mix_path}: OP temperatures are not on the target log T grid")
+    pla, ros = interpolate_rows(blocks, rho)
+    opa_pla = np.full((tmp.size, rho.size), NO_DATA)
+    opa_ros = np.full((tmp.size, rho.size), NO_DATA)
+    opa_pla[rows] = pla
+    opa_ros[rows] = ros
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with (out_dir / "border.data").open("w") as f:
+        f.write(fortran_list_int(len(blocks)) + "\n")
+        for b in blocks:
+            f.write(fortran_list_real(b.log_t) + fortran_list_real(b.rho[0]) + fortran_list_real(b.rho[-1]) + "\n")
+    table_ros = SourceTable(tmp, rho, opa_ros)
+    table_pla = SourceTable(tmp, rho, opa_pla)
+    write_opacity_file(out_dir / "op_ros.data", table_ros)
+    write_opacity_file(out_dir / "op_pla.data", table_pla)
+    return table_ros, table_pla
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert OP mixture files to op_ros.data/op_pla.data/border.data.")
+    parser.add_argument("mix", nargs="*", default=["mixv.gs98"], help="OP mixture files (default: mixv.gs98)")
+    parser.add_argument("--out-dir", default=".", help="Output directory")
+    parser.add_argument("--tmp-min", type=float, default=0.5, help="log10 T of the first table row")
+    parser.add_argument("--tmp-max", type=float, default=8.0, help="log10 T of the last table row")
+    parser.add_argument("--dtmp", type=float, default=0.05, help="log10 T step (OP temperatures must lie on it)")
+    parser.add_argument("--rho-min", type=float, default=-22.0, help="log10 rho of the first column")
+    parser.add_argument("--rho-max", type=float, default=8.0, help="log10 rho of the last column")
+    parser.add_argument("--nrho", type=int, default=256, help="Number of density points")
+    args = parser.parse_args(argv)
+
+    tmp, rho = target_grid(args.tmp_min, args.tmp_max, args.dtmp, args.rho_min, args.rho_max, args.nrho)
+    out_dir = Path(args.out_dir)
+    for name in args.mix:
+        mix_path = Path(name)
+        dest = out_dir / mix_path.stem if len(args.mix) > 1 else out_dir
+        t0 = time.perf_counter()
+        try:
+            ingest(mix_path, dest, tmp, rho)
+        except ValueError as exc:
+            print(f"ERROR: {exc}")
+            return 1
+        print(f"{mix_path} -> {dest}: {tmp.size}x{rho.size} ({(time.perf_counter() - t0) * 1e3:.1f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
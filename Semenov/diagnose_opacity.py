@@ -1,69 +1,40 @@
 #!/usr/bin/env python3
-import struct
-import numpy as np
+import argparse
+import os
+import sys
 
+# Shared Fortran record reader and diagnostics engine live in the hybrid package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hybrid.diagnostics import Region, diagnose, open_table  # noqa: E402
 
-def _read_record_be_f77(f, marker_bytes=4):
-    marker_fmt = ">i" if marker_bytes == 4 else ">q"
-    header = f.read(marker_bytes)
-    if len(header) != marker_bytes:
-        raise EOFError("Unexpected EOF while reading record header.")
-    (nbytes,) = struct.unpack(marker_fmt, header)
-    payload = f.read(nbytes)
-    if len(payload) != nbytes:
-        raise EOFError("Unexpected EOF while reading record payload.")
-    trailer = f.read(marker_bytes)
-    if len(trailer) != marker_bytes:
-        raise EOFError("Unexpected EOF while reading record trailer.")
-    (nbytes2,) = struct.unpack(marker_fmt, trailer)
-    if nbytes2 != nbytes:
-        raise ValueError("Record length mismatch")
-    return payload
 
-
-def read_opacity_file(path, marker_bytes=4):
-    with open(path, "rb") as f:
-        rec = _read_record_be_f77(f, marker_bytes)
-        ints = np.frombuffer(rec, dtype=">i4")
-        nt, nd = int(ints[0]), int(ints[1])
-        rec2 = _read_record_be_f77(f, marker_bytes)
-        need = nt + nd + nt * nd
-        arr = np.frombuffer(rec2, dtype=">f8", count=need)
-        t = arr[:nt].astype(float)
-        d = arr[nt : nt + nd].astype(float)
-        data = arr[nt + nd :].astype(float).reshape((nt, nd), order="F")
-        return t, d, data
-
-
-def stats(name, t, data, t_thresh=3.0, vmin=-6.0):
-    mask = t >= t_thresh
-    sub = data[mask, :]
-    nan_count = np.isnan(sub).sum()
-    total = sub.size
-    finite = np.isfinite(sub)
-    finite_count = finite.sum()
-    if finite_count:
-        minv = np.nanmin(sub)
-        maxv = np.nanmax(sub)
-        under_count = np.sum(sub < vmin)
-    else:
-        minv = maxv = np.nan
-        under_count = 0
+def stats(name, table, t_thresh=3.0, vmin=-6.0):
+    report = diagnose(table, [Region("hot", tmin=t_thresh)], vmin=vmin)
+    r = report["regions"]["hot"]
+    minv = r["min"] if r["min"] is not None else float("nan")
+    maxv = r["max"] if r["max"] is not None else float("nan")
     print(f"[{name}] T>=10^{t_thresh} K region:")
-    print(f"  size={total}, NaN={nan_count}, finite={finite_count}")
+    print(f"  size={r['size']}, NaN={r['nan']}, finite={r['finite']}")
     print(f"  min={minv:.3g}, max={maxv:.3g}")
-    print(f"  values < vmin({vmin}) count={under_count}")
+    print(f"  values < vmin({vmin}) count={r['below_vmin']}")
 
 
-def main():
-    t, d, ros = read_opacity_file("semenov_ros.data")
-    t2, d2, pla = read_opacity_file("semenov_pla.data")
-    print(f"t range (log10 K): {t.min():.3f} .. {t.max():.3f}")
-    print(f"d range (log10 g/cc): {d.min():.3f} .. {d.max():.3f}")
-    stats("ROS", t, ros)
-    stats("PLA", t2, pla)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quick check of the Semenov tables above a temperature.")
+    parser.add_argument("--ros", default="semenov_ros.data", help="Rosseland-mean data file")
+    parser.add_argument("--pla", default="semenov_pla.data", help="Planck-mean data file")
+    parser.add_argument("--t-thresh", type=float, default=3.0, help="Region is log T >= this")
+    parser.add_argument("--vmin", type=float, default=-6.0, help="Count values below this")
+    args = parser.parse_args(argv)
+
+    ros = open_table(args.ros)
+    pla = open_table(args.pla)
+    print(f"t range (log10 K): {ros.t.min():.3f} .. {ros.t.max():.3f}")
+    print(f"d range (log10 g/cc): {ros.d.min():.3f} .. {ros.d.max():.3f}")
+    stats("ROS", ros, args.t_thresh, args.vmin)
+    stats("PLA", pla, args.t_thresh, args.vmin)
+    print(f"(full JSON report: python3 ../hybrid/diagnostics.py {args.ros} {args.pla})")
 
 
 if __name__ == "__main__":
     main()
-
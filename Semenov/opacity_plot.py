@@ -15,76 +15,18 @@ Notes:
   - Assumes 4-byte record markers (classic F77). If your files were written
     with 8-byte markers, run with --marker-bytes 8
   - Values are assumed to already be log10-scaled, matching opacity.pro
+  - Tables are memory-mapped via ../hybrid/opacity_io.py (no payload copies)
+  - Matplotlib is imported only after the tables have been read
 """
 
 import os
-import struct
+import sys
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-
-
-def _read_record_be_f77(f, marker_bytes=4):
-    """Read one Fortran unformatted record (big-endian) and return its payload.
-
-    Parameters
-    ----------
-    f : file-like
-        Opened binary file handle.
-    marker_bytes : int
-        Size of the record marker in bytes (4 or 8).
-
-    Returns
-    -------
-    bytes
-        Raw payload bytes of the record.
-    """
-    marker_fmt = ">i" if marker_bytes == 4 else ">q"
-    header = f.read(marker_bytes)
-    if len(header) != marker_bytes:
-        raise EOFError("Unexpected EOF while reading record header.")
-    (nbytes,) = struct.unpack(marker_fmt, header)
-    payload = f.read(nbytes)
-    if len(payload) != nbytes:
-        raise EOFError("Unexpected EOF while reading record payload.")
-    trailer = f.read(marker_bytes)
-    if len(trailer) != marker_bytes:
-        raise EOFError("Unexpected EOF while reading record trailer.")
-    (nbytes2,) = struct.unpack(marker_fmt, trailer)
-    if nbytes2 != nbytes:
-        raise ValueError(f"Record length mismatch: {nbytes} vs {nbytes2}")
-    return payload
-
-
-def read_opacity_file(path, marker_bytes=4):
-    """Read Semenov opacity Fortran binary (big-endian).
-
-    Returns
-    -------
-    t : ndarray shape (nt,)
-    d : ndarray shape (nd,)
-    data : ndarray shape (nt, nd)
-    """
-    with open(path, "rb") as f:
-        # First record: nt, nd (int32 big-endian)
-        rec = _read_record_be_f77(f, marker_bytes=marker_bytes)
-        ints = np.frombuffer(rec, dtype=">i4")
-        if ints.size < 2:
-            raise ValueError("First record must contain nt and nd.")
-        nt, nd = int(ints[0]), int(ints[1])
-
-        # Second record: t(nt), d(nd), data(nt*nd) as float64 big-endian
-        rec2 = _read_record_be_f77(f, marker_bytes=marker_bytes)
-        need = nt + nd + nt * nd
-        arr = np.frombuffer(rec2, dtype=">f8", count=need)
-        if arr.size != need:
-            raise ValueError(
-                f"Second record size mismatch: expected {need}, got {arr.size}"
-            )
-        t = np.array(arr[:nt], dtype=np.float64)
-        d = np.array(arr[nt : nt + nd], dtype=np.float64)
-        data = np.array(arr[nt + nd :], dtype=np.float64).reshape((nt, nd), order="F")
-        return t, d, data
+
+# Shared Fortran record reader lives in the hybrid package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hybrid.opacity_io import read_opacity_file  # noqa: E402
 
 
 def plot_panel(ax, t, d, data, title, vmin=-6.0, vmax=7.0, cmap="turbo"):
@@ -111,12 +53,12 @@ def plot_panel(ax, t, d, data, title, vmin=-6.0, vmax=7.0, cmap="turbo"):
     ax.set_xlabel("log (T / K)")
     ax.set_ylabel(r"log ($\rho$ / g cm$^{-3}$)")
     ax.set_title(title)
-    cbar = plt.colorbar(im, ax=ax)
+    cbar = ax.figure.colorbar(im, ax=ax)
     cbar.set_label(title)
     return im
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Plot Semenov opacity (Python port of opacity.pro)."
     )
@@ -135,7 +77,7 @@ def main():
         choices=(4, 8),
         help="Fortran record marker size in bytes (4 or 8).",
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if not os.path.exists(args.ros):
         raise FileNotFoundError(f"Not found: {args.ros}")
@@ -152,6 +94,8 @@ def main():
             "Warning: t/d grids differ between ROS and PLA; using ROS grid for extent."
         )
 
+    import matplotlib.pyplot as plt
+
     # Make figure similar to IDL layout
     fig, axes = plt.subplots(1, 2, figsize=(10, 4), constrained_layout=True)
 
@@ -0,0 +1,9 @@
+"""
+Hybrid Semenov/Ferguson/OP opacity tables (Hirose et al. 2014) and tools.
+
+The modules of this directory form one package: installed with
+``pip install .`` it is ``optab14`` (``python3 -m optab14.build_hybrid``,
+the ``optab`` command), and in a checkout the scripts also run directly
+(``python3 build_hybrid.py``) or as ``python3 -m hybrid.build_hybrid`` from
+the repository root.
+"""
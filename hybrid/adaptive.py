@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Adaptive quadtree version of a hybrid table, refined only where needed.
+
+Starting from square root cells of 2^depth x 2^depth grid steps, a cell is
+split into four while its error estimate exceeds the tolerance. The estimate
+is exact on the uniform grid: the largest difference, over every uniform node
+inside the cell, between the table value and the bilinear interpolation of
+the cell's four corners (log kappa_R and log kappa_P against --tol, the dust
+flag against --dust-tol). Cells of one grid step are never split, so the
+finest level reproduces the uniform table; smooth regions stay coarse while
+the sublimation front, the Ferguson/OP blend and the OP border edges are
+refined.
+
+The leaves form a linear quadtree: each is stored by the Morton (Z-order)
+code of its first uniform cell and its size exponent, sorted by code, with
+four indices into a shared array of corner nodes. A lookup computes the code
+of the uniform cell holding each point and finds its leaf with one
+searchsorted, then interpolates bilinearly; every step is vectorized.
+
+Usage:
+  python3 adaptive.py build [--root .] [--tol 1e-3] [--depth 6] [--out adaptive.npz]
+  python3 adaptive.py build --from-sources --input input.dat --tol 1e-2
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 adaptive.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import read_hybrid_table, source_dir
+from .opacity_lookup import OpacityTable, OpacityValues
+
+FORMAT_VERSION = 1
+# max values per error-estimate chunk (bounds the build's scratch memory)
+CHUNK_VALUES = 1 << 22
+
+
+def _spread(x: np.ndarray) -> np.ndarray:
+    """Insert a zero bit between the low 16 bits of ``x``."""
+    x = x.astype(np.int64) & 0xFFFF
+    x = (x | (x << 8)) & 0x00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F
+    x = (x | (x << 2)) & 0x33333333
+    return (x | (x << 1)) & 0x55555555
+
+
+def _compact(x: np.ndarray) -> np.ndarray:
+    """Inverse of _spread."""
+    x = x & 0x55555555
+    x = (x | (x >> 1)) & 0x33333333
+    x = (x | (x >> 2)) & 0x0F0F0F0F
+    x = (x | (x >> 4)) & 0x00FF00FF
+    return (x | (x >> 8)) & 0xFFFF
+
+
+def morton(i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """Z-order code of local cell (i, j); i (log T) takes the odd bits."""
+    return (_spread(i) << 1) | _spread(j)
+
+
+class AdaptiveGrid(NamedTuple):
+    """Linear quadtree of a table on the uniform grid (ltmin + dlt * i, lrmin + dlr * j)."""
+
+    ltmin: float
+    dlt: float
+    nitt: int
+    lrmin: float
+    dlr: float
+    nidd: int
+    depth: int
+    nroot: Tuple[int, int]
+    start: np.ndarray  # int64 Morton code of each leaf's first cell (root index * 4**depth + local code)
+    level: np.ndarray  # uint8 size exponent: the leaf spans 2**level grid steps per axis
+    corners: np.ndarray  # int32 (nleaf, 4) node indices: (i0, j0), (i0, j1), (i1, j0), (i1, j1)
+    node_kr: np.ndarray
+    node_kp: np.ndarray
+    node_dust: np.ndarray  # uint8
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.start, self.level, self.corners, self.node_kr, self.node_kp, self.node_dust))
+
+
+def _pad(values: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Edge-replicate ``values`` up to ``shape`` nodes."""
+    n, m = values.shape
+    return np.pad(values, ((0, shape[0] - n), (0, shape[1] - m)), mode="edge")
+
+
+def cell_errors(
+    fields, nreal: Tuple[int, int], i0: np.ndarray, j0: np.ndarray, size: int
+) -> np.ndarray:
+    """Max |bilinear(corners) - value| over the nodes of each cell, per field: shape (nfield, ncell).
+
+    Nodes outside the real grid (padding) do not count; a NaN on one side only counts as infinite.
+    """
+    ar = np.arange(size + 1)
+    u = (ar / size)[None, :, None]
+    v = (ar / size)[None, None, :]
+    out = np.empty((len(fields), i0.size))
+    step = max(1, CHUNK_VALUES // (size + 1) ** 2)
+    for c0 in range(0, i0.size, step):
+        rows = i0[c0 : c0 + step, None] + ar
+        cols = j0[c0 : c0 + step, None] + ar
+        real = (rows < nreal[0])[:, :, None] & (cols < nreal[1])[:, None, :]
+        for k, values in enumerate(fields):
+            blk = values[rows[:, :, None], cols[:, None, :]]
+            c00, c01 = blk[:, :1, :1], blk[:, :1, -1:]
+            c10, c11 = blk[:, -1:, :1], blk[:, -1:, -1:]
+            with np.errstate(invalid="ignore"):
+                pred = (c00 * (1 - v) + c01 * v) * (1 - u) + (c10 * (1 - v) + c11 * v) * u
+                err = np.abs(pred - blk)
+            nan_p, nan_b = np.isnan(pred), np.isnan(blk)
+            err = np.where(nan_p | nan_b, np.where(nan_p & nan_b, 0.0, np.inf), err)
+            err[~real] = 0.0
+            out[k, c0 : c0 + step] = err.reshape(err.shape[0], -1).max(axis=1)
+    return out
+
+
+def build_adaptive(
+    ltmin: float,
+    dlt: float,
+    lrmin: float,
+    dlr: float,
+    log_kr: np.ndarray,
+    log_kp: np.ndarray,
+    dust: np.ndarray,
+    tol: float = 1e-3,
+    dust_tol: float = 0.49,
+    depth: int = 6,
+) -> AdaptiveGrid:
+    """Refine root cells of 2**depth grid steps until every leaf meets the tolerances."""
+    if not 0 <= depth <= 15:
+        raise ValueError("depth must be between 0 and 15")
+    nitt, nidd = log_kr.shape
+    s_root = 1 << depth
+    nroot = (-(-(nitt - 1) // s_root), -(-(nidd - 1) // s_root))
+    padded = (nroot[0] * s_root + 1, nroot[1] * s_root + 1)
+    fields = [_pad(np.asarray(a, dtype=np.float64), padded) for a in (log_kr, log_kp, dust)]
+
+    a, b = np.meshgrid(np.arange(nroot[0]), np.arange(nroot[1]), indexing="ij")
+    i0 = (a.reshape(-1) * s_root).astype(np.int64)
+    j0 = (b.reshape(-1) * s_root).astype(np.int64)
+    leaves_i, leaves_j, leaves_e = [], [], []
+    for e in range(depth, -1, -1):
+        size = 1 << e
+        if e == 0:
+            split = np.zeros(i0.size, dtype=bool)
+        else:
+            err = cell_errors(fields, (nitt, nidd), i0, j0, size)
+            split = (np.maximum(err[0], err[1]) > tol) | (err[2] > dust_tol)
+        leaves_i.append(i0[~split])
+        leaves_j.append(j0[~split])
+        leaves_e.append(np.full(int((~split).sum()), e, dtype=np.uint8))
+        h = size >> 1
+        i0, j0 = i0[split], j0[split]
+        i0 = np.concatenate([i0, i0, i0 + h, i0 + h])
+        j0 = np.concatenate([j0, j0 + h, j0, j0 + h])
+        if not i0.size:
+            break
+    li = np.concatenate(leaves_i)
+    lj = np.concatenate(leaves_j)
+    level = np.concatenate(leaves_e)
+
+    root = (li // s_root) * nroot[1] + lj // s_root
+    start = root * (1 << (2 * depth)) + morton(li % s_root, lj % s_root)
+    order = np.argsort(start, kind="stable")
+    start, level, li, lj = start[order], level[order], li[order], lj[order]
+
+    size = (1 << level.astype(np.int64))
+    ci = np.stack([li, li, li + size, li + size], axis=1)
+    cj = np.stack([lj, lj + size, lj, lj + size], axis=1)
+    keys, corners = np.unique(ci * padded[1] + cj, return_inverse=True)
+    ni, nj = keys // padded[1], keys % padded[1]
+    return AdaptiveGrid(
+        float(ltmin), float(dlt), nitt, float(lrmin), float(dlr), nidd, depth, nroot,
+        start.astype(np.int64), level, corners.reshape(-1, 4).astype(np.int32),
+        fields[0][ni, nj], fields[1][ni, nj], fields[2][ni, nj].astype(np.uint8),
+    )
+
+
+class AdaptiveTable:
+    """Vectorized point lookup in an AdaptiveGrid."""
+
+    def __init__(self, grid: AdaptiveGrid):
+        self.grid = grid
+
+    @classmethod
+    def load(cls, path: Path) -> "AdaptiveTable":
+        with np.load(path) as z:
+            if int(z["format_version"]) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported adaptive table version {int(z['format_version'])}")
+            g = z["grid"]
+            ints = z["dims"]
+            grid = AdaptiveGrid(
+                float(g[0]), float(g[1]), int(ints[0]), float(g[2]), float(g[3]), int(ints[1]),
+                int(ints[2]), (int(ints[3]), int(ints[4])),
+                z["start"], z["level"], z["corners"], z["node_kr"], z["node_kp"], z["node_dust"],
+            )
+        return cls(grid)
+
+    def save(self, path: Path) -> None:
+        g = self.grid
+        np.savez(
+            path,
+            format_version=FORMAT_VERSION,
+            grid=np.array([g.ltmin, g.dlt, g.lrmin, g.dlr]),
+            dims=np.array([g.nitt, g.nidd, g.depth, g.nroot[0], g.nroot[1]], dtype=np.int64),
+            start=g.start, level=g.level, corners=g.corners,
+            node_kr=g.node_kr, node_kp=g.node_kp, node_dust=g.node_dust,
+        )
+
+    def locate(self, log_t, log_rho):
+        """Leaf index, in-leaf weights (u along log T, v along log rho) and the outside mask."""
+        g = self.grid
+        ft = (np.asarray(log_t, dtype=np.float64) - g.ltmin) / g.dlt
+        fr = (np.asarray(log_rho, dtype=np.float64) - g.lrmin) / g.dlr
+        ft, fr = np.broadcast_arrays(ft, fr)
+        outside = ~((ft >= 0) & (ft <= g.nitt - 1) & (fr >= 0) & (fr <= g.nidd - 1))
+        ft = np.clip(np.nan_to_num(ft), 0, g.nitt - 1)
+        fr = np.clip(np.nan_to_num(fr), 0, g.nidd - 1)
+        it = np.minimum(ft.astype(np.int64), g.nitt - 2)
+        ir = np.minimum(fr.astype(np.int64), g.nidd - 2)
+        s_root = 1 << g.depth
+        code = ((it // s_root) * g.nroot[1] + ir // s_root) * (1 << (2 * g.depth)) + morton(it % s_root, ir % s_root)
+        leaf = np.searchsorted(g.start, code, side="right") - 1
+        # leaf origin from its start code
+        local = g.start[leaf] & ((1 << (2 * g.depth)) - 1)
+        root = g.start[leaf] >> (2 * g.depth)
+        i0 = (root // g.nroot[1]) * s_root + _compact(local >> 1)
+        j0 = (root % g.nroot[1]) * s_root + _compact(local)
+        size = (1 << g.level[leaf].astype(np.int64)).astype(np.float64)
+        return leaf, (ft - i0) / size, (fr - j0) / size, outside
+
+    def lookup_all(self, log_t, log_rho, outside=None) -> OpacityValues:
+        """log10 kappa_R, kappa_P and the dust flag at (log T, log rho), as OpacityTable.lookup_all."""
+        leaf, u, v, out = self.locate(log_t, log_rho)
+        c = self.grid.corners[leaf]
+        w = ((1 - u) * (1 - v), (1 - u) * v, u * (1 - v), u * v)
+        res = []
+        for nodes in (self.grid.node_kr, self.grid.node_kp, self.grid.node_dust):
+            res.append(sum(wk * nodes[c[..., k]] for k, wk in enumerate(w)))
+        if outside is not None:
+            outside[...] = out
+        return OpacityValues(*res)
+
+
+def error_report(ref: OpacityTable, table: AdaptiveTable) -> dict:
+    """Max |adaptive - uniform| of log kappa at the uniform nodes and at the uniform cell centers."""
+    report = {}
+    for name, (di, dj) in (("nodes", (0.0, 0.0)), ("centers", (0.5, 0.5))):
+        n = ref.nitt - (1 if di else 0)
+        m = ref.nidd - (1 if dj else 0)
+        lt = ref.ltmin + ref.dlt * (np.arange(n) + di)
+        lr = ref.lrmin + ref.dlr * (np.arange(m) + dj)
+        lt, lr = np.meshgrid(lt, lr, indexing="ij")
+        a = table.lookup_all(lt, lr)
+        b = ref.lookup_all(lt, lr)
+        entry = {}
+        for key, x, y in (("kR", a.log_kr, b.log_kr), ("kP", a.log_kp, b.log_kp), ("dust", a.dust, b.dust)):
+            d = np.abs(x - y)
+            entry[key] = float(np.nanmax(d)) if np.isfinite(d).any() else 0.0
+        report[name] = entry
+    return report
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Adaptive quadtree hybrid table.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Build an adaptive table and report its size and error")
+    b.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat, input.dat")
+    b.add_argument("--input", default=None, help="input.dat (default: <root>/input.dat)")
+    b.add_argument("--from-sources", action="store_true", help="Build the uniform table from the source tables first")
+    b.add_argument("--semenov-dir", default=str(source_dir("Semenov")))
+    b.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")))
+    b.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")))
+    b.add_argument("--tol", type=float, default=1e-3, help="Max log kappa error at the uniform nodes (dex)")
+    b.add_argument("--dust-tol", type=float, default=0.49, help="Max dust-flag interpolation error")
+    b.add_argument("--depth", type=int, default=6, help="Root cells span 2**depth grid steps")
+    b.add_argument("--out", default="adaptive.npz", help="Output file")
+    args = parser.parse_args(argv)
+
+    root = Path(args.root)
+    input_path = Path(args.input) if args.input else root / "input.dat"
+    t0 = time.perf_counter()
+    if args.from_sources:
+        from .build_hybrid import build_hybrid, read_sources, read_use_dust
+        from .opacity_io import read_input_dat
+
+        sources = read_sources(Path(args.semenov_dir), Path(args.ferguson_dir), Path(args.op_dir))
+        tmp, rho, log_kr, log_kp, dust = build_hybrid(input_path, sources, read_use_dust(input_path.parent))
+        nitt, nidd, ltmin, _, dlt, lrmin, _, dlr = read_input_dat(input_path)
+        ref = OpacityTable(ltmin, dlt, lrmin, dlr, log_kr, log_kp, dust)
+    else:
+        t = read_hybrid_table(root, input_path)
+        ref = OpacityTable(t.ltmin, t.dlt, t.lrmin, t.dlr, t.log_kr, t.log_kp, t.dust)
+    grid = build_adaptive(ref.ltmin, ref.dlt, ref.lrmin, ref.dlr, ref.log_kr, ref.log_kp, ref.dust,
+                          args.tol, args.dust_tol, args.depth)
+    table = AdaptiveTable(grid)
+    table.save(Path(args.out))
+    seconds = time.perf_counter() - t0
+    uniform = ref.log_kr.nbytes + ref.log_kp.nbytes + ref.nitt * ref.nidd  # two float64 tables + 1-byte dust
+    counts = np.bincount(grid.level, minlength=grid.depth + 1)
+    print(f"Wrote {args.out}: {grid.level.size} leaves, {grid.node_kr.size} nodes, "
+          f"{grid.nbytes / 2**20:.2f} MiB ({uniform / grid.nbytes:.1f}x smaller than the uniform "
+          f"{ref.nitt}x{ref.nidd} grid, {seconds:.2f} s)")
+    print("  leaves per size: " + ", ".join(f"{1 << e}:{n}" for e, n in enumerate(counts) if n))
+    rep = error_report(ref, table)
+    for name, entry in rep.items():
+        print(f"  max error at uniform {name}: " + ", ".join(f"{k} {v:.2e}" for k, v in entry.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of table I/O, build, lookup, diagnostics and rendering.
+
+Synthetic source tables with the layout and axis ranges of semenov_*.data,
+ferguson_*.data and op_*.data (analytic log kappa, the -37.93 Semenov floor
+above a sublimation temperature and -100 outside the gas tables' domains)
+are written at each ``--scales`` factor: the source point counts and the
+hybrid grid (input.dat 2 6 0.01 -22 0 0.04 at scale 1) are both multiplied
+by it. The stages are then timed on them:
+
+- read_sources: Fortran record scan and native copy of the six tables
+- build: build_hybrid (interpolation and blend), output cells/s
+- write: pow10 and kR.dat/kP.dat/dust.dat (no text table)
+- read_hybrid: kR/kP/dust.dat read and log10
+- lookup: OpacityTable.lookup_all on --points random points, lookups/s
+- sublimation: sublimation_line on the dust flag
+- diagnostics: diagnose() over kR.dat
+- render: hybrid map PNG via render.py (skipped without Matplotlib)
+
+Each stage reports the best of --repeat timings (a timing loops the stage
+until it has run for at least --min-time seconds), its throughput and the
+peak of memory allocated during one separate call (tracemalloc; numpy
+buffers included, memory maps not). The table cache is disabled and reads
+hit the page cache. Nothing is downloaded. A run with a subset of --stages
+or --scales updates those entries of an existing --out file and keeps the
+rest; --baseline is read before anything is written and must be another file.
+
+Usage:
+  python3 bench.py --scales 1 2 4 --out bench.json
+  python3 bench.py --baseline bench_baseline.json --fail-on-regression
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 bench.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import SourceTable, write_opacity_file
+
+# (file stem, points along log T and log rho at scale 1, log T range, log rho range) of the real tables
+SOURCE_SHAPES = {
+    "semenov": ((512, 512), (0.47712125471966244, 6.477121254719663), (-22.0, 0.0)),
+    "ferguson": ((241, 221), (0.5, 6.5), (-22.0, 0.0)),
+    "op": ((151, 256), (0.5, 8.0), (-22.0, 8.0)),
+}
+SOURCE_DIRS = {"semenov": "Semenov", "ferguson": "Ferguson", "op": "OPCD_3.3"}
+GRID = (2.0, 6.0, 0.01, -22.0, 0.0, 0.04)
+STAGES = ("read_sources", "build", "write", "read_hybrid", "lookup", "sublimation", "diagnostics", "render")
+SEMENOV_FLOOR = -37.92977945366163
+OUT_OF_RANGE = -100.0
+
+
+def _axes(name: str, scale: float):
+    (nt, nd), (t0, t1), (d0, d1) = SOURCE_SHAPES[name]
+    nt, nd = (max(2, int(round((n - 1) * scale)) + 1) for n in (nt, nd))
+    return np.linspace(t0, t1, nt), np.linspace(d0, d1, nd)
+
+
+def synthetic_source(name: str, scale: float, planck: bool = False) -> SourceTable:
+    """Analytic stand-in for one source table (log10 kappa on its native axes)."""
+    t, d = _axes(name, scale)
+    lt, lr = np.meshgrid(t, d, indexing="ij")
+    shift = 0.3 if planck else 0.0
+    if name == "semenov":
+        t_sub = 3.2 + 0.04 * (lr + 10.0)
+        data = np.where(lt < t_sub, 0.5 + 0.8 * lt - 0.1 * lt**2 + 0.02 * lr + shift, SEMENOV_FLOOR)
+    elif name == "ferguson":
+        data = -3.0 + 2.5 * (lt - 2.5) - 0.3 * (lt - 3.5) ** 2 + 0.3 * (lr + 8.0) + shift
+        data = np.where(lr <= -1.0 + 2.0 * (lt - 3.0), data, OUT_OF_RANGE)
+    else:
+        data = 4.0 - 2.0 * (lt - 4.5) + 0.6 * (lr + 6.0) + 0.2 * np.sin(3.0 * lt) + shift
+        data = np.where(lt >= 3.5, data, OUT_OF_RANGE)
+    return SourceTable(t, d, np.asfortranarray(data))
+
+
+def write_synthetic(root: Path, scale: float) -> Path:
+    """Write the six source tables and an input.dat under ``root``; returns the input.dat path."""
+    for name, sub in SOURCE_DIRS.items():
+        (root / sub).mkdir(parents=True, exist_ok=True)
+        for kind, planck in (("ros", False), ("pla", True)):
+            write_opacity_file(root / sub / f"{name}_{kind}.data", synthetic_source(name, scale, planck))
+    table = root / "table"
+    table.mkdir(exist_ok=True)
+    ltmin, ltmax, dlt, lrmin, lrmax, dlr = GRID
+    (table / "input.dat").write_text(f"{ltmin} {ltmax} {dlt / scale:.10g} {lrmin} {lrmax} {dlr / scale:.10g}\n")
+    return table / "input.dat"
+
+
+def time_stage(fn: Callable[[], object], repeat: int, min_time: float) -> float:
+    """Best seconds per call over ``repeat`` timings of at least ``min_time`` each."""
+    best = float("inf")
+    for _ in range(repeat):
+        n = 0
+        t0 = time.perf_counter()
+        while True:
+            fn()
+            n += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / n)
+    return best
+
+
+def peak_alloc(fn: Callable[[], object]) -> float:
+    """Peak MiB allocated while running ``fn`` once."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def run_scale(scale: float, work: Path, points: int, repeat: int, min_time: float, stages=STAGES) -> Dict[str, dict]:
+    """Time every stage on synthetic tables at ``scale``."""
+    from .build_hybrid import build_hybrid, read_sources, write_outputs
+    from .contours import sublimation_line
+    from .diagnostics import diagnose, open_table
+    from .opacity_io import read_hybrid_table
+    from .opacity_lookup import OpacityTable
+
+    input_path = write_synthetic(work, scale)
+    table_dir = input_path.parent
+    dirs = [work / SOURCE_DIRS[k] for k in ("semenov", "ferguson", "op")]
+    sources = read_sources(*dirs)
+    tmp, rho, kr, kp, dust = build_hybrid(input_path, sources)
+    write_outputs(table_dir, tmp, rho, kr, kp, dust, text=False)
+    cells = kr.size
+    table = OpacityTable(tmp[0], tmp[1] - tmp[0], rho[0], rho[1] - rho[0], kr, kp, dust)
+    rng = np.random.default_rng(0)
+    lt = rng.uniform(tmp[0], tmp[-1], points)
+    lr = rng.uniform(rho[0], rho[-1], points)
+    out = np.empty((3, points))
+    w = table.workspace(points)
+    source_cells = sum(s.data.size for s in sources)
+    source_bytes = sum(s.data.nbytes for s in sources)
+
+    jobs = {
+        "read_sources": (lambda: read_sources(*dirs), {"cells": source_cells, "bytes": source_bytes}),
+        "build": (lambda: build_hybrid(input_path, sources), {"cells": cells}),
+        "write": (lambda: write_outputs(table_dir, tmp, rho, kr, kp, dust, text=False), {"cells": cells, "bytes": 3 * 8 * cells}),
+        "read_hybrid": (lambda: read_hybrid_table(table_dir), {"cells": cells, "bytes": 3 * 8 * cells}),
+        "lookup": (lambda: table.lookup_all(lt, lr, out=out, work=w), {"lookups": points}),
+        "sublimation": (lambda: sublimation_line(dust, tmp[0], tmp[-1], rho[0], rho[-1]), {"cells": cells}),
+        "diagnostics": (lambda: diagnose(open_table(table_dir / "kR.dat", input_path)), {"cells": cells}),
+    }
+    try:
+        from .render import RenderJob, RenderOptions, render_job
+    except ImportError:
+        render_job = None
+    if render_job is not None:
+        opts = RenderOptions(out_dir=str(work), formats=("png",), dpi=150, op_border="", fe_border="")
+        job = RenderJob("bench", "hybrid", (str(table_dir),))
+        render_job(job, opts)  # creates the reused figure
+        jobs["render"] = (lambda: render_job(job, opts), {"cells": cells})
+
+    results = {"shape": [len(tmp), len(rho)]}
+    for stage in stages:
+        if stage not in jobs:
+            results[stage] = {"skipped": "matplotlib not available"}
+            continue
+        fn, sizes = jobs[stage]
+        sec = time_stage(fn, repeat, min_time)
+        r = {"seconds": sec, "peak_alloc_mib": round(peak_alloc(fn), 2)}
+        for key, n in sizes.items():
+            r[f"{key}_per_s"] = n / sec
+        results[stage] = r
+    return results
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _rate(r: dict) -> Optional[float]:
+    return next((v for k, v in r.items() if k.endswith("_per_s")), None)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[dict]:
+    """Per stage and scale, slowdown against the baseline (ratio of throughputs, so batch sizes may differ).
+
+    ``regression`` is set when the slowdown exceeds ``threshold``.
+    """
+    rows = []
+    for scale, stages in results["scales"].items():
+        base = baseline.get("scales", {}).get(scale, {})
+        for stage, r in stages.items():
+            b = base.get(stage)
+            if not isinstance(r, dict) or not isinstance(b, dict) or not _rate(r) or not _rate(b):
+                continue
+            ratio = _rate(b) / _rate(r)
+            rows.append({"scale": scale, "stage": stage, "seconds": r["seconds"], "baseline": b["seconds"],
+                         "ratio": ratio, "regression": ratio > threshold})
+    return rows
+
+
+def merge_results(path: Path, results: dict) -> dict:
+    """``results`` plus the stages and scales of an existing results file at ``path`` that this run did not time."""
+    if not path.exists():
+        return results
+    merged = json.loads(path.read_text())
+    scales = merged.setdefault("scales", {})
+    for scale, stages in results["scales"].items():
+        scales.setdefault(scale, {}).update(stages)
+    merged.update({k: v for k, v in results.items() if k != "scales"})
+    return merged
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark read/build/lookup/diagnostics/render on synthetic tables.")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 2.0], help="Resolution factors")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--points", type=int, default=1_000_000, help="Random points per lookup batch")
+    parser.add_argument("--repeat", type=int, default=3, help="Timings per stage (best is kept)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timing")
+    parser.add_argument("--work-dir", default=None, help="Keep the synthetic tables here (default: a temporary dir)")
+    parser.add_argument("--out", default="bench.json", help="Results file")
+    parser.add_argument("--baseline", default=None, help="Compare with this results file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+    args = parser.parse_args(argv)
+    out = Path(args.out)
+    baseline = None
+    if args.baseline:
+        if Path(args.baseline).resolve() == out.resolve():
+            parser.error("--out must differ from --baseline (the run would overwrite what it is compared with)")
+        baseline = json.loads(Path(args.baseline).read_text())
+
+    os.environ["OPTAB_CACHE"] = "0"  # time the readers, not the cache
+    results = {"environment": environment(), "points": args.points, "repeat": args.repeat, "scales": {}}
+    with tempfile.TemporaryDirectory(prefix="optab-bench-") as tmp:
+        for scale in args.scales:
+            work = Path(args.work_dir or tmp) / f"scale{scale:g}"
+            work.mkdir(parents=True, exist_ok=True)
+            res = run_scale(scale, work, args.points, args.repeat, args.min_time, args.stages)
+            results["scales"][f"{scale:g}"] = res
+            print(f"scale {scale:g}: table {res['shape'][0]}x{res['shape'][1]}")
+            for stage in args.stages:
+                r = res[stage]
+                if "seconds" not in r:
+                    print(f"  {stage:13s} skipped ({r['skipped']})")
+                    continue
+                rate = ", ".join(f"{r[k]:.3g} {k[:-6]}/s" for k in r if k.endswith("_per_s"))
+                print(f"  {stage:13s} {r['seconds'] * 1e3:10.3f} ms  {rate}  peak {r['peak_alloc_mib']:.1f} MiB")
+    out.write_text(json.dumps(merge_results(out, results), indent=2) + "\n")
+    print(f"Wrote {args.out}")
+
+    if baseline is None:
+        return 0
+    rows = compare(results, baseline, args.threshold)
+    print(f"Compared with {args.baseline} (slowdown in throughput; regression above {args.threshold:g}x)")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"  scale {r['scale']:>4s} {r['stage']:13s} {r['baseline'] * 1e3:10.3f} -> {r['seconds'] * 1e3:10.3f} ms "
+              f"({r['ratio']:.2f}x){flag}")
+    return 1 if args.fail_on_regression and any(r["regression"] for r in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
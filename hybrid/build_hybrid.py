@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Vectorized NumPy port of hybrid.F90.
+
+Builds the hybrid Semenov/Ferguson/OP table on the grid given by input.dat
+with whole-array operations instead of the per-cell loop:
+- blend weights (f1r, f2r, f1p, f2p) are evaluated once per temperature row
+- bracketing source indices are found with one searchsorted per axis
+- each source table is interpolated as a batched bilinear gather
+
+Outputs are byte-for-byte identical to hybrid.F90 (compiled with the Makefile):
+- kR.dat, kP.dat, dust.dat: Fortran unformatted big-endian float64 (nitt x nidd)
+- opacity_table.txt: per-cell text table (skipped with --no-text)
+- temp_fe_op.data: Ferguson/OP transition temperature
+
+With --derivs it also writes d log kappa / d log T and d log kappa / d log rho
+(dlkRdlT.dat, dlkRdlrho.dat, dlkPdlT.dat, dlkPdlrho.dat, same layout), taken
+analytically from the bilinear source interpolation and the blend weights.
+
+Usage:
+  python3 build_hybrid.py [--input input.dat] [--use-dust {0,1}] [--no-text] [--derivs]
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 build_hybrid.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import (
+    DERIV_FILES,
+    SourceTable,
+    fortran_list_real,
+    read_input_dat,
+    read_opacity_file,
+    source_dir,
+    to_native,
+    write_fortran_unformatted_matrix,
+)
+from .tracing import span, traced
+
+# Value returned by opacity() in hybrid.F90 outside a source table's T range
+OUT_OF_RANGE = -100.0
+# TRANSFER(-1_8, 0d0): the NaN bit pattern hybrid.F90 writes for empty cells
+FORTRAN_NAN = np.array(-1, dtype=np.int64).view(np.float64)[()]
+
+
+@dataclass(frozen=True)
+class BlendParams:
+    """Transition temperatures and half-widths (log10 K) used in hybrid.F90.
+
+    ``depletion`` scales the Semenov dust opacity in dusty cells (DEPLETION in
+    hybrid.F90, where it is defined but left at 1). Dust existence is still
+    decided from the undepleted opacity.
+    """
+
+    temp_fe_op: float = 3.7  # Ferguson -> OP
+    tmp_ser: float = 2.0  # Semenov -> Ferguson (Rosseland)
+    tmp_sep: float = 2.0  # Semenov -> Ferguson (Planck)
+    tmp_opr: float = 7.0  # OP -> free-free (Rosseland)
+    tmp_opp: float = 7.0  # OP -> free-free (Planck)
+    tmpdsr: float = 0.01
+    tmpdsp: float = 0.01
+    tmpdfr: float = 0.01
+    tmpdfp: float = 0.01
+    tmpdor: float = 0.02
+    tmpdop: float = 0.02
+    opacity_dust: float = 0.0  # OPACITY_DUST: log kappa above which dust exists
+    tmp_dust: float = 2.7  # TMP_DUST: always dusty below this log T
+    depletion: float = 1.0  # DEPLETION: dust-to-gas scaling of the dust opacity
+
+
+class TableDerivs(NamedTuple):
+    """d log10 kappa / d log10 T and d log10 kappa / d log10 rho of a built table."""
+
+    dkr_dt: np.ndarray
+    dkr_dr: np.ndarray
+    dkp_dt: np.ndarray
+    dkp_dr: np.ndarray
+
+
+class HybridSources(NamedTuple):
+    """The six source tables read by hybrid.F90."""
+
+    ros_se: SourceTable
+    pla_se: SourceTable
+    ros_fe: SourceTable
+    pla_fe: SourceTable
+    ros_op: SourceTable
+    pla_op: SourceTable
+
+
+def read_sources(semenov_dir: Path, ferguson_dir: Path, op_dir: Path) -> HybridSources:
+    """Read the Semenov, Ferguson and OP tables from their directories.
+
+    The build gathers from every part of each table, so the mapped files are
+    copied to native byte order once rather than byte-swapped on every access.
+    """
+    paths = (
+        semenov_dir / "semenov_ros.data",
+        semenov_dir / "semenov_pla.data",
+        ferguson_dir / "ferguson_ros.data",
+        ferguson_dir / "ferguson_pla.data",
+        op_dir / "op_ros.data",
+        op_dir / "op_pla.data",
+    )
+    with span("build.read_sources") as sp:
+        sources = HybridSources(*(to_native(read_opacity_file(p)) for p in paths))
+        sp.nbytes = sum(s.data.nbytes for s in sources)
+    return sources
+
+
+def read_use_dust(root: Path) -> bool:
+    """Read use_dust.in (or its alias use_opacity.in); dust is enabled by default."""
+    for name in ("use_dust.in", "use_opacity.in"):
+        path = root / name
+        if path.exists():
+            tokens = path.read_text().replace(",", " ").split()
+            try:
+                return int(tokens[0]) != 0
+            except (IndexError, ValueError):
+                return True
+    return True
+
+
+def rightup(x, x0: float, d: float):
+    return 0.5 * (1.0 + np.sin(0.5 * np.pi * (x - x0) / d))
+
+
+def rightdown(x, x0: float, d: float):
+    return 0.5 * (1.0 - np.sin(0.5 * np.pi * (x - x0) / d))
+
+
+def d_rightup(x, x0: float, d: float):
+    """d rightup / dx (rightdown has the opposite sign)."""
+    return 0.25 * np.pi / d * np.cos(0.5 * np.pi * (x - x0) / d)
+
+
+def _window(tmp: np.ndarray, lo: float, dlo: float, hi: float, dhi: float) -> np.ndarray:
+    """Weight that ramps up around ``lo`` and down around ``hi`` (f1*/f2* in hybrid.F90)."""
+    return np.select(
+        [tmp < lo - dlo, tmp < lo + dlo, tmp < hi - dhi, tmp < hi + dhi],
+        [0.0, rightup(tmp, lo, dlo), 1.0, rightdown(tmp, hi, dhi)],
+        default=0.0,
+    )
+
+
+def _window_deriv(tmp: np.ndarray, lo: float, dlo: float, hi: float, dhi: float) -> np.ndarray:
+    """d/d log T of _window, taken on the same branches."""
+    return np.select(
+        [tmp < lo - dlo, tmp < lo + dlo, tmp < hi - dhi, tmp < hi + dhi],
+        [0.0, d_rightup(tmp, lo, dlo), 0.0, -d_rightup(tmp, hi, dhi)],
+        default=0.0,
+    )
+
+
+def blend_weights(tmp: np.ndarray, params: BlendParams = BlendParams()):
+    """Return the Ferguson/OP weights (f1r, f2r, f1p, f2p) for each log T in ``tmp``."""
+    tmp = np.asarray(tmp, dtype=np.float64)
+    p = params
+    f1r = _window(tmp, p.tmp_ser, p.tmpdsr, p.temp_fe_op, p.tmpdfr)
+    f2r = _window(tmp, p.temp_fe_op, p.tmpdfr, p.tmp_opr, p.tmpdor)
+    f1p = _window(tmp, p.tmp_sep, p.tmpdsp, p.temp_fe_op, p.tmpdfp)
+    f2p = _window(tmp, p.temp_fe_op, p.tmpdfp, p.tmp_opp, p.tmpdop)
+    return f1r, f2r, f1p, f2p
+
+
+def blend_weight_derivs(tmp: np.ndarray, params: BlendParams = BlendParams()):
+    """Return d/d log T of (f1r, f2r, f1p, f2p)."""
+    tmp = np.asarray(tmp, dtype=np.float64)
+    p = params
+    df1r = _window_deriv(tmp, p.tmp_ser, p.tmpdsr, p.temp_fe_op, p.tmpdfr)
+    df2r = _window_deriv(tmp, p.temp_fe_op, p.tmpdfr, p.tmp_opr, p.tmpdor)
+    df1p = _window_deriv(tmp, p.tmp_sep, p.tmpdsp, p.temp_fe_op, p.tmpdfp)
+    df2p = _window_deriv(tmp, p.temp_fe_op, p.tmpdfp, p.tmp_opp, p.tmpdop)
+    return df1r, df2r, df1p, df2p
+
+
+def interpolate_source(src: SourceTable, tmp: np.ndarray, rho: np.ndarray, derivs: bool = False):
+    """Bilinear interpolation of ``src`` on the tensor grid ``tmp`` x ``rho``.
+
+    Reproduces opacity() in hybrid.F90 exactly: density is clamped to the table
+    edges, and temperatures outside the open interval (t[0], t[-1]) yield -100.
+    Returns an array of shape (len(tmp), len(rho)); with ``derivs`` returns
+    (value, d/d log T, d/d log rho) of the same bilinear cell (zero where the
+    value is clamped or out of range).
+    """
+    t, d, opa = src
+    nt, nd = opa.shape
+    tmp = np.asarray(tmp, dtype=np.float64)
+    rho = np.asarray(rho, dtype=np.float64)
+
+    # First index with t >= tmp (and d >= rho), like the linear scans in opacity()
+    it = np.clip(np.searchsorted(t, tmp, side="left"), 1, nt - 1)
+    jd = np.searchsorted(d, rho, side="left")
+    hi = np.minimum(jd, nd - 1)
+    lo = np.maximum(jd - 1, 0)
+    clamped = (jd == 0) | (jd == nd)
+
+    r_lo = d[lo]
+    r_hi = d[hi]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w_hi = rho - r_lo
+        w_lo = r_hi - rho
+        den = r_hi - r_lo
+
+        def along_rho(rows):
+            a_lo = opa[np.ix_(rows, lo)]
+            a_hi = opa[np.ix_(rows, hi)]
+            return np.where(clamped, a_hi, (w_hi * a_hi + w_lo * a_lo) / den)
+
+        op0 = along_rho(it - 1)
+        op1 = along_rho(it)
+        t0 = t[it - 1][:, None]
+        t1 = t[it][:, None]
+        col = tmp[:, None]
+        out = ((col - t0) * op1 + (t1 - col) * op0) / (t1 - t0)
+        if derivs:
+
+            def slope_rho(rows):
+                return np.where(clamped, 0.0, (opa[np.ix_(rows, hi)] - opa[np.ix_(rows, lo)]) / den)
+
+            d_t = (op1 - op0) / (t1 - t0)
+            d_r = ((col - t0) * slope_rho(it) + (t1 - col) * slope_rho(it - 1)) / (t1 - t0)
+
+    inside = (tmp > t[0]) & (tmp < t[-1])
+    out[~inside, :] = OUT_OF_RANGE
+    if not derivs:
+        return out
+    d_t[~inside, :] = 0.0
+    d_r[~inside, :] = 0.0
+    return out, d_t, d_r
+
+
+def _blend_gas(a1: np.ndarray, a2: np.ndarray, f1: np.ndarray, f2: np.ndarray) -> np.ndarray:
+    """Ferguson/OP blend with the NaN fallbacks of hybrid.F90."""
+    ok1 = np.isfinite(a1)
+    ok2 = np.isfinite(a2)
+    with np.errstate(invalid="ignore"):
+        both = a1 * f1[:, None] + a2 * f2[:, None]
+    out = np.where(ok1 & ok2, both, np.where(ok1, a1, np.where(ok2, a2, FORTRAN_NAN)))
+    return out
+
+
+def _blend_gas_derivs(a1, a2, d1, d2, f1, f2, df1, df2):
+    """Derivatives (d/d log T, d/d log rho) of _blend_gas, following its fallbacks."""
+    ok1 = np.isfinite(a1)
+    ok2 = np.isfinite(a2)
+    f1, f2, df1, df2 = f1[:, None], f2[:, None], df1[:, None], df2[:, None]
+    with np.errstate(invalid="ignore"):
+        both_t = d1[0] * f1 + a1 * df1 + d2[0] * f2 + a2 * df2
+        both_r = d1[1] * f1 + d2[1] * f2
+    return tuple(
+        np.where(ok1 & ok2, both, np.where(ok1, g1, np.where(ok2, g2, np.nan)))
+        for both, g1, g2 in ((both_t, d1[0], d2[0]), (both_r, d1[1], d2[1]))
+    )
+
+
+@traced("build.block")
+def build_block(
+    sources: HybridSources,
+    tmp: np.ndarray,
+    rho: np.ndarray,
+    use_dust: bool = True,
+    params: BlendParams = BlendParams(),
+    derivs: bool = False,
+):
+    """Build log kappa_R, log kappa_P and the dust flag on the grid ``tmp`` x ``rho``.
+
+    Returns (opa_ros, opa_pla, dust), each of shape (len(tmp), len(rho)), where the
+    opacities are log10 values as held in hybrid.F90 before exponentiation.
+    With ``derivs`` a fourth element holds the TableDerivs of the same cells.
+    """
+    tmp = np.asarray(tmp, dtype=np.float64)
+    rho = np.asarray(rho, dtype=np.float64)
+    f1r, f2r, f1p, f2p = blend_weights(tmp, params)
+
+    with span("build.interpolate", cells=tmp.size * rho.size):
+        srcs = [
+            interpolate_source(src, tmp, rho, derivs)
+            for src in (sources.ros_se, sources.ros_fe, sources.ros_op, sources.pla_se, sources.pla_fe, sources.pla_op)
+        ]
+    if derivs:
+        (ros0, *dros0), (ros1, *dros1), (ros2, *dros2), (pla0, *dpla0), (pla1, *dpla1), (pla2, *dpla2) = srcs
+    else:
+        ros0, ros1, ros2, pla0, pla1, pla2 = srcs
+
+    dusty_r = ros0 > params.opacity_dust
+    dusty_p = pla0 > params.opacity_dust
+    ros1[dusty_r] = 0.0
+    pla1[dusty_p] = 0.0
+
+    opa_ros = _blend_gas(ros1, ros2, f1r, f2r)
+    opa_pla = _blend_gas(pla1, pla2, f1p, f2p)
+    if derivs:
+        for d in dros1:
+            d[dusty_r] = 0.0
+        for d in dpla1:
+            d[dusty_p] = 0.0
+        df1r, df2r, df1p, df2p = blend_weight_derivs(tmp, params)
+        dkr_dt, dkr_dr = _blend_gas_derivs(ros1, ros2, dros1, dros2, f1r, f2r, df1r, df2r)
+        dkp_dt, dkp_dr = _blend_gas_derivs(pla1, pla2, dpla1, dpla2, f1p, f2p, df1p, df2p)
+    if use_dust:
+        dust = dusty_r | (tmp < params.tmp_dust)[:, None]
+        if params.depletion != 1.0:
+            ros0 += math.log10(params.depletion)
+            pla0 += math.log10(params.depletion)
+        opa_ros = np.where(dust, ros0, opa_ros)
+        opa_pla = np.where(dust, pla0, opa_pla)
+        if derivs:
+            dkr_dt, dkr_dr = (np.where(dust, d0, d) for d0, d in zip(dros0, (dkr_dt, dkr_dr)))
+            dkp_dt, dkp_dr = (np.where(dust, d0, d) for d0, d in zip(dpla0, (dkp_dt, dkp_dr)))
+    else:
+        dust = np.zeros(opa_ros.shape, dtype=bool)
+        empty_r = (f1r == 0.0) & (f2r == 0.0)
+        empty_p = (f1p == 0.0) & (f2p == 0.0)
+        opa_ros[empty_r, :] = FORTRAN_NAN
+        opa_pla[empty_p, :] = FORTRAN_NAN
+        if derivs:
+            for d in (dkr_dt, dkr_dr):
+                d[empty_r, :] = np.nan
+            for d in (dkp_dt, dkp_dr):
+                d[empty_p, :] = np.nan
+    if derivs:
+        return opa_ros, opa_pla, dust.astype(np.float64), TableDerivs(dkr_dt, dkr_dr, dkp_dt, dkp_dr)
+    return opa_ros, opa_pla, dust.astype(np.float64)
+
+
+def grid_axes(ltmin: float, dlt: float, nitt: int, lrmin: float, dlr: float, nidd: int):
+    """log T and log rho axes computed as in hybrid.F90 (min + step * index)."""
+    tmp = ltmin + dlt * np.arange(nitt, dtype=np.float64)
+    rho = lrmin + dlr * np.arange(nidd, dtype=np.float64)
+    return tmp, rho
+
+
+_libm_pow = np.frompyfunc(math.pow, 2, 1)
+
+
+def pow10(x: np.ndarray, chunk: int = 1 << 20) -> np.ndarray:
+    """10**x evaluated with the C library pow, as gfortran does.
+
+    NumPy's SIMD power can differ from libm in the last bit, so the output files
+    would not match hybrid.F90 byte for byte.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if not (x.flags.c_contiguous or x.flags.f_contiguous):
+        x = np.ascontiguousarray(x)
+    out = np.empty_like(x)
+    src = x.reshape(-1, order="A")
+    dst = out.reshape(-1, order="A")
+    for s in range(0, src.size, chunk):
+        dst[s : s + chunk] = _libm_pow(10.0, src[s : s + chunk])
+    return out
+
+
+def _fortran_es(x: float, width: int = 14, digits: int = 6) -> str:
+    """Format like Fortran ESw.d (gfortran), including NaN and 3-digit exponents."""
+    if math.isnan(x):
+        return "NaN".rjust(width)
+    if math.isinf(x):
+        return ("Infinity" if x > 0 else "-Infinity").rjust(width)
+    s = "%.*E" % (digits, x)
+    mant, exp = s.split("E")
+    e = int(exp)
+    if abs(e) > 99:
+        s = "%s%+04d" % (mant, e)
+    else:
+        s = "%sE%+03d" % (mant, e)
+    return s.rjust(width)
+
+
+@traced("write.text")
+def write_text_table(
+    path: Path,
+    tmp: np.ndarray,
+    rho: np.ndarray,
+    kr: np.ndarray,
+    kp: np.ndarray,
+    dust: np.ndarray,
+) -> None:
+    """Write opacity_table.txt in the format of write_text_table in hybrid.F90."""
+    with path.open("w") as f:
+        f.write("log10T[K], log10rho[g/cm^3], kR[cm^2/g], kP[cm^2/g], dust\n")
+        tstr = ["%8.3f" % v for v in tmp]
+        for j, r in enumerate(rho):
+            rstr = "%9.3f" % r
+            lines = [
+                " %s %s %s %s %d\n" % (ts, rstr, _fortran_es(a), _fortran_es(b), int(c))
+                for ts, a, b, c in zip(tstr, kr[:, j].tolist(), kp[:, j].tolist(), dust[:, j].tolist())
+            ]
+            f.writelines(lines)
+
+
+def build_hybrid(
+    input_path: Path,
+    sources: HybridSources,
+    use_dust: bool = True,
+    params: BlendParams = BlendParams(),
+    derivs: bool = False,
+):
+    """Build the full table described by input.dat.
+
+    Returns (tmp, rho, opa_ros, opa_pla, dust) with log10 opacities, plus the
+    TableDerivs when ``derivs`` is set.
+    Raises ValueError when dust is enabled and tmp_min is below the Semenov grid.
+    """
+    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(input_path)
+    t_ser0 = sources.ros_se.t[0]
+    if use_dust and ltmin < t_ser0:
+        raise ValueError(
+            f"tmp_min (log10T={ltmin}) is below Semenov dust table min (log10T={t_ser0}). "
+            "Please raise tmp_min or disable dust via use_dust.in (set 0)."
+        )
+    tmp, rho = grid_axes(ltmin, dlt, nitt, lrmin, dlr, nidd)
+    return (tmp, rho) + tuple(build_block(sources, tmp, rho, use_dust, params, derivs))
+
+
+def write_outputs(
+    out_dir: Path,
+    tmp: np.ndarray,
+    rho: np.ndarray,
+    opa_ros: np.ndarray,
+    opa_pla: np.ndarray,
+    dust: np.ndarray,
+    params: BlendParams = BlendParams(),
+    text: bool = True,
+    derivs: Optional[TableDerivs] = None,
+) -> None:
+    """Write kR.dat, kP.dat, dust.dat, temp_fe_op.data and (optionally) opacity_table.txt.
+
+    ``derivs`` adds the derivative tables (DERIV_FILES, float64 as computed).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with span("build.pow10", nbytes=opa_ros.nbytes + opa_pla.nbytes):
+        kr = pow10(opa_ros)
+        kp = pow10(opa_pla)
+    (out_dir / "temp_fe_op.data").write_text(fortran_list_real(params.temp_fe_op) + "\n")
+    if text:
+        write_text_table(out_dir / "opacity_table.txt", tmp, rho, kr, kp, dust)
+    write_fortran_unformatted_matrix(out_dir / "kP.dat", kp)
+    write_fortran_unformatted_matrix(out_dir / "kR.dat", kr)
+    write_fortran_unformatted_matrix(out_dir / "dust.dat", dust)
+    if derivs is not None:
+        for name, arr in zip(DERIV_FILES, derivs):
+            write_fortran_unformatted_matrix(out_dir / name, arr)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the hybrid opacity table (vectorized hybrid.F90).")
+    parser.add_argument("--input", default="input.dat", help="Grid ranges file (log10 units)")
+    parser.add_argument("--semenov-dir", default=str(source_dir("Semenov")), help="Directory with semenov_*.data")
+    parser.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")), help="Directory with ferguson_*.data")
+    parser.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")), help="Directory with op_*.data")
+    parser.add_argument("--out-dir", default=".", help="Output directory")
+    parser.add_argument(
+        "--use-dust",
+        type=int,
+        choices=(0, 1),
+        default=None,
+        help="Override use_dust.in / use_opacity.in (default: read file, else 1)",
+    )
+    parser.add_argument("--no-text", action="store_true", help="Skip opacity_table.txt")
+    parser.add_argument("--derivs", action="store_true", help="Also write the d log kappa derivative tables")
+    args = parser.parse_args(argv)
+
+    input_path = Path(args.input)
+    use_dust = read_use_dust(input_path.parent) if args.use_dust is None else bool(args.use_dust)
+    sources = read_sources(Path(args.semenov_dir), Path(args.ferguson_dir), Path(args.op_dir))
+    try:
+        tmp, rho, opa_ros, opa_pla, dust, *derivs = build_hybrid(input_path, sources, use_dust, derivs=args.derivs)
+    except ValueError as exc:
+        print(f"ERROR: {exc}")
+        return 1
+    write_outputs(
+        Path(args.out_dir), tmp, rho, opa_ros, opa_pla, dust, text=not args.no_text, derivs=derivs[0] if derivs else None
+    )
+    print(f"Wrote kR.dat, kP.dat, dust.dat ({len(tmp)}x{len(rho)}) to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Compact export of the hybrid table for the runtime lookup.
+
+log10 kappa_R / kappa_P are stored either as float32 ("f32") or as 16-bit
+fixed point with a per-table scale and offset ("q16"; code 65535 marks NaN),
+and the 0/1 dust flag is bit-packed. At the default input.dat this is 1.8 MB
+(f32) or 0.9 MB (q16) instead of 5.3 MB for kR.dat + kP.dat + dust.dat.
+
+File layout (native byte order, like the table cache):
+- magic b"OPTABQ01", 8-byte little-endian header length, JSON header
+  (grid, mode, per-field dtype/offset/scale, error report)
+- log_kr, log_kp and dust arrays, each starting on a 64-byte boundary
+
+CompactTable has the OpacityTable lookup API and dequantizes the four cell
+corners on the fly, so the packed arrays are the only table data in memory.
+
+Usage:
+  python3 compact.py [--root .] [--mode q16] [--out opacity_q16.tab]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import struct
+import sys
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 compact.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_lookup import LookupWorkspace, OpacityTable
+
+MAGIC = b"OPTABQ01"
+FORMAT_VERSION = 1
+ALIGN = 64
+MODES = ("f32", "q16")
+NAN_CODE = 65535
+QMAX = 65534
+
+
+class PackedField(NamedTuple):
+    """Flat C-order table data: float32, uint16 codes, or packed bits (uint8)."""
+
+    data: np.ndarray
+    scale: float = 1.0
+    offset: float = 0.0
+    has_nan: bool = False
+
+
+def quantize(values: np.ndarray, mode: str) -> PackedField:
+    """Pack a log10 kappa table as float32 or 16-bit fixed point."""
+    v = np.ascontiguousarray(values, dtype=np.float64).reshape(-1)
+    if mode == "f32":
+        return PackedField(v.astype(np.float32), has_nan=bool(np.isnan(v).any()))
+    if mode != "q16":
+        raise ValueError(f"mode must be one of {MODES}")
+    finite = np.isfinite(v)
+    if np.isinf(v).any():
+        raise ValueError("q16 cannot store infinite values; use f32")
+    lo = float(v[finite].min()) if finite.any() else 0.0
+    hi = float(v[finite].max()) if finite.any() else 0.0
+    scale = (hi - lo) / QMAX if hi > lo else 1.0
+    codes = np.full(v.shape, NAN_CODE, dtype=np.uint16)
+    codes[finite] = np.rint((v[finite] - lo) / scale)
+    return PackedField(codes, scale, lo, not bool(finite.all()))
+
+
+def pack_dust(dust: np.ndarray) -> PackedField:
+    """Bit-pack the 0/1 dust flag (bit k of byte n is cell 8 n + k)."""
+    flags = np.ascontiguousarray(dust).reshape(-1) >= 0.5
+    return PackedField(np.packbits(flags, bitorder="little"))
+
+
+def unpack(field: PackedField, shape) -> np.ndarray:
+    """Dequantize a whole field to a float64 array of ``shape``."""
+    n = int(np.prod(shape))
+    data = field.data
+    if data.dtype == np.uint8:
+        out = np.unpackbits(data, count=n, bitorder="little").astype(np.float64)
+    elif data.dtype == np.float32:
+        out = data.astype(np.float64)
+    else:
+        out = data * field.scale + field.offset
+        out[data == NAN_CODE] = np.nan
+    return out.reshape(shape)
+
+
+class CompactWorkspace(LookupWorkspace):
+    """LookupWorkspace plus buffers in the packed storage types."""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self.f32 = np.empty(n, dtype=np.float32)
+        self.q = np.empty(n, dtype=np.uint16)
+        self.byte = np.empty(n, dtype=np.uint8)
+        self.bit = np.empty(n, dtype=np.intp)
+        self.qmask = np.empty(n, dtype=bool)
+
+
+class CompactTable(OpacityTable):
+    """Hybrid opacity table held in compact form; same lookup API as OpacityTable."""
+
+    def __init__(
+        self,
+        ltmin: float,
+        dlt: float,
+        lrmin: float,
+        dlr: float,
+        shape,
+        kr: PackedField,
+        kp: PackedField,
+        dust: PackedField,
+    ):
+        self.nitt, self.nidd = (int(s) for s in shape)
+        if min(self.nitt, self.nidd) < 2:
+            raise ValueError("table must have at least 2 points along each axis")
+        n = self.nitt * self.nidd
+        if kr.data.size != n or kp.data.size != n or dust.data.size != -(-n // 8):
+            raise ValueError("packed fields do not match the table shape")
+        self.ltmin = float(ltmin)
+        self.dlt = float(dlt)
+        self.lrmin = float(lrmin)
+        self.dlr = float(dlr)
+        self.mode = "f32" if kr.data.dtype == np.float32 else "q16"
+        self._flat_kr = kr
+        self._flat_kp = kp
+        self._flat_dust = dust
+        self._flat_derivs = None
+        self._work = None
+
+    @classmethod
+    def from_table(cls, table: OpacityTable, mode: str = "q16") -> "CompactTable":
+        """Pack a float64 OpacityTable."""
+        return cls(
+            table.ltmin,
+            table.dlt,
+            table.lrmin,
+            table.dlr,
+            table.log_kr.shape,
+            quantize(table.log_kr, mode),
+            quantize(table.log_kp, mode),
+            pack_dust(table.dust),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(f.data.nbytes for f in (self._flat_kr, self._flat_kp, self._flat_dust))
+
+    def to_opacity_table(self) -> OpacityTable:
+        """Dequantized float64 copy of the whole table."""
+        shape = (self.nitt, self.nidd)
+        return OpacityTable(
+            self.ltmin,
+            self.dlt,
+            self.lrmin,
+            self.dlr,
+            unpack(self._flat_kr, shape),
+            unpack(self._flat_kp, shape),
+            unpack(self._flat_dust, shape),
+        )
+
+    def workspace(self, n: int) -> CompactWorkspace:
+        return CompactWorkspace(n)
+
+    def _get_work(self, n: int, work: Optional[LookupWorkspace]) -> CompactWorkspace:
+        if work is not None and not isinstance(work, CompactWorkspace):
+            raise ValueError("CompactTable needs a workspace from CompactTable.workspace()")
+        return super()._get_work(n, work)
+
+    def _gather(self, field: PackedField, idx: np.ndarray, out: np.ndarray, w: CompactWorkspace) -> np.ndarray:
+        data = field.data
+        if data.dtype == np.uint8:
+            # dust bit: (byte[idx >> 3] >> (idx & 7)) & 1
+            np.right_shift(idx, 3, out=w.bit)
+            np.take(data, w.bit, out=w.byte, mode="clip")
+            np.bitwise_and(idx, 7, out=w.bit)
+            np.right_shift(w.byte, w.bit, out=w.bit)
+            np.bitwise_and(w.bit, 1, out=w.bit)
+            np.copyto(out, w.bit)
+        elif data.dtype == np.float32:
+            np.take(data, idx, out=w.f32, mode="clip")
+            np.copyto(out, w.f32)
+        else:
+            np.take(data, idx, out=w.q, mode="clip")
+            np.multiply(w.q, field.scale, out=out)
+            np.add(out, field.offset, out=out)
+            if field.has_nan:
+                np.equal(w.q, NAN_CODE, out=w.qmask)
+                np.copyto(out, np.nan, where=w.qmask)
+        return out
+
+    def save(self, path: Path, report: Optional[dict] = None) -> None:
+        """Write the compact file; ``report`` (see error_report) is kept in the header."""
+        fields = {}
+        offset = 0
+        for name, f in (("log_kr", self._flat_kr), ("log_kp", self._flat_kp), ("dust", self._flat_dust)):
+            fields[name] = {
+                "dtype": f.data.dtype.newbyteorder("=").str,
+                "size": int(f.data.size),
+                "offset": offset,
+                "scale": f.scale,
+                "zero": f.offset,
+                "has_nan": f.has_nan,
+            }
+            offset += -(-f.data.nbytes // ALIGN) * ALIGN
+        header = json.dumps(
+            {
+                "version": FORMAT_VERSION,
+                "mode": self.mode,
+                "grid": {"ltmin": self.ltmin, "dlt": self.dlt, "lrmin": self.lrmin, "dlr": self.dlr,
+                         "nitt": self.nitt, "nidd": self.nidd},
+                "fields": fields,
+                "error": report,
+            }
+        ).encode()
+        data_start = -(-(16 + len(header)) // ALIGN) * ALIGN
+        with Path(path).open("wb") as fh:
+            fh.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, f in (("log_kr", self._flat_kr), ("log_kp", self._flat_kp), ("dust", self._flat_dust)):
+                fh.seek(data_start + fields[name]["offset"])
+                fh.write(f.data.tobytes())
+            fh.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, path: Path) -> "CompactTable":
+        """Map a file written by save(); the packed arrays are views of one mmap."""
+        with Path(path).open("rb") as fh:
+            head = fh.read(16)
+            if len(head) != 16 or head[:8] != MAGIC:
+                raise ValueError(f"{path}: not a compact opacity table")
+            (nheader,) = struct.unpack("<Q", head[8:])
+            meta = json.loads(fh.read(nheader))
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported compact table version {meta.get('version')}")
+        data_start = -(-(16 + nheader) // ALIGN) * ALIGN
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        packed = {}
+        for name, e in meta["fields"].items():
+            data = np.ndarray((e["size"],), dtype=np.dtype(e["dtype"]), buffer=mm, offset=data_start + e["offset"])
+            packed[name] = PackedField(data, e["scale"], e["zero"], e["has_nan"])
+        g = meta["grid"]
+        table = cls(g["ltmin"], g["dlt"], g["lrmin"], g["dlr"], (g["nitt"], g["nidd"]),
+                    packed["log_kr"], packed["log_kp"], packed["dust"])
+        table.report = meta.get("error")
+        return table
+
+
+def error_report(ref: OpacityTable, compact: CompactTable, rows: int = 256) -> dict:
+    """Max and RMS error of the compact lookup against the float64 table.
+
+    Both tables are evaluated at every node and every cell center (processed
+    in blocks of ``rows`` table rows); entries that are NaN in the float64
+    result are skipped, and NaN/non-NaN disagreements are counted.
+    """
+    acc = {k: {"max": 0.0, "sq": 0.0, "n": 0, "nan_mismatch": 0} for k in ("kR", "kP")}
+    dust_mismatch = 0
+    lr_nodes = ref.lrmin + ref.dlr * np.arange(ref.nidd)
+    lr_centers = ref.lrmin + ref.dlr * (np.arange(ref.nidd - 1) + 0.5)
+    for i0 in range(0, ref.nitt, rows):
+        i1 = min(i0 + rows, ref.nitt)
+        lt_nodes = ref.ltmin + ref.dlt * np.arange(i0, i1)
+        lt_centers = ref.ltmin + ref.dlt * (np.arange(i0, min(i1, ref.nitt - 1)) + 0.5)
+        for lt_axis, lr_axis in ((lt_nodes, lr_nodes), (lt_centers, lr_centers)):
+            if lt_axis.size == 0:
+                continue
+            lt, lr = np.meshgrid(lt_axis, lr_axis, indexing="ij")
+            for key, ref_vals, cmp_vals in zip(("kR", "kP"), ref.lookup(lt, lr), compact.lookup(lt, lr)):
+                a = acc[key]
+                valid = ~np.isnan(ref_vals)
+                a["nan_mismatch"] += int((valid == np.isnan(cmp_vals)).sum())
+                err = np.abs(cmp_vals[valid] - ref_vals[valid])
+                err = err[np.isfinite(err)]
+                if err.size:
+                    a["max"] = max(a["max"], float(err.max()))
+                    a["sq"] += float(np.dot(err, err))
+                    a["n"] += err.size
+            if lt_axis is lt_nodes:
+                dust_mismatch += int((ref.dust_fraction(lt, lr) != compact.dust_fraction(lt, lr)).sum())
+    report = {"mode": compact.mode}
+    for key, field in (("kR", compact._flat_kr), ("kP", compact._flat_kp)):
+        a = acc[key]
+        report[key] = {
+            "max_abs_dex": a["max"],
+            "rms_dex": (a["sq"] / a["n"]) ** 0.5 if a["n"] else 0.0,
+            "bound_dex": field.scale / 2 if compact.mode == "q16" else None,
+            "nan_mismatch": a["nan_mismatch"],
+        }
+    report["dust_mismatch"] = dust_mismatch
+    report["bytes"] = compact.nbytes
+    report["bytes_float64"] = 3 * 8 * ref.nitt * ref.nidd
+    return report
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the hybrid table as float32 or 16-bit fixed point.")
+    parser.add_argument("--root", default=".", help="Directory with input.dat, kR.dat, kP.dat, dust.dat")
+    parser.add_argument("--mode", choices=MODES, default="q16", help="Storage of log10 kappa")
+    parser.add_argument("--out", default=None, help="Output file (default: opacity_<mode>.tab in --root)")
+    args = parser.parse_args(argv)
+
+    root = Path(args.root)
+    ref = OpacityTable.from_files(root)
+    compact = CompactTable.from_table(ref, args.mode)
+    report = error_report(ref, compact)
+    out = Path(args.out) if args.out else root / f"opacity_{args.mode}.tab"
+    compact.save(out, report)
+    print(f"Wrote {out}: {report['bytes']} bytes (float64 tables: {report['bytes_float64']} bytes)")
+    for key in ("kR", "kP"):
+        r = report[key]
+        bound = "" if r["bound_dex"] is None else f", bound {r['bound_dex']:.3e}"
+        print(f"  log {key}: max {r['max_abs_dex']:.3e} dex, rms {r['rms_dex']:.3e} dex{bound}")
+    print(f"  dust mismatches at nodes: {report['dust_mismatch']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Vectorized boundary and iso-contour extraction for hybrid tables.
+
+- sublimation_line: last dusty log T per density (as in opacity_table.pro)
+- dust_free_rho: per temperature, the highest dust-free log rho
+- iso_crossing: coordinate where a table crosses a level along one axis,
+  with linear sub-cell interpolation (e.g. T(rho) where log kappa_R = 0)
+- blend_crossing: log T where a Ferguson/OP blend weight equals a level
+
+Every function works on whole arrays; there are no per-column Python loops.
+
+Usage (writes text files with a row-count header like border.data):
+  python3 contours.py [--root .] [--kr-level L ...] [--kp-level L ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 contours.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .build_hybrid import BlendParams, blend_weights
+from .opacity_io import read_hybrid_table
+from .tracing import traced
+
+
+def _last_true(mask: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of the last True along ``axis`` and whether any was found."""
+    n = mask.shape[axis]
+    found = mask.any(axis=axis)
+    idx = n - 1 - np.argmax(np.flip(mask, axis=axis), axis=axis)
+    return idx, found
+
+
+def _first_true(mask: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of the first True along ``axis`` and whether any was found."""
+    return np.argmax(mask, axis=axis), mask.any(axis=axis)
+
+
+@traced("sublimation_line")
+def sublimation_line(dust: np.ndarray, topmin: float, topmax: float, dopmin: float, dopmax: float):
+    """Compute (tsubl, dsubl): the last log T with dust per density column.
+
+    Same result as the loop in opacity_table.pro; columns without dust get NaN.
+    """
+    nitt, nidd = dust.shape
+    idx, found = _last_true(np.asarray(dust) >= 0.5, axis=0)
+    tsubl = np.where(found, topmin + (topmax - topmin) * (idx / (nitt - 1)), np.nan)
+    dsubl = np.linspace(dopmin, dopmax, nidd)
+    return tsubl, dsubl
+
+
+def dust_free_rho(dust: np.ndarray, topmin: float, topmax: float, dopmin: float, dopmax: float):
+    """Compute (t, rho_free): per log T row, the highest log rho without dust.
+
+    This is the sublimation boundary seen along density; rows that are dusty
+    everywhere get NaN.
+    """
+    nitt, nidd = dust.shape
+    idx, found = _last_true(np.asarray(dust) < 0.5, axis=1)
+    rho_free = np.where(found, dopmin + (dopmax - dopmin) * (idx / (nidd - 1)), np.nan)
+    t = np.linspace(topmin, topmax, nitt)
+    return t, rho_free
+
+
+def iso_crossing(
+    values: np.ndarray, coords: np.ndarray, level: float, axis: int = 0, which: str = "last"
+) -> np.ndarray:
+    """Coordinate along ``axis`` where ``values`` crosses ``level``.
+
+    ``coords`` holds the coordinates of ``values`` along ``axis``. Between the two
+    bracketing nodes the position is interpolated linearly. ``which`` selects the
+    "first" or "last" crossing; lines with no crossing (or only NaN) give NaN.
+    The result has the shape of ``values`` with ``axis`` removed.
+    """
+    if which not in ("first", "last"):
+        raise ValueError("which must be 'first' or 'last'")
+    v = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    x = np.asarray(coords, dtype=np.float64)
+    if x.shape != (v.shape[0],):
+        raise ValueError("coords must match the length of values along axis")
+    v0 = v[:-1]
+    v1 = v[1:]
+    with np.errstate(invalid="ignore"):
+        above0 = v0 >= level
+        above1 = v1 >= level
+    valid = np.isfinite(v0) & np.isfinite(v1)
+    crossing = valid & (above0 != above1)
+    if which == "first":
+        k, found = _first_true(crossing, axis=0)
+    else:
+        k, found = _last_true(crossing, axis=0)
+    a = np.take_along_axis(v0, k[None], axis=0)[0]
+    b = np.take_along_axis(v1, k[None], axis=0)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = (level - a) / (b - a)
+    out = x[k] + frac * (x[k + 1] - x[k])
+    return np.where(found, out, np.nan)
+
+
+def blend_crossing(
+    tmp: np.ndarray, level: float = 0.5, weight: str = "f2r", params: BlendParams = BlendParams()
+) -> np.ndarray:
+    """log T values on the axis ``tmp`` where a blend weight crosses ``level``.
+
+    ``weight`` is one of f1r, f2r, f1p, f2p (see build_hybrid.blend_weights);
+    returns (first, last) crossing, e.g. both equal temp_fe_op for f2r at 0.5
+    when the OP range reaches the top of ``tmp``.
+    """
+    names = ("f1r", "f2r", "f1p", "f2p")
+    if weight not in names:
+        raise ValueError(f"weight must be one of {names}")
+    tmp = np.asarray(tmp, dtype=np.float64)
+    w = blend_weights(tmp, params)[names.index(weight)]
+    return np.array(
+        [iso_crossing(w, tmp, level, which="first"), iso_crossing(w, tmp, level, which="last")]
+    )
+
+
+def write_curve(path: Path, x: np.ndarray, y: np.ndarray) -> None:
+    """Write finite (x, y) pairs with a leading row count, like border.data."""
+    keep = np.isfinite(x) & np.isfinite(y)
+    with path.open("w") as f:
+        f.write(f"{int(keep.sum())}\n")
+        np.savetxt(f, np.column_stack([x[keep], y[keep]]), fmt="%.10f")
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Extract sublimation and iso-opacity curves.")
+    parser.add_argument("--root", default=".", help="Directory with input.dat, kR.dat, kP.dat, dust.dat")
+    parser.add_argument("--out-dir", default=".", help="Output directory")
+    parser.add_argument("--kr-level", type=float, action="append", default=[], help="log kappa_R level")
+    parser.add_argument("--kp-level", type=float, action="append", default=[], help="log kappa_P level")
+    args = parser.parse_args(argv)
+
+    table = read_hybrid_table(Path(args.root))
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = np.linspace(table.ltmin, table.ltmax, table.nitt)
+    rho = np.linspace(table.lrmin, table.lrmax, table.nidd)
+
+    tsubl, dsubl = sublimation_line(table.dust, table.ltmin, table.ltmax, table.lrmin, table.lrmax)
+    write_curve(out_dir / "sublimation_line.data", tsubl, dsubl)
+    t, rho_free = dust_free_rho(table.dust, table.ltmin, table.ltmax, table.lrmin, table.lrmax)
+    write_curve(out_dir / "dust_free_rho.data", t, rho_free)
+    written = ["sublimation_line.data", "dust_free_rho.data"]
+    for tag, lk, levels in (("kR", table.log_kr, args.kr_level), ("kP", table.log_kp, args.kp_level)):
+        for level in levels:
+            name = f"iso_{tag}_{level:g}.data"
+            write_curve(out_dir / name, iso_crossing(lk, tmp, level, axis=0), rho)
+            written.append(name)
+    print("Wrote: " + ", ".join(written))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Monotone bicubic Hermite interpolation of hybrid tables.
+
+Each node of log kappa_R / log kappa_P gets limited slopes along log T and
+log rho (Fritsch-Carlson: harmonic mean of the neighbouring differences, zero
+at local extrema and next to flat runs, limited one-sided slopes at the
+table edges). Inside a cell the value is the bicubic Hermite patch of its
+four corners with zero cross derivative, so it reproduces the node values,
+is C1 across cells and does not overshoot along the grid lines: plateaus
+such as the Semenov floor and sharp edges stay flat. The dust flag remains
+bilinear.
+
+The slopes (per grid step) are stored next to the table as HERMITE_FILES
+(hkRdi.dat, hkRdj.dat, hkPdi.dat, hkPdj.dat; same layout as kR.dat). Storing
+the 3 Hermite values per node instead of the 16 polynomial coefficients per
+cell gives the same patches at about a fifth of the memory. CubicTable has the
+OpacityTable lookup API.
+
+Usage:
+  python3 cubic.py build [--root .]
+  python3 cubic.py bench [--input input.dat] [--factors 1 2 4 8] [--samples 400]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 cubic.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import HERMITE_FILES, read_fortran_unformatted_matrix, read_hybrid_table, read_input_dat
+from .opacity_io import source_dir, write_fortran_unformatted_matrix
+from .opacity_lookup import LookupWorkspace, OpacityTable
+
+
+def limited_slopes(y: np.ndarray, axis: int) -> np.ndarray:
+    """Fritsch-Carlson slopes of ``y`` per unit index step along ``axis`` (uniform grid).
+
+    Non-finite neighbours give a zero slope.
+    """
+    y = np.moveaxis(np.asarray(y, dtype=np.float64), axis, 0)
+    with np.errstate(invalid="ignore"):
+        delta = np.diff(y, axis=0)
+    delta = np.where(np.isfinite(delta), delta, 0.0)
+    d = np.zeros_like(y)
+    if y.shape[0] == 2:
+        d[0] = d[1] = delta[0]
+        return np.moveaxis(d, 0, axis)
+    a, b = delta[:-1], delta[1:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        d[1:-1] = np.where(a * b > 0, 2 * a * b / (a + b), 0.0)
+    for k, d0, d1 in ((0, delta[0], delta[1]), (-1, delta[-1], delta[-2])):
+        e = (3 * d0 - d1) / 2
+        e = np.where(np.sign(e) != np.sign(d0), 0.0, e)
+        e = np.where((np.sign(d0) != np.sign(d1)) & (np.abs(e) > 3 * np.abs(d0)), 3 * d0, e)
+        d[k] = e
+    return np.moveaxis(d, 0, axis)
+
+
+class CubicWorkspace(LookupWorkspace):
+    """LookupWorkspace plus the Hermite basis values of the located points."""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        # value (h00/h01) and slope (h10/h11) basis at the lower and upper corner, per axis
+        self.basis = np.empty((8, n))
+        self.g = np.empty(n)
+
+
+def _hermite(t: np.ndarray, out: np.ndarray) -> None:
+    """Fill out[0:4] with h00, h01, h10, h11 at ``t``."""
+    t2 = t * t
+    t3 = t2 * t
+    np.multiply(t3, 2.0, out=out[0])
+    out[0] -= 3.0 * t2
+    out[0] += 1.0
+    np.subtract(1.0, out[0], out=out[1])
+    np.subtract(t3, 2.0 * t2, out=out[2])
+    out[2] += t
+    np.subtract(t3, t2, out=out[3])
+
+
+class CubicTable(OpacityTable):
+    """OpacityTable evaluating log kappa with monotone bicubic Hermite patches."""
+
+    def __init__(
+        self,
+        ltmin: float,
+        dlt: float,
+        lrmin: float,
+        dlr: float,
+        log_kr: np.ndarray,
+        log_kp: np.ndarray,
+        dust: np.ndarray,
+        slopes: Optional[Sequence[np.ndarray]] = None,
+    ):
+        super().__init__(ltmin, dlt, lrmin, dlr, log_kr, log_kp, dust)
+        if slopes is None:
+            slopes = hermite_slopes(self.log_kr, self.log_kp)
+        if len(slopes) != 4 or any(np.shape(s) != self.log_kr.shape for s in slopes):
+            raise ValueError("slopes must be four tables with the shape of kR")
+        s = [np.ascontiguousarray(a, dtype=np.float64).reshape(-1) for a in slopes]
+        self.slopes = tuple(a.reshape(self.log_kr.shape) for a in s)
+        # (value, slope per step in log T, slope per step in log rho)
+        self._flat_kr = (self._flat_kr, s[0], s[1])
+        self._flat_kp = (self._flat_kp, s[2], s[3])
+
+    @classmethod
+    def from_files(cls, root: Path = Path("."), input_path: Optional[Path] = None, derivs: bool = False) -> "CubicTable":
+        """Load kR.dat, kP.dat, dust.dat and the HERMITE_FILES written by ``cubic.py build``."""
+        if derivs:
+            raise ValueError("CubicTable does not load derivative tables")
+        t = read_hybrid_table(root, input_path)
+        missing = [name for name in HERMITE_FILES if not (Path(root) / name).exists()]
+        if missing:
+            raise FileNotFoundError(f"{', '.join(missing)} not found in {root} (run cubic.py build)")
+        slopes = [read_fortran_unformatted_matrix(Path(root) / name, t.nitt, t.nidd) for name in HERMITE_FILES]
+        return cls(t.ltmin, t.dlt, t.lrmin, t.dlr, t.log_kr, t.log_kp, t.dust, slopes)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the kR/kP values and slopes."""
+        return sum(a.nbytes for f in (self._flat_kr, self._flat_kp) for a in f)
+
+    def workspace(self, n: int) -> CubicWorkspace:
+        return CubicWorkspace(n)
+
+    def _get_work(self, n: int, work: Optional[LookupWorkspace]) -> CubicWorkspace:
+        if work is not None and not isinstance(work, CubicWorkspace):
+            raise ValueError("CubicTable needs a workspace from CubicTable.workspace()")
+        return super()._get_work(n, work)
+
+    def _locate(self, log_t, log_rho, w: CubicWorkspace) -> None:
+        super()._locate(log_t, log_rho, w)
+        _hermite(w.ft, w.basis[0:4])
+        _hermite(w.fr, w.basis[4:8])
+
+    def _interp(self, flat, w: CubicWorkspace, out: np.ndarray) -> np.ndarray:
+        if not isinstance(flat, tuple):
+            return super()._interp(flat, w, out)
+        val, di, dj = flat
+        bu, bv = w.basis[0:4], w.basis[4:8]
+        out[...] = 0.0
+        # corners (i, j), (i, j+1), (i+1, j), (i+1, j+1): (flat offset, T side, rho side)
+        for offset, a, b in ((0, 0, 0), (1, 0, 1), (self.nidd, 1, 0), (self.nidd + 1, 1, 1)):
+            np.add(w.idx, offset, out=w.idx2)
+            for table, ut, vt in ((val, bu[a], bv[b]), (di, bu[2 + a], bv[b]), (dj, bu[a], bv[2 + b])):
+                self._gather(table, w.idx2, w.g, w)
+                np.multiply(w.g, ut, out=w.g)
+                np.multiply(w.g, vt, out=w.g)
+                np.add(out, w.g, out=out)
+        return out
+
+
+def hermite_slopes(log_kr: np.ndarray, log_kp: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Limited slopes (kR along log T, kR along log rho, kP along log T, kP along log rho)."""
+    return (limited_slopes(log_kr, 0), limited_slopes(log_kr, 1), limited_slopes(log_kp, 0), limited_slopes(log_kp, 1))
+
+
+def write_slopes(root: Path, slopes: Sequence[np.ndarray]) -> None:
+    for name, arr in zip(HERMITE_FILES, slopes):
+        write_fortran_unformatted_matrix(Path(root) / name, arr)
+
+
+def _errors(err: np.ndarray) -> dict:
+    e = np.abs(err[np.isfinite(err)])
+    if not e.size:
+        return {"rms": None, "p99": None, "max": None}
+    return {"rms": float(np.sqrt(np.mean(e * e))), "p99": float(np.percentile(e, 99)), "max": float(e.max())}
+
+
+# Node regime bits for smooth_cells(): dust flag, sentinel / non-finite value,
+# a fractional blend weight (inside a source seam), then which weights are 1
+_DUST, _SENTINEL, _SEAM, _WEIGHT_SHIFT = 1, 2, 4, 3
+
+
+def smooth_cells(table: OpacityTable, params=None, sentinel: float = -99.0, jump: float = 1.0) -> np.ndarray:
+    """Mask (nitt - 1, nidd - 1) of cells away from every discontinuity of the table.
+
+    A cell counts as smooth when all 16 nodes of its cubic stencil (the cell
+    corners and their neighbours, which set the slopes) have the same dust
+    flag and the same Ferguson/OP blend weights, none of them fractional
+    (blend seams), and none is non-finite, at or below ``sentinel``, or next
+    to a step of more than ``jump`` dex (steps inside the source tables).
+    """
+    from .build_hybrid import BlendParams, blend_weights
+
+    t = table.ltmin + table.dlt * np.arange(table.nitt)
+    weights = blend_weights(t, params or BlendParams())
+    per_t = np.zeros(table.nitt, dtype=np.int16)
+    for k, w in enumerate(weights):
+        per_t |= ((w > 0.0) & (w < 1.0)).astype(np.int16) * _SEAM
+        per_t |= (w >= 1.0).astype(np.int16) << (_WEIGHT_SHIFT + k)
+    with np.errstate(invalid="ignore"):
+        bad = ~(np.isfinite(table.log_kr) & np.isfinite(table.log_kp))
+        bad |= (table.log_kr <= sentinel) | (table.log_kp <= sentinel)
+        for y in (table.log_kr, table.log_kp):
+            for axis in (0, 1):
+                step = np.abs(np.diff(y, axis=axis)) > jump
+                lo = [slice(None)] * 2
+                hi = [slice(None)] * 2
+                lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+                bad[tuple(lo)] |= step
+                bad[tuple(hi)] |= step
+    code = per_t[:, None] | (table.dust >= 0.5).astype(np.int16) * _DUST | bad.astype(np.int16) * _SENTINEL
+    win = np.lib.stride_tricks.sliding_window_view(np.pad(code, 1, mode="edge"), (4, 4))
+    lo, hi = win.min(axis=(2, 3)), win.max(axis=(2, 3))
+    return (lo == hi) & (lo & (_SEAM | _SENTINEL) == 0)
+
+
+def coarse_smooth_cells(fine_smooth: np.ndarray, factor: int) -> np.ndarray:
+    """smooth_cells() of the grid with ``factor`` times the steps, judged on the fine grid.
+
+    A coarse cell is smooth when every fine cell under its 4 x 4 node
+    stencil is, so discontinuities narrower than a coarse step also count.
+    """
+    bad = np.pad((~fine_smooth).astype(np.int32), ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    shape = [(n // factor) for n in fine_smooth.shape]  # coarse cells
+    lo = [np.clip(factor * (np.arange(n) - 1), 0, m) for n, m in zip(shape, fine_smooth.shape)]
+    hi = [np.clip(factor * (np.arange(n) + 2), 0, m) for n, m in zip(shape, fine_smooth.shape)]
+    count = (bad[np.ix_(hi[0], hi[1])] - bad[np.ix_(lo[0], hi[1])]
+             - bad[np.ix_(hi[0], lo[1])] + bad[np.ix_(lo[0], lo[1])])
+    return count == 0
+
+
+def _cell_of(table: OpacityTable, lt: np.ndarray, lr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    i = np.clip(np.floor((lt - table.ltmin) / table.dlt).astype(np.intp), 0, table.nitt - 2)
+    j = np.clip(np.floor((lr - table.lrmin) / table.dlr).astype(np.intp), 0, table.nidd - 2)
+    return i, j
+
+
+def benchmark(
+    input_path: Path,
+    source_dirs: Tuple[Path, Path, Path],
+    factors: Sequence[int] = (1, 2, 4, 8),
+    samples: int = 400,
+    use_dust: bool = True,
+    seed: int = 0,
+) -> dict:
+    """Memory and accuracy of bilinear vs monotone cubic tables at coarsened steps.
+
+    For each factor f the table is built from the source tables with f times
+    the input.dat steps; both interpolants are compared with the hybrid
+    formula evaluated directly at samples x samples random points. Errors
+    are also reported over the points in smooth cells (coarse_smooth_cells()
+    of the input.dat grid), since the sublimation front and the source seams
+    dominate the overall figures for both interpolants.
+    """
+    from .build_hybrid import build_block, grid_axes, read_sources
+
+    sources = read_sources(*source_dirs)
+    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(input_path)
+    f_max = max(factors)
+    # common domain covered by every coarsened grid
+    t_hi = ltmin + dlt * f_max * ((nitt - 1) // f_max)
+    r_hi = lrmin + dlr * f_max * ((nidd - 1) // f_max)
+    rng = np.random.default_rng(seed)
+    tt = np.sort(rng.uniform(ltmin, t_hi, samples))
+    rr = np.sort(rng.uniform(lrmin, r_hi, samples))
+    truth_r, truth_p, _ = build_block(sources, tt, rr, use_dust)
+    lt, lr = np.meshgrid(tt, rr, indexing="ij")
+    tmp, rho = grid_axes(ltmin, dlt, nitt, lrmin, dlr, nidd)
+    fine_smooth = smooth_cells(OpacityTable(ltmin, dlt, lrmin, dlr, *build_block(sources, tmp, rho, use_dust)))
+    rows = []
+    for f in factors:
+        n_t = (nitt - 1) // f + 1
+        n_r = (nidd - 1) // f + 1
+        tmp, rho = grid_axes(ltmin, dlt * f, n_t, lrmin, dlr * f, n_r)
+        t0 = time.perf_counter()
+        log_kr, log_kp, dust = build_block(sources, tmp, rho, use_dust)
+        bilinear = OpacityTable(ltmin, dlt * f, lrmin, dlr * f, log_kr, log_kp, dust)
+        cubic = CubicTable(ltmin, dlt * f, lrmin, dlr * f, log_kr, log_kp, dust)
+        build_s = time.perf_counter() - t0
+        smooth = coarse_smooth_cells(fine_smooth, f)[_cell_of(bilinear, lt, lr)].reshape(-1)
+        row = {"factor": f, "shape": [n_t, n_r], "build_seconds": round(build_s, 3),
+               "bytes": {"bilinear": log_kr.nbytes + log_kp.nbytes, "cubic": cubic.nbytes},
+               "smooth_fraction": round(float(smooth.mean()), 4)}
+        for name, table in (("bilinear", bilinear), ("cubic", cubic)):
+            t0 = time.perf_counter()
+            kr, kp = table.lookup(lt, lr)
+            row[f"{name}_lookup_seconds"] = round(time.perf_counter() - t0, 4)
+            err = np.concatenate([(kr - truth_r).reshape(-1), (kp - truth_p).reshape(-1)])
+            row[name] = {"all": _errors(err), "smooth": _errors(err[np.concatenate([smooth, smooth])])}
+        rows.append(row)
+    return {"input": str(input_path), "samples": samples * samples, "use_dust": use_dust, "results": rows}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Monotone bicubic Hermite slopes and benchmark.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Write HERMITE_FILES next to kR.dat/kP.dat")
+    b.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat, input.dat")
+    m = sub.add_parser("bench", help="Memory/accuracy of bilinear vs cubic at coarsened steps")
+    m.add_argument("--input", default="input.dat", help="Grid ranges file (log10 units)")
+    m.add_argument("--semenov-dir", default=str(source_dir("Semenov")))
+    m.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")))
+    m.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")))
+    m.add_argument("--factors", type=int, nargs="+", default=[1, 2, 4, 8], help="Step multipliers")
+    m.add_argument("--samples", type=int, default=400, help="Random points per axis")
+    m.add_argument("--use-dust", type=int, choices=(0, 1), default=1)
+    m.add_argument("--out", default=None, help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        root = Path(args.root)
+        t = read_hybrid_table(root)
+        slopes = hermite_slopes(t.log_kr, t.log_kp)
+        write_slopes(root, slopes)
+        print(f"Wrote {', '.join(HERMITE_FILES)} to {root} ({t.nitt}x{t.nidd})")
+        return 0
+
+    dirs = (Path(args.semenov_dir), Path(args.ferguson_dir), Path(args.op_dir))
+    res = benchmark(Path(args.input), dirs, args.factors, args.samples, bool(args.use_dust))
+    print(f"{'':24s} {'all points':^19s}  {'smooth cells':^39s}")
+    print(f"{'factor':>6} {'shape':>11} {'MiB':>5}  {'p99 bilin':>9} {'p99 cubic':>9}  "
+          f"{'share':>5} {'rms bilin':>9} {'rms cubic':>9} {'p99 bilin':>9} {'p99 cubic':>9}")
+    for r in res["results"]:
+        ba, ca = r["bilinear"]["all"], r["cubic"]["all"]
+        bs, cs = r["bilinear"]["smooth"], r["cubic"]["smooth"]
+        print(f"{r['factor']:>6} {r['shape'][0]:>5}x{r['shape'][1]:<5} {r['bytes']['cubic'] / 2**20:5.1f}  "
+              f"{ba['p99']:9.2e} {ca['p99']:9.2e}  {r['smooth_fraction']:5.2f} "
+              f"{bs['rms']:9.2e} {cs['rms']:9.2e} {bs['p99']:9.2e} {cs['p99']:9.2e}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(res, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Single-pass, multithreaded diagnostics for opacity tables.
+
+Any table the tools produce or read can be checked:
+- source tables (semenov_*.data, ferguson_*.data, op_*.data; log10 kappa)
+- hybrid kR.dat / kP.dat (log10 is taken on the fly) and, with --no-log10,
+  dust.dat or any other table read as is; the grid comes from input.dat
+
+The table is mapped, not loaded, and streamed in blocks along its contiguous
+axis (density columns for the Fortran-ordered files) over a thread pool. Each
+block is converted to native float64 once and, while it is in cache, every
+statistic is accumulated for every region that overlaps it: NaN / inf /
+finite counts, counts of floor sentinels (the Semenov -37.93 floor and the
+-100 out-of-range value by default), values below vmin, min / max and a
+histogram. Memory use is bounded by the block size times the thread count.
+
+Regions are log T / log rho rectangles, given as NAME:TMIN:TMAX:RMIN:RMAX
+with empty fields for open ends (bounds inclusive), e.g. "hot:3:::" for
+log T >= 3. Results are printed as JSON.
+
+Usage:
+  python3 diagnostics.py ../Semenov/semenov_ros.data --region hot:3:::
+  python3 diagnostics.py kR.dat --input input.dat --fail-on-nonfinite
+  python3 diagnostics.py dust.dat --input input.dat --no-log10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 diagnostics.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import map_opacity_file, read_fortran_unformatted_matrix, read_input_dat
+from .tracing import traced
+
+# Semenov floor (log10 kappa at physical zero) and the out-of-range value of opacity()
+DEFAULT_FLOORS = (-37.92977945366163, -100.0)
+BLOCK_ELEMENTS = 1 << 16
+
+
+class Region(NamedTuple):
+    """log T / log rho rectangle (inclusive); None means unbounded."""
+
+    name: str
+    tmin: Optional[float] = None
+    tmax: Optional[float] = None
+    rmin: Optional[float] = None
+    rmax: Optional[float] = None
+
+
+class TableView(NamedTuple):
+    """A mapped 2-D table with its axes; ``log`` means log10 is applied to the values."""
+
+    name: str
+    t: np.ndarray
+    d: np.ndarray
+    data: np.ndarray
+    log: bool = False
+
+
+@dataclass
+class RegionStats:
+    """Accumulated statistics of one region (mergeable across blocks)."""
+
+    bins: int
+    size: int = 0
+    nan: int = 0
+    inf: int = 0
+    below_vmin: int = 0
+    floors: Dict[float, int] = field(default_factory=dict)
+    min: float = np.inf
+    max: float = -np.inf
+    hist: Optional[np.ndarray] = None
+    underflow: int = 0
+    overflow: int = 0
+
+    def merge(self, other: "RegionStats") -> None:
+        self.size += other.size
+        self.nan += other.nan
+        self.inf += other.inf
+        self.below_vmin += other.below_vmin
+        for k, v in other.floors.items():
+            self.floors[k] = self.floors.get(k, 0) + v
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.hist is not None:
+            self.hist = other.hist.copy() if self.hist is None else self.hist + other.hist
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+    def to_json(self, hist_range: Tuple[float, float]) -> dict:
+        finite = self.size - self.nan - self.inf
+        return {
+            "size": self.size,
+            "nan": self.nan,
+            "inf": self.inf,
+            "finite": finite,
+            "min": self.min if finite else None,
+            "max": self.max if finite else None,
+            "below_vmin": self.below_vmin,
+            "floors": {repr(k): v for k, v in self.floors.items()},
+            "hist": {
+                "range": list(hist_range),
+                "counts": (self.hist if self.hist is not None else np.zeros(self.bins, np.int64)).tolist(),
+                "underflow": self.underflow,
+                "overflow": self.overflow,
+            },
+        }
+
+
+def parse_region(text: str) -> Region:
+    """Parse NAME:TMIN:TMAX:RMIN:RMAX (empty fields are open ends)."""
+    parts = text.split(":")
+    if len(parts) != 5 or not parts[0]:
+        raise ValueError(f"region must be NAME:TMIN:TMAX:RMIN:RMAX, got {text!r}")
+    return Region(parts[0], *(float(p) if p.strip() else None for p in parts[1:]))
+
+
+def open_table(path: Path, input_path: Optional[Path] = None, log10: bool = True) -> TableView:
+    """Map a source table, or a hybrid file on the grid of ``input_path``.
+
+    Hybrid files hold kappa, not log10 kappa; ``log10`` selects whether the
+    statistics are taken on its log10 (kR/kP) or on the values as stored
+    (dust flags). Source tables are already log10 and ignore it.
+    """
+    path = Path(path)
+    if input_path is None:
+        src = map_opacity_file(path)
+        return TableView(path.name, np.asarray(src.t), np.asarray(src.d), src.data)
+    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(Path(input_path))
+    data = read_fortran_unformatted_matrix(path, nitt, nidd)
+    t = ltmin + dlt * np.arange(nitt, dtype=np.float64)
+    d = lrmin + dlr * np.arange(nidd, dtype=np.float64)
+    return TableView(path.name, t, d, data, log=log10)
+
+
+def _index_range(axis: np.ndarray, lo: Optional[float], hi: Optional[float]) -> Tuple[int, int]:
+    i0 = 0 if lo is None else int(np.searchsorted(axis, lo, side="left"))
+    i1 = axis.size if hi is None else int(np.searchsorted(axis, hi, side="right"))
+    return i0, max(i0, i1)
+
+
+def _scan_block(
+    table: TableView,
+    axis: int,
+    start: int,
+    stop: int,
+    boxes: Sequence[Tuple[int, int, int, int]],
+    floors: Sequence[float],
+    floor_tol: float,
+    vmin: float,
+    bins: int,
+    hist_range: Tuple[float, float],
+) -> List[Optional[RegionStats]]:
+    """Statistics of block [start, stop) along ``axis`` for every region box."""
+    sl = (slice(start, stop), slice(None)) if axis == 0 else (slice(None), slice(start, stop))
+    block = np.asarray(table.data[sl], dtype=np.float64)
+    if table.log:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            block = np.log10(block)
+    out: List[Optional[RegionStats]] = []
+    for i0, i1, j0, j1 in boxes:
+        if axis == 0:
+            i0, i1 = max(i0, start) - start, min(i1, stop) - start
+        else:
+            j0, j1 = max(j0, start) - start, min(j1, stop) - start
+        if i0 >= i1 or j0 >= j1:
+            out.append(None)
+            continue
+        sub = block[i0:i1, j0:j1]
+        st = RegionStats(bins=bins, size=sub.size)
+        finite = np.isfinite(sub)
+        nfinite = int(np.count_nonzero(finite))
+        st.nan = int(np.count_nonzero(np.isnan(sub)))
+        st.inf = sub.size - nfinite - st.nan
+        vals = sub[finite] if nfinite != sub.size else sub.reshape(-1)
+        if vals.size:
+            st.min = float(vals.min())
+            st.max = float(vals.max())
+            st.below_vmin = int(np.count_nonzero(vals < vmin))
+            for fv in floors:
+                st.floors[fv] = int(np.count_nonzero(np.abs(vals - fv) <= floor_tol))
+            st.hist, _ = np.histogram(vals, bins=bins, range=hist_range)
+            st.underflow = int(np.count_nonzero(vals < hist_range[0]))
+            st.overflow = int(np.count_nonzero(vals > hist_range[1]))
+        else:
+            st.floors = {fv: 0 for fv in floors}
+        out.append(st)
+    return out
+
+
+@traced("diagnose")
+def diagnose(
+    table: TableView,
+    regions: Sequence[Region] = (Region("all"),),
+    floors: Sequence[float] = DEFAULT_FLOORS,
+    floor_tol: float = 1e-9,
+    vmin: float = -6.0,
+    bins: int = 64,
+    hist_range: Tuple[float, float] = (-40.0, 10.0),
+    workers: Optional[int] = None,
+    block_elements: int = BLOCK_ELEMENTS,
+) -> dict:
+    """Scan ``table`` once and return the statistics of every region as a JSON-ready dict."""
+    t0 = time.perf_counter()
+    nt, nd = table.data.shape
+    # block along the axis that is contiguous in the file
+    axis = 1 if table.data.flags.f_contiguous and not table.data.flags.c_contiguous else 0
+    n_axis, n_other = (nd, nt) if axis == 1 else (nt, nd)
+    step = max(1, block_elements // max(n_other, 1))
+    blocks = [(s, min(s + step, n_axis)) for s in range(0, n_axis, step)]
+    boxes = [_index_range(table.t, r.tmin, r.tmax) + _index_range(table.d, r.rmin, r.rmax) for r in regions]
+    totals = [RegionStats(bins=bins, floors={fv: 0 for fv in floors}) for _ in regions]
+
+    def run(block):
+        return _scan_block(table, axis, block[0], block[1], boxes, floors, floor_tol, vmin, bins, hist_range)
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(run, blocks):
+            for total, st in zip(totals, partial):
+                if st is not None:
+                    total.merge(st)
+    return {
+        "table": table.name,
+        "shape": [nt, nd],
+        "log10_applied": table.log,
+        "t_range": [float(table.t[0]), float(table.t[-1])],
+        "d_range": [float(table.d[0]), float(table.d[-1])],
+        "vmin": vmin,
+        "regions": {
+            r.name: {"bounds": {"t": [r.tmin, r.tmax], "rho": [r.rmin, r.rmax]}, **s.to_json(hist_range)}
+            for r, s in zip(regions, totals)
+        },
+        "blocks": len(blocks),
+        "workers": workers,
+        "seconds": round(time.perf_counter() - t0, 6),
+    }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Single-pass statistics of opacity tables (JSON output).")
+    parser.add_argument("tables", nargs="+", help="Source tables, or kR.dat/kP.dat/dust.dat with --input")
+    parser.add_argument("--input", default=None, help="input.dat of hybrid tables (omit for source tables)")
+    parser.add_argument("--log10", dest="log10", action="store_true", default=True,
+                        help="Take log10 of the --input tables (default; for kR.dat/kP.dat)")
+    parser.add_argument("--no-log10", dest="log10", action="store_false",
+                        help="Use the --input tables as stored (dust.dat, dust_e.dat)")
+    parser.add_argument("--region", action="append", default=None, metavar="NAME:TMIN:TMAX:RMIN:RMAX",
+                        help="Region to report (repeatable; default: whole table)")
+    parser.add_argument("--floor", type=float, action="append", default=None,
+                        help="Sentinel value to count (repeatable; default: -37.9298 and -100)")
+    parser.add_argument("--floor-tol", type=float, default=1e-9, help="Absolute tolerance for sentinel matches")
+    parser.add_argument("--vmin", type=float, default=-6.0, help="Count values below this")
+    parser.add_argument("--bins", type=int, default=64, help="Histogram bins")
+    parser.add_argument("--hist-range", type=float, nargs=2, default=[-40.0, 10.0], metavar=("LO", "HI"))
+    parser.add_argument("--workers", type=int, default=None, help="Threads (default: all cores)")
+    parser.add_argument("--out", default=None, help="Write JSON here instead of stdout")
+    parser.add_argument("--fail-on-nonfinite", action="store_true",
+                        help="Exit with status 1 if any region has NaN or inf values")
+    args = parser.parse_args(argv)
+
+    try:
+        regions = [parse_region(r) for r in args.region] if args.region else [Region("all")]
+    except ValueError as exc:
+        parser.error(str(exc))
+    floors = tuple(args.floor) if args.floor else DEFAULT_FLOORS
+    input_path = Path(args.input) if args.input else None
+    reports = [
+        diagnose(
+            open_table(Path(p), input_path, args.log10),
+            regions,
+            floors,
+            args.floor_tol,
+            args.vmin,
+            args.bins,
+            tuple(args.hist_range),
+            args.workers,
+        )
+        for p in args.tables
+    ]
+    text = json.dumps(reports if len(reports) > 1 else reports[0], indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+    if args.fail_on_nonfinite:
+        bad = [
+            (rep["table"], name)
+            for rep in reports
+            for name, r in rep["regions"].items()
+            if r["nan"] or r["inf"]
+        ]
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
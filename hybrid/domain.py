@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Source-domain index: which of Semenov / Ferguson / OP has data at (log T, log rho).
+
+Built once from ../OPCD_3.3/border.data, ../Ferguson/border.data and the
+Semenov grid extent, the index answers batched queries on arrays of points
+with per-point validity masks and the blend weights (f1r, f2r, f1p, f2p) that
+hybrid.F90 applies, so callers can mask whole arrays at once instead of
+probing the -100 sentinel of opacity().
+
+- OP, Ferguson: log T inside the border file's range and
+  rho_min(T) <= log rho <= rho_max(T), with the bounds interpolated linearly
+  in log T between border rows
+- Semenov: t[0] < log T < t[-1] (the open range of opacity()) and
+  d[0] <= log rho <= d[-1]
+
+Usage (coverage of the grid in input.dat):
+  python3 domain.py [--input input.dat]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 domain.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .build_hybrid import BlendParams, blend_weights
+from .opacity_io import map_opacity_file, read_input_dat, source_dir
+
+SOURCES = ("semenov", "ferguson", "op")
+
+
+class Border(NamedTuple):
+    """Density range of a source table per log T (border.data)."""
+
+    t: np.ndarray
+    rho_min: np.ndarray
+    rho_max: np.ndarray
+
+
+class DomainQuery(NamedTuple):
+    """Per-point result of DomainIndex.query; all arrays have the input shape."""
+
+    semenov: np.ndarray  # bool
+    ferguson: np.ndarray  # bool
+    op: np.ndarray  # bool
+    f1r: np.ndarray
+    f2r: np.ndarray
+    f1p: np.ndarray
+    f2p: np.ndarray
+
+
+def read_border(path: Path, has_index_col: bool = False) -> Optional[Border]:
+    """Read a border file (row count, then T rho_min rho_max rows); None if missing or malformed.
+
+    Ferguson/border.data has a leading row-index column (``has_index_col``).
+    The file is read once; rows beyond the count are ignored.
+    """
+    try:
+        lines = Path(path).read_text().split("\n")
+    except OSError:
+        return None
+    try:
+        n = int(lines[0].strip())
+        lines = lines[1 : 1 + n]
+    except (ValueError, IndexError):
+        n = None
+    try:
+        data = np.array(" ".join(lines).split(), dtype=np.float64)
+        ncol = 4 if has_index_col else 3
+        data = data.reshape(-1, ncol)
+    except ValueError:
+        return None
+    if data.shape[0] == 0 or (n is not None and data.shape[0] != n):
+        return None
+    cols = data[:, 1:] if has_index_col else data
+    order = np.argsort(cols[:, 0], kind="stable")
+    return Border(*(np.ascontiguousarray(c[order]) for c in cols.T))
+
+
+def _in_border(border: Optional[Border], log_t: np.ndarray, log_rho: np.ndarray) -> np.ndarray:
+    if border is None:
+        return np.zeros(log_t.shape, dtype=bool)
+    lo = np.interp(log_t, border.t, border.rho_min)
+    hi = np.interp(log_t, border.t, border.rho_max)
+    return (log_t >= border.t[0]) & (log_t <= border.t[-1]) & (log_rho >= lo) & (log_rho <= hi)
+
+
+class DomainIndex:
+    """Validity domains of the three source tables plus the hybrid blend parameters."""
+
+    def __init__(
+        self,
+        op: Optional[Border],
+        ferguson: Optional[Border],
+        semenov_t: tuple,
+        semenov_rho: tuple,
+        params: BlendParams = BlendParams(),
+    ):
+        self.op = op
+        self.ferguson = ferguson
+        self.semenov_t = (float(semenov_t[0]), float(semenov_t[1]))
+        self.semenov_rho = (float(semenov_rho[0]), float(semenov_rho[1]))
+        self.params = params
+
+    @classmethod
+    def from_files(
+        cls,
+        op_dir: Optional[Path] = None,
+        ferguson_dir: Optional[Path] = None,
+        semenov_dir: Optional[Path] = None,
+        params: BlendParams = BlendParams(),
+    ) -> "DomainIndex":
+        """Read both border files and the Semenov axes (only the axes are touched).
+
+        Directories default to source_dir() (../OPCD_3.3 etc., or under $OPTAB_SOURCES).
+        """
+        op_dir = op_dir or source_dir("OPCD_3.3")
+        ferguson_dir = ferguson_dir or source_dir("Ferguson")
+        semenov_dir = semenov_dir or source_dir("Semenov")
+        se = map_opacity_file(Path(semenov_dir) / "semenov_ros.data")
+        return cls(
+            read_border(Path(op_dir) / "border.data"),
+            read_border(Path(ferguson_dir) / "border.data", has_index_col=True),
+            (se.t[0], se.t[-1]),
+            (se.d[0], se.d[-1]),
+            params,
+        )
+
+    def valid(self, source: str, log_t, log_rho) -> np.ndarray:
+        """Boolean mask of points inside the data domain of ``source`` (one of SOURCES)."""
+        log_t, log_rho = np.broadcast_arrays(np.asarray(log_t, dtype=np.float64), np.asarray(log_rho, dtype=np.float64))
+        if source == "op":
+            return _in_border(self.op, log_t, log_rho)
+        if source == "ferguson":
+            return _in_border(self.ferguson, log_t, log_rho)
+        if source == "semenov":
+            t0, t1 = self.semenov_t
+            r0, r1 = self.semenov_rho
+            return (log_t > t0) & (log_t < t1) & (log_rho >= r0) & (log_rho <= r1)
+        raise ValueError(f"source must be one of {SOURCES}")
+
+    def query(self, log_t, log_rho) -> DomainQuery:
+        """Validity of every source and the blend weights at each point."""
+        log_t, log_rho = np.broadcast_arrays(np.asarray(log_t, dtype=np.float64), np.asarray(log_rho, dtype=np.float64))
+        masks = [self.valid(name, log_t, log_rho) for name in SOURCES]
+        return DomainQuery(*masks, *blend_weights(log_t, self.params))
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report source-table coverage of the hybrid grid.")
+    parser.add_argument("--input", default="input.dat", help="Grid ranges file (log10 units)")
+    parser.add_argument("--semenov-dir", default=str(source_dir("Semenov")))
+    parser.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")))
+    parser.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")))
+    args = parser.parse_args(argv)
+
+    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(Path(args.input))
+    index = DomainIndex.from_files(Path(args.op_dir), Path(args.ferguson_dir), Path(args.semenov_dir))
+    lt, lr = np.meshgrid(
+        ltmin + dlt * np.arange(nitt), lrmin + dlr * np.arange(nidd), indexing="ij", sparse=True
+    )
+    q = index.query(lt, lr)
+    total = nitt * nidd
+    print(f"{nitt}x{nidd} cells")
+    for name in SOURCES:
+        n = int(getattr(q, name).sum())
+        print(f"  {name:9s} {n:9d} ({100.0 * n / total:5.1f} %)")
+    none = int((~(q.semenov | q.ferguson | q.op)).sum())
+    print(f"  {'none':9s} {none:9d} ({100.0 * none / total:5.1f} %)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Opacity lookup by gas internal energy density instead of temperature.
+
+With the ideal-gas relation used in hybrid.F90,
+    e = RGAS / MMW / (GAMMA - 1) * rho * T      [erg cm^-3],
+log T = log e - log rho - log C, so a hydro code that evolves e needs no
+per-cell inversion: OpacityTable.lookup_energy(log_e, log_rho, gas) does
+that one subtraction inside its workspace and interpolates the T table
+(exactly lookup_all at log_temperature(log_e, log_rho, gas)). GasParams
+holds MMW, GAMMA and RGAS (defaults of hybrid.F90).
+
+Usage:
+  python3 energy.py bench [--root .] [--points 1000000] [--mmw 0.61] [--gamma 1.6667]
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 energy.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+
+class GasParams(NamedTuple):
+    """Ideal-gas constants of e = rgas / mmw / (gamma - 1) * rho * T (defaults of hybrid.F90)."""
+
+    mmw: float = 0.61
+    gamma: float = 5.0 / 3.0
+    rgas: float = 8.31447e7
+
+    @property
+    def log_coef(self) -> float:
+        """log10 of rgas / mmw / (gamma - 1)."""
+        return math.log10(self.rgas / self.mmw / (self.gamma - 1.0))
+
+
+def log_energy(log_t, log_rho, gas: GasParams = GasParams()) -> np.ndarray:
+    """log10 internal energy density [erg cm^-3] at (log T, log rho)."""
+    return np.add(log_t, log_rho) + gas.log_coef
+
+
+def log_temperature(log_e, log_rho, gas: GasParams = GasParams()) -> np.ndarray:
+    """log10 T [K] at (log e, log rho)."""
+    return np.subtract(log_e, log_rho) - gas.log_coef
+
+
+def bench(table, gas: GasParams = GasParams(), points: int = 1_000_000, repeat: int = 5, seed: int = 0) -> dict:
+    """Lookup from log e: converting to log T in a caller buffer, then lookup_all, vs lookup_energy."""
+    rng = np.random.default_rng(seed)
+    lr = rng.uniform(table.lrmin, table.lrmax, points)
+    le = log_energy(rng.uniform(table.ltmin, table.ltmax, points), lr, gas)
+    out_t, out_e = np.empty((3, points)), np.empty((3, points))
+    work = table.workspace(points)
+    lt_buf = np.empty(points)
+    c = gas.log_coef
+
+    def via_t():
+        np.subtract(le, lr, out=lt_buf)
+        np.subtract(lt_buf, c, out=lt_buf)
+        table.lookup_all(lt_buf, lr, out=out_t, work=work)
+
+    def via_e():
+        table.lookup_energy(le, lr, gas, out=out_e, work=work)
+
+    res = {"points": points}
+    for name, fn in (("invert_then_lookup", via_t), ("lookup_energy", via_e)):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        res[f"{name}_seconds"] = best
+    res["max_abs_diff"] = float(np.nanmax(np.abs(out_e - out_t))) if points else 0.0
+    return res
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Opacity lookup by internal energy density (ideal gas).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("bench", help="lookup_energy vs converting to log T before lookup_all")
+    m.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat, input.dat")
+    m.add_argument("--points", type=int, default=1_000_000)
+    m.add_argument("--repeat", type=int, default=5)
+    m.add_argument("--mmw", type=float, default=GasParams().mmw, help="Mean molecular weight")
+    m.add_argument("--gamma", type=float, default=GasParams().gamma, help="Adiabatic index")
+    m.add_argument("--rgas", type=float, default=GasParams().rgas, help="Gas constant [erg/K/mol]")
+    args = parser.parse_args(argv)
+
+    gas = GasParams(args.mmw, args.gamma, args.rgas)
+    if gas.gamma <= 1.0 or gas.mmw <= 0.0:
+        parser.error("need gamma > 1 and mmw > 0")
+    from .opacity_lookup import OpacityTable
+
+    r = bench(OpacityTable.from_files(Path(args.root)), gas, args.points, args.repeat)
+    t, e = r["invert_then_lookup_seconds"], r["lookup_energy_seconds"]
+    print(f"{r['points']} points: invert + lookup_all {t * 1e3:.1f} ms, lookup_energy {e * 1e3:.1f} ms "
+          f"({t / e:.2f}x); max difference {r['max_abs_diff']:.1e}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
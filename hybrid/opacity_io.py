@@ -0,0 +1,284 @@
+"""
+Readers and writers for the files shared by the hybrid table tools.
+
+- input.dat: log10 ranges (tmp_min tmp_max dtmp rho_min rho_max drho)
+- kR.dat, kP.dat, dust.dat: single-record Fortran unformatted arrays (nitt x nidd)
+- optional derivative tables (DERIV_FILES), same layout
+- optional monotone Hermite slopes (HERMITE_FILES, written by cubic.py), same layout
+- Source tables (semenov_*.data, ferguson_*.data, op_*.data): two records,
+  (nt, nd) as int32 followed by t(nt), d(nd), data(nt, nd) as float64
+
+All binaries are big-endian with 4-byte record markers, as written by gfortran
+with -fconvert=big-endian. Readers locate records by scanning the markers and
+return read-only np.memmap views (big-endian dtype, Fortran order), so opening
+a table reads only a few bytes and slicing touches only the pages it needs.
+Parsed tables are also kept in a native-endian cache (table_cache.py).
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import struct
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import table_cache
+from .tracing import span
+
+# d log kappa_R / d log T, d log kappa_R / d log rho, then the same for kappa_P
+DERIV_FILES = ("dlkRdlT.dat", "dlkRdlrho.dat", "dlkPdlT.dat", "dlkPdlrho.dat")
+# Limited slopes of log kappa_R per grid step along log T and log rho, then the same for kappa_P
+HERMITE_FILES = ("hkRdi.dat", "hkRdj.dat", "hkPdi.dat", "hkPdj.dat")
+# Parent of Semenov/, Ferguson/ and OPCD_3.3/ (default: .., i.e. run from hybrid/)
+SOURCES_ENV = "OPTAB_SOURCES"
+
+
+def source_dir(name: str) -> Path:
+    """Source table directory ``name`` (e.g. "Semenov", "OPCD_3.3") under $OPTAB_SOURCES, else ../name."""
+    return Path(os.environ.get(SOURCES_ENV) or "..") / name
+
+
+class SourceTable(NamedTuple):
+    """A source opacity table on its native (log T, log rho) grid."""
+
+    t: np.ndarray  # log10 T, shape (nt,)
+    d: np.ndarray  # log10 rho, shape (nd,)
+    data: np.ndarray  # log10 kappa, shape (nt, nd), Fortran order
+
+
+def read_input_dat(path: Path) -> Tuple[int, int, float, float, float, float, float, float]:
+    """Read input.dat with log10 ranges: tmp_min tmp_max dtmp rho_min rho_max drho
+
+    Returns: (nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr)
+    """
+    tokens = []
+    with path.open("r") as f:
+        for line in f:
+            parts = line.strip().split()
+            for p in parts:
+                try:
+                    tokens.append(float(p))
+                except Exception:
+                    pass
+    if len(tokens) < 6:
+        raise ValueError("input.dat must contain at least 6 numbers: tmp_min tmp_max dtmp rho_min rho_max drho (log10 units)")
+    ltmin, ltmax, dlt, lrmin, lrmax, dlr = tokens[:6]
+    # Compute counts consistent with Fortran logic
+    nitt = int((ltmax - ltmin) / dlt) + 1
+    nidd = int((lrmax - lrmin) / dlr) + 1
+    return nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr
+
+
+def scan_records(
+    path: Path, marker_bytes: int = 4, max_records: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """Return (payload offset, payload size) of each Fortran record in ``path``.
+
+    Only the record markers are read; payloads are skipped with seek().
+    """
+    marker_fmt = ">i" if marker_bytes == 4 else ">q"
+    size = path.stat().st_size
+    records = []
+    with path.open("rb") as f:
+        pos = 0
+        while pos < size and (max_records is None or len(records) < max_records):
+            f.seek(pos)
+            head = f.read(marker_bytes)
+            if len(head) != marker_bytes:
+                raise ValueError(f"{path}: unexpected EOF reading record header")
+            (nbytes,) = struct.unpack(marker_fmt, head)
+            end = pos + marker_bytes + nbytes
+            if nbytes < 0 or end + marker_bytes > size:
+                raise ValueError(f"{path}: unexpected EOF reading payload")
+            f.seek(end)
+            (nbytes2,) = struct.unpack(marker_fmt, f.read(marker_bytes))
+            if nbytes2 != nbytes:
+                raise ValueError(f"{path}: trailer size {nbytes2} != header {nbytes}")
+            records.append((pos + marker_bytes, nbytes))
+            pos = end + marker_bytes
+    return records
+
+
+def map_array(path: Path, offset: int, dtype, shape: Tuple[int, ...], order: str = "F") -> np.memmap:
+    """Read-only memory map of an array stored at ``offset`` in ``path``.
+
+    Nothing is read until the array (or a slice of it) is accessed, and slices
+    are views that only touch the pages they cover.
+    """
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+
+
+def read_fortran_unformatted_matrix(
+    path: Path, nitt: int, nidd: int, dtype: np.dtype = np.dtype(">f8"), marker_bytes: int = 4
+) -> np.ndarray:
+    """Map a single-record Fortran unformatted array of shape (nitt, nidd).
+
+    Assumes big-endian 64-bit floats as written by gfortran with -fconvert=big-endian
+    and a single WRITE of the full array (adds 4-byte record markers around payload).
+    The result is a read-only memmap in Fortran order; no data is copied.
+    """
+    path = Path(path)
+    records = scan_records(path, marker_bytes, max_records=1)
+    if not records:
+        raise ValueError(f"{path}: unexpected EOF reading record header")
+    offset, nbytes = records[0]
+    expected = dtype.itemsize * nitt * nidd
+    if nbytes != expected:
+        raise ValueError(
+            f"{path}: record size {nbytes} != expected {expected} for ({nitt}x{nidd})"
+        )
+    # Shape as Fortran (temperature, density)
+    return map_array(path, offset, dtype, (nitt, nidd), order="F")
+
+
+def read_opacity_file(path: Path, marker_bytes: int = 4) -> SourceTable:
+    """Read a two-record source table (Semenov, Ferguson or OP).
+
+    Served from the native-endian table cache when enabled (see table_cache.py);
+    otherwise t, d and data are read-only big-endian views into the file.
+    Either way the arrays are memory-mapped, not copied.
+    """
+    path = Path(path)
+    with span("read.source", file=path.name) as sp:
+        arrays = table_cache.cached(
+            "source",
+            [path],
+            lambda: map_opacity_file(path, marker_bytes)._asdict(),
+            extra=f"marker_bytes={marker_bytes}",
+        )
+        sp.nbytes = arrays["data"].nbytes
+    return SourceTable(arrays["t"], arrays["d"], arrays["data"])
+
+
+def map_opacity_file(path: Path, marker_bytes: int = 4) -> SourceTable:
+    """Map a two-record source table directly, bypassing the cache.
+
+    t, d and data are read-only big-endian views into the file; convert with
+    ``np.asarray(..., dtype=np.float64)`` only where a native copy is needed.
+    """
+    path = Path(path)
+    with span("read.records", file=path.name):
+        records = scan_records(path, marker_bytes, max_records=2)
+    if len(records) < 2:
+        raise ValueError(f"{path}: expected 2 records, found {len(records)}")
+    (off, nbytes), (off2, nbytes2) = records
+    if nbytes < 8:
+        raise ValueError(f"{path}: first record must contain nt and nd")
+    with path.open("rb") as f:
+        f.seek(off)
+        nt, nd = struct.unpack(">ii", f.read(8))
+    need = nt + nd + nt * nd
+    if nbytes2 != 8 * need:
+        raise ValueError(f"{path}: second record size {nbytes2} != expected {8 * need}")
+    f8 = np.dtype(">f8")
+    t = map_array(path, off2, f8, (nt,))
+    d = map_array(path, off2 + 8 * nt, f8, (nd,))
+    data = map_array(path, off2 + 8 * (nt + nd), f8, (nt, nd), order="F")
+    return SourceTable(t, d, data)
+
+
+class HybridTable(NamedTuple):
+    """A hybrid table (kR.dat, kP.dat, dust.dat) with its input.dat grid."""
+
+    ltmin: float
+    ltmax: float
+    dlt: float
+    lrmin: float
+    lrmax: float
+    dlr: float
+    log_kr: np.ndarray  # log10 kappa_R, shape (nitt, nidd)
+    log_kp: np.ndarray  # log10 kappa_P, shape (nitt, nidd)
+    dust: np.ndarray  # 0/1 flag, shape (nitt, nidd)
+
+    @property
+    def nitt(self) -> int:
+        return self.log_kr.shape[0]
+
+    @property
+    def nidd(self) -> int:
+        return self.log_kr.shape[1]
+
+
+def read_hybrid_table(root: Path = Path("."), input_path: Optional[Path] = None) -> HybridTable:
+    """Read kR.dat, kP.dat and dust.dat from ``root`` as log10 opacities.
+
+    The grid comes from input.dat (``root / "input.dat"`` unless given). The
+    parsed table is cached keyed on all four files.
+    """
+    root = Path(root)
+    input_path = root / "input.dat" if input_path is None else Path(input_path)
+    paths = [input_path, root / "kR.dat", root / "kP.dat", root / "dust.dat"]
+
+    def parse():
+        nitt, nidd, *grid = read_input_dat(input_path)
+        kr = read_fortran_unformatted_matrix(paths[1], nitt, nidd)
+        kp = read_fortran_unformatted_matrix(paths[2], nitt, nidd)
+        with np.errstate(divide="ignore", invalid="ignore"), span("read.log10", nbytes=kr.nbytes + kp.nbytes):
+            log_kr = np.log10(kr)
+            log_kp = np.log10(kp)
+        return {
+            "grid": np.array(grid, dtype=np.float64),
+            "log_kr": log_kr,
+            "log_kp": log_kp,
+            "dust": read_fortran_unformatted_matrix(paths[3], nitt, nidd),
+        }
+
+    with span("read.hybrid", root=str(root)):
+        arrays = table_cache.cached("hybrid", paths, parse)
+    ltmin, ltmax, dlt, lrmin, lrmax, dlr = (float(v) for v in arrays["grid"])
+    return HybridTable(
+        ltmin, ltmax, dlt, lrmin, lrmax, dlr, arrays["log_kr"], arrays["log_kp"], arrays["dust"]
+    )
+
+
+def to_native(table: SourceTable) -> SourceTable:
+    """Native-endian in-memory copy of a mapped source table."""
+    return SourceTable(*(np.asarray(a, dtype=np.float64) for a in table))
+
+
+def write_fortran_unformatted_matrix(path: Path, arr: np.ndarray) -> None:
+    """Write ``arr`` as one big-endian float64 Fortran record in column-major order.
+
+    Produces the same bytes as ``write(8) arr`` in hybrid.F90.
+    """
+    payload = np.asarray(arr, dtype=">f8").tobytes(order="F")
+    marker = struct.pack(">i", len(payload))
+    with span("write.record", nbytes=len(payload), file=path.name), path.open("wb") as f:
+        f.write(marker)
+        f.write(payload)
+        f.write(marker)
+
+
+def write_opacity_file(path: Path, table: SourceTable) -> None:
+    """Write a source table in the two-record layout read by read_opacity_file.
+
+    Produces the same bytes as ``write(1) nt, nd`` / ``write(1) t, d, data`` with
+    -fconvert=big-endian (read_op.F90, Ferguson/read.F90).
+    """
+    t, d, data = (np.asarray(a, dtype=np.float64) for a in table)
+    dims = np.array(data.shape, dtype=">i4").tobytes()
+    payload = t.astype(">f8").tobytes() + d.astype(">f8").tobytes() + data.astype(">f8").tobytes(order="F")
+    with path.open("wb") as f:
+        for rec in (dims, payload):
+            marker = struct.pack(">i", len(rec))
+            f.write(marker + rec + marker)
+
+
+def fortran_list_real(x: float) -> str:
+    """Format a real(8) as gfortran list-directed output (``write(u,*) x``)."""
+    ax = abs(x)
+    if ax == 0.0 or 0.1 <= ax < 1e17:
+        k = 1 if ax < 1.0 else int(math.floor(math.log10(ax))) + 1
+        if ax < 1.0 and ax != 0.0:
+            k = 0
+        return " " + ("%.*f" % (17 - k, x)).rjust(20) + " " * 5
+    mant, exp = ("%.16E" % x).split("E")
+    return " " + ("%sE%+04d" % (mant, int(exp))).rjust(25)
+
+
+def fortran_list_int(n: int) -> str:
+    """Format a default integer as gfortran list-directed output."""
+    return " " + ("%d" % n).rjust(11)
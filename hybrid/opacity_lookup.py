@@ -0,0 +1,340 @@
+"""
+Batched runtime lookup in the hybrid opacity table.
+
+Loads kR.dat, kP.dat and dust.dat on the uniform grid described by input.dat
+(through the table cache, see opacity_io.read_hybrid_table) and evaluates
+log10 kappa for arrays of (log T, log rho) by bilinear interpolation.
+Cell indices come from O(1) arithmetic on the uniform grid, and every step
+is a NumPy ufunc writing into preallocated buffers, so repeated calls of
+the same size do not allocate.
+
+When the derivative tables written by build_hybrid.py --derivs are loaded,
+lookup_derivs returns log10 kappa and d log kappa / d log T, d log rho for
+both means in one pass over the same cell indices. lookup_energy takes log
+internal energy density in place of log T for an ideal gas (energy.GasParams).
+
+Example:
+    table = OpacityTable.from_files(".")
+    work = table.workspace(ncell)
+    lkr = np.empty(ncell); lkp = np.empty(ncell); outside = np.empty(ncell, bool)
+    for step in ...:
+        table.lookup(log_t, log_rho, out_r=lkr, out_p=lkp, outside=outside, work=work)
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .energy import GasParams
+from .opacity_io import DERIV_FILES, read_fortran_unformatted_matrix, read_hybrid_table
+
+
+class LookupWorkspace:
+    """Scratch buffers for lookups of ``n`` points.
+
+    A workspace must not be shared between threads running lookups concurrently.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.ft = np.empty(n)
+        self.fr = np.empty(n)
+        self.a = np.empty(n)
+        self.b = np.empty(n)
+        self.c = np.empty(n)
+        self.it = np.empty(n, dtype=np.intp)
+        self.ir = np.empty(n, dtype=np.intp)
+        self.idx = np.empty(n, dtype=np.intp)
+        self.idx2 = np.empty(n, dtype=np.intp)
+        self.mask = np.empty(n, dtype=bool)
+        self.outside = np.empty(n, dtype=bool)
+
+
+def _flat(arr: Optional[np.ndarray], n: int, dtype, name: str) -> Optional[np.ndarray]:
+    """Return a flat view of a caller-supplied output buffer."""
+    if arr is None:
+        return None
+    if arr.size != n or arr.dtype != dtype:
+        raise ValueError(f"{name} must have {n} elements of dtype {np.dtype(dtype)}")
+    flat = arr.reshape(-1)
+    if not np.shares_memory(flat, arr):
+        raise ValueError(f"{name} must be contiguous")
+    return flat
+
+
+class OpacityValues(NamedTuple):
+    """log10 kappa_R, log10 kappa_P and the dust flag at the same points."""
+
+    log_kr: np.ndarray
+    log_kp: np.ndarray
+    dust: np.ndarray
+
+
+class OpacityDerivs(NamedTuple):
+    """log10 kappa and its derivatives with respect to log10 T and log10 rho."""
+
+    log_kr: np.ndarray
+    dkr_dt: np.ndarray
+    dkr_dr: np.ndarray
+    log_kp: np.ndarray
+    dkp_dt: np.ndarray
+    dkp_dr: np.ndarray
+
+
+class OpacityTable:
+    """Hybrid opacity table on a uniform (log T, log rho) grid.
+
+    ``log_kr``, ``log_kp`` and ``dust`` have shape (nitt, nidd); row i is
+    log T = ltmin + dlt * i and column j is log rho = lrmin + dlr * j.
+    Points outside the table are evaluated at the nearest table edge and
+    reported in the ``outside`` mask. ``derivs`` optionally holds the four
+    derivative tables (dkr_dt, dkr_dr, dkp_dt, dkp_dr) on the same grid.
+    """
+
+    def __init__(
+        self,
+        ltmin: float,
+        dlt: float,
+        lrmin: float,
+        dlr: float,
+        log_kr: np.ndarray,
+        log_kp: np.ndarray,
+        dust: np.ndarray,
+        derivs: Optional[Sequence[np.ndarray]] = None,
+    ):
+        if log_kr.shape != log_kp.shape or log_kr.shape != dust.shape:
+            raise ValueError("kR, kP and dust tables must have the same shape")
+        if min(log_kr.shape) < 2:
+            raise ValueError("table must have at least 2 points along each axis")
+        self.ltmin = float(ltmin)
+        self.dlt = float(dlt)
+        self.lrmin = float(lrmin)
+        self.dlr = float(dlr)
+        self.nitt, self.nidd = log_kr.shape
+        # C-contiguous copies so that cell (i, j) is at flat index i * nidd + j
+        self.log_kr = np.ascontiguousarray(log_kr, dtype=np.float64)
+        self.log_kp = np.ascontiguousarray(log_kp, dtype=np.float64)
+        self.dust = np.ascontiguousarray(dust, dtype=np.float64)
+        self._flat_kr = self.log_kr.reshape(-1)
+        self._flat_kp = self.log_kp.reshape(-1)
+        self._flat_dust = self.dust.reshape(-1)
+        self._flat_derivs = None
+        if derivs is not None:
+            if len(derivs) != 4 or any(np.shape(d) != log_kr.shape for d in derivs):
+                raise ValueError("derivs must be four tables with the shape of kR")
+            self._flat_derivs = tuple(np.ascontiguousarray(d, dtype=np.float64).reshape(-1) for d in derivs)
+        self._work: Optional[LookupWorkspace] = None
+
+    @classmethod
+    def from_files(
+        cls, root: Path = Path("."), input_path: Optional[Path] = None, derivs: bool = False
+    ) -> "OpacityTable":
+        """Load kR.dat, kP.dat and dust.dat from ``root`` (grid from input.dat).
+
+        With ``derivs`` the derivative tables (opacity_io.DERIV_FILES) are loaded too.
+        """
+        t = read_hybrid_table(root, input_path)
+        d = None
+        if derivs:
+            d = [read_fortran_unformatted_matrix(Path(root) / name, t.nitt, t.nidd) for name in DERIV_FILES]
+        return cls(t.ltmin, t.dlt, t.lrmin, t.dlr, t.log_kr, t.log_kp, t.dust, d)
+
+    @property
+    def ltmax(self) -> float:
+        return self.ltmin + self.dlt * (self.nitt - 1)
+
+    @property
+    def lrmax(self) -> float:
+        return self.lrmin + self.dlr * (self.nidd - 1)
+
+    def workspace(self, n: int) -> LookupWorkspace:
+        """Allocate scratch buffers for lookups of ``n`` points."""
+        return LookupWorkspace(n)
+
+    def _get_work(self, n: int, work: Optional[LookupWorkspace]) -> LookupWorkspace:
+        if work is not None:
+            if work.n != n:
+                raise ValueError(f"workspace is for {work.n} points, got {n}")
+            return work
+        if self._work is None or self._work.n != n:
+            self._work = self.workspace(n)
+        return self._work
+
+    def _locate(self, log_t, log_rho, w: LookupWorkspace) -> None:
+        """Fill w.idx (flat index of the lower-left corner), w.ft/w.fr (weights) and w.outside."""
+        ft, fr, mask = w.ft, w.fr, w.mask
+        np.subtract(log_t, self.ltmin, out=ft)
+        np.divide(ft, self.dlt, out=ft)
+        np.subtract(log_rho, self.lrmin, out=fr)
+        np.divide(fr, self.dlr, out=fr)
+
+        # outside = not (0 <= f <= n - 1) on either axis; NaN counts as outside
+        np.greater_equal(ft, 0.0, out=w.outside)
+        np.less_equal(ft, self.nitt - 1, out=mask)
+        np.logical_and(w.outside, mask, out=w.outside)
+        np.greater_equal(fr, 0.0, out=mask)
+        np.logical_and(w.outside, mask, out=w.outside)
+        np.less_equal(fr, self.nidd - 1, out=mask)
+        np.logical_and(w.outside, mask, out=w.outside)
+        np.logical_not(w.outside, out=w.outside)
+
+        for f, i, n in ((ft, w.it, self.nitt), (fr, w.ir, self.nidd)):
+            np.isnan(f, out=mask)
+            np.copyto(f, 0.0, where=mask)
+            np.clip(f, 0.0, n - 1, out=f)
+            np.floor(f, out=w.a)
+            np.copyto(i, w.a, casting="unsafe")
+            np.minimum(i, n - 2, out=i)
+            # f becomes the fractional position inside the cell
+            np.subtract(f, i, out=f)
+
+        np.multiply(w.it, self.nidd, out=w.idx)
+        np.add(w.idx, w.ir, out=w.idx)
+
+    def _gather(self, flat, idx: np.ndarray, out: np.ndarray, w: LookupWorkspace) -> np.ndarray:
+        """Table values at flat indices ``idx`` as float64 (hook for packed tables)."""
+        # mode="clip" writes straight into ``out`` ("raise" buffers it); _locate clamps idx
+        return np.take(flat, idx, out=out, mode="clip")
+
+    def _interp(self, flat, w: LookupWorkspace, out: np.ndarray) -> np.ndarray:
+        """Bilinear interpolation of ``flat`` at the located cells into ``out``."""
+        a, b, c = w.a, w.b, w.c
+        # row i: a + fr * (b - a)
+        self._gather(flat, w.idx, a, w)
+        np.add(w.idx, 1, out=w.idx2)
+        self._gather(flat, w.idx2, b, w)
+        np.subtract(b, a, out=b)
+        np.multiply(b, w.fr, out=b)
+        np.add(a, b, out=a)
+        # row i + 1
+        np.add(w.idx, self.nidd, out=w.idx2)
+        self._gather(flat, w.idx2, b, w)
+        np.add(w.idx2, 1, out=w.idx2)
+        self._gather(flat, w.idx2, c, w)
+        np.subtract(c, b, out=c)
+        np.multiply(c, w.fr, out=c)
+        np.add(b, c, out=b)
+        # along T
+        np.subtract(b, a, out=b)
+        np.multiply(b, w.ft, out=b)
+        np.add(a, b, out=out)
+        return out
+
+    def _prepare(self, log_t, log_rho, work, log_coef: Optional[float] = None):
+        """Locate the points; with ``log_coef`` the first argument is log e (see lookup_energy)."""
+        log_t = np.asarray(log_t, dtype=np.float64)
+        log_rho = np.asarray(log_rho, dtype=np.float64)
+        if log_t.shape != log_rho.shape:
+            log_t, log_rho = np.broadcast_arrays(log_t, log_rho)
+        shape = log_t.shape
+        n = log_t.size
+        w = self._get_work(n, work)
+        log_t, log_rho = log_t.reshape(-1), log_rho.reshape(-1)
+        if log_coef is not None:
+            # log T = log e - log rho - log C into w.c, which _locate does not use
+            log_t = np.subtract(log_t, log_rho, out=w.c)
+            np.subtract(log_t, log_coef, out=log_t)
+        self._locate(log_t, log_rho, w)
+        return shape, n, w
+
+    def _finish(self, shape, n, w, out, flat_out, outside):
+        if outside is not None:
+            flat = _flat(outside, n, np.bool_, "outside")
+            np.copyto(flat, w.outside)
+        return out if out is not None else flat_out.reshape(shape)
+
+    def _single(self, flat_table, log_t, log_rho, out, outside, work):
+        shape, n, w = self._prepare(log_t, log_rho, work)
+        flat_out = _flat(out, n, np.float64, "out")
+        if flat_out is None:
+            flat_out = np.empty(n)
+        self._interp(flat_table, w, flat_out)
+        return self._finish(shape, n, w, out, flat_out, outside)
+
+    def kappa_R(self, log_t, log_rho, out=None, outside=None, work=None) -> np.ndarray:
+        """log10 Rosseland-mean opacity [cm^2/g] at (log T, log rho)."""
+        return self._single(self._flat_kr, log_t, log_rho, out, outside, work)
+
+    def kappa_P(self, log_t, log_rho, out=None, outside=None, work=None) -> np.ndarray:
+        """log10 Planck-mean opacity [cm^2/g] at (log T, log rho)."""
+        return self._single(self._flat_kp, log_t, log_rho, out, outside, work)
+
+    def dust_fraction(self, log_t, log_rho, out=None, outside=None, work=None) -> np.ndarray:
+        """Bilinearly interpolated dust flag (0 gas only, 1 dusty)."""
+        return self._single(self._flat_dust, log_t, log_rho, out, outside, work)
+
+    def lookup(
+        self, log_t, log_rho, out_r=None, out_p=None, outside=None, work=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """log10 kappa_R and kappa_P in one pass over the same cell indices."""
+        shape, n, w = self._prepare(log_t, log_rho, work)
+        flat_r = _flat(out_r, n, np.float64, "out_r")
+        flat_p = _flat(out_p, n, np.float64, "out_p")
+        if flat_r is None:
+            flat_r = np.empty(n)
+        if flat_p is None:
+            flat_p = np.empty(n)
+        self._interp(self._flat_kr, w, flat_r)
+        self._interp(self._flat_kp, w, flat_p)
+        if outside is not None:
+            np.copyto(_flat(outside, n, np.bool_, "outside"), w.outside)
+        lkr = out_r if out_r is not None else flat_r.reshape(shape)
+        lkp = out_p if out_p is not None else flat_p.reshape(shape)
+        return lkr, lkp
+
+    def lookup_all(self, log_t, log_rho, out=None, outside=None, work=None) -> OpacityValues:
+        """log10 kappa_R, kappa_P and the dust flag in one pass over the same cell indices.
+
+        ``out`` may be a float64 array of shape (3,) + shape of the inputs,
+        filled in OpacityValues order.
+        """
+        shape, n, w = self._prepare(log_t, log_rho, work)
+        return self._values(shape, n, w, out, outside)
+
+    def lookup_energy(
+        self, log_e, log_rho, gas: GasParams = GasParams(), out=None, outside=None, work=None
+    ) -> OpacityValues:
+        """lookup_all at (log e, log rho) for an ideal gas, e = rgas / mmw / (gamma - 1) * rho * T.
+
+        log e [erg cm^-3] is turned into log T (one subtraction per point)
+        inside the workspace, so the result equals
+        lookup_all(energy.log_temperature(log_e, log_rho, gas), log_rho).
+        """
+        shape, n, w = self._prepare(log_e, log_rho, work, gas.log_coef)
+        return self._values(shape, n, w, out, outside)
+
+    def _values(self, shape, n, w, out, outside) -> OpacityValues:
+        if out is None:
+            out = np.empty((3,) + shape)
+        elif out.shape != (3,) + shape or out.dtype != np.float64:
+            raise ValueError(f"out must be a float64 array of shape {(3,) + shape}")
+        for k, flat in enumerate((self._flat_kr, self._flat_kp, self._flat_dust)):
+            self._interp(flat, w, _flat(out[k], n, np.float64, "out"))
+        if outside is not None:
+            np.copyto(_flat(outside, n, np.bool_, "outside"), w.outside)
+        return OpacityValues(*out)
+
+    def lookup_derivs(self, log_t, log_rho, out=None, outside=None, work=None) -> OpacityDerivs:
+        """log10 kappa_R, kappa_P and their log T / log rho derivatives in one pass.
+
+        The derivative tables are interpolated bilinearly with the same cell
+        indices and weights as the values. ``out`` may be a float64 array of
+        shape (6,) + shape of the inputs, filled in OpacityDerivs order.
+        """
+        if self._flat_derivs is None:
+            raise ValueError("no derivative tables loaded (build with build_hybrid.py --derivs)")
+        shape, n, w = self._prepare(log_t, log_rho, work)
+        if out is None:
+            out = np.empty((6,) + shape)
+        elif out.shape != (6,) + shape or out.dtype != np.float64:
+            raise ValueError(f"out must be a float64 array of shape {(6,) + shape}")
+        dkr_dt, dkr_dr, dkp_dt, dkp_dr = self._flat_derivs
+        tables = (self._flat_kr, dkr_dt, dkr_dr, self._flat_kp, dkp_dt, dkp_dr)
+        for k, flat in enumerate(tables):
+            self._interp(flat, w, _flat(out[k], n, np.float64, "out"))
+        if outside is not None:
+            np.copyto(_flat(outside, n, np.bool_, "outside"), w.outside)
+        return OpacityDerivs(*out)
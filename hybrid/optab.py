@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Single command-line entry point for the hybrid table tools.
+
+  optab build    [build_hybrid.py options]   kR.dat, kP.dat, dust.dat from the source tables
+  optab lookup   [options] LOG_T LOG_RHO ... log kappa_R, log kappa_P and dust at points
+  optab diagnose [diagnostics.py options]    one-pass table statistics (JSON)
+  optab plot     [plot_opacity.py options]   maps and slices (--batch: render.py options)
+  optab export   FORMAT [options]            compact | cubic | adaptive | pyramid | tiles | slices | contours
+
+Each subcommand imports its module only when it runs, so lookups and
+diagnostics never load Matplotlib (about 0.6 s on its own). A one-point
+lookup or a diagnose run still takes about 0.2 s: roughly 0.1 s to import
+NumPy and the rest for the table modules, argparse and reading the table.
+Source tables are found under --sources DIR (or $OPTAB_SOURCES): the parent
+of Semenov/, Ferguson/ and OPCD_3.3/, by default ".." as when run from hybrid/.
+--trace FILE writes a timing trace of the run (tracing.py).
+
+Installed with ``pip install .`` from the repository root, or run as
+``python3 optab.py`` here.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import sys
+from typing import Optional
+
+if not __package__:  # run as a script (python3 optab.py): import the siblings as the hybrid package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "hybrid"
+
+# subcommand -> module whose main(argv) it runs
+COMMANDS = {"build": "build_hybrid", "diagnose": "diagnostics", "plot": "plot_opacity"}
+EXPORTS = {
+    "compact": "compact",
+    "cubic": "cubic",
+    "adaptive": "adaptive",
+    "pyramid": "pyramid",
+    "tiles": "tiled",
+    "slices": "slices",
+    "contours": "contours",
+}
+
+
+def _run(module: str, prog: str, argv: list) -> int:
+    """Import ``module`` and run its main(argv), with ``prog`` in its usage lines."""
+    saved = sys.argv[0]
+    sys.argv[0] = prog  # the tools' parsers take their program name from here
+    try:
+        rc = importlib.import_module(f".{module}", __package__).main(argv)
+    finally:
+        sys.argv[0] = saved
+    return int(rc or 0)
+
+
+def lookup(argv: Optional[list] = None) -> int:
+    """Interpolate a table at points given on the command line or in a text file."""
+    parser = argparse.ArgumentParser(prog="optab lookup", description="Interpolate kappa at (log T, log rho) points.")
+    parser.add_argument("points", nargs="*", type=float, metavar="LOG_T LOG_RHO", help="Pairs of coordinates")
+    parser.add_argument("--file", default=None, help="Text file with log T, log rho columns ('-' for stdin)")
+    parser.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat")
+    parser.add_argument("--input", default=None, help="input.dat (default: <root>/input.dat)")
+    parser.add_argument("--compact", default=None, help="Read this compact.py table instead of --root")
+    parser.add_argument("--cubic", action="store_true", help="Monotone cubic interpolation (cubic.py build first)")
+    parser.add_argument("--linear", action="store_true", help="Inputs are T [K] and rho [g/cc]")
+    parser.add_argument("--energy", action="store_true",
+                        help="First column is internal energy density e (ideal gas, hybrid.F90 MMW/GAMMA)")
+    args = parser.parse_args(argv)
+    if len(args.points) % 2:
+        parser.error("points come in LOG_T LOG_RHO pairs")
+
+    import numpy as np
+    from pathlib import Path
+
+    pts = [np.asarray(args.points, dtype=np.float64).reshape(-1, 2)]
+    if args.file:
+        pts.append(np.loadtxt(sys.stdin if args.file == "-" else args.file, usecols=(0, 1), ndmin=2, comments="#"))
+    pts = np.concatenate(pts)
+    if args.linear:
+        pts = np.log10(pts)
+
+    root = Path(args.root)
+    input_path = Path(args.input) if args.input else None
+    if args.compact:
+        from .compact import CompactTable
+
+        table = CompactTable.load(Path(args.compact))
+    elif args.cubic:
+        from .cubic import CubicTable
+
+        table = CubicTable.from_files(root, input_path)
+    else:
+        from .opacity_lookup import OpacityTable
+
+        table = OpacityTable.from_files(root, input_path)
+    outside = np.empty(len(pts), dtype=bool)
+    if args.energy:
+        values = table.lookup_energy(pts[:, 0], pts[:, 1], outside=outside)
+    else:
+        values = table.lookup_all(pts[:, 0], pts[:, 1], outside=outside)
+    rows = np.column_stack([pts, values.log_kr, values.log_kp, values.dust, outside])
+    np.savetxt(sys.stdout, rows, fmt=["%.6f", "%.6f", "%.10g", "%.10g", "%.6g", "%d"],
+               header=f"{'log_e' if args.energy else 'log_t'} log_rho log_kr log_kp dust outside")
+    return 0
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="optab",
+        description="Hybrid opacity table tools.",
+        epilog="Run 'optab COMMAND -h' for the options of a command.",
+    )
+    parser.add_argument("--sources", default=None, metavar="DIR",
+                        help="Parent of Semenov/, Ferguson/, OPCD_3.3/ (default: $OPTAB_SOURCES or ..)")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help="Write a timing trace of the run (same as OPTAB_TRACE=FILE; see tracing.py)")
+    parser.add_argument("command", choices=("build", "lookup", "diagnose", "plot", "export"))
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Options of the command")
+    args = parser.parse_args(argv)
+    if args.sources:
+        os.environ["OPTAB_SOURCES"] = args.sources  # read by opacity_io.source_dir()
+    if args.trace:
+        from . import tracing
+
+        tracing.enable(args.trace)
+
+    rest = list(args.args)
+    if args.command == "lookup":
+        return lookup(rest)
+    if args.command == "export":
+        if not rest or rest[0] not in EXPORTS:
+            parser.error(f"export needs a format: {', '.join(EXPORTS)}")
+        return _run(EXPORTS[rest[0]], f"optab export {rest[0]}", rest[1:])
+    if args.command == "plot" and rest[:1] == ["--batch"]:
+        return _run("render", "optab plot --batch", rest[1:])
+    return _run(COMMANDS[args.command], f"optab {args.command}", rest)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
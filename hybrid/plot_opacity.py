@@ -4,7 +4,7 @@ Plot opacity tables similarly to opacity_table.pro, with modifications:
 - Outputs both transparent PNG and transparent PDF
 - Visualizes kR (Rosseland), kP (Planck), and dust side-by-side
 
-Inputs expected in current directory:
+Inputs expected in --root (default: current directory):
 - opacity.in: text header (nitt, nidd, topmin/topmax, dopmin/dopmax[, depletion])
 - kR.dat, kP.dat, dust.dat: Fortran unformatted big-endian float64 arrays (nitt x nidd)
 - temp_fe_op.data: text with single value for vertical marker
@@ -12,76 +12,30 @@ Inputs expected in current directory:
 Optional overlays (skipped if files not found or not readable):
 - ../OPCD_3.3/border.data (OP border; columns: T, rho_min, rho_max)
 - ../Ferguson/border.data (FERGUSON border; columns: idx, T, rho_min, rho_max)
+  (--op-border/--fe-border, or $OPTAB_SOURCES as the parent of OPCD_3.3/ and Ferguson/)
+
+Matplotlib is imported only when the figures are drawn.
 """
 
 from __future__ import annotations
 
-import struct
+import argparse
+import sys
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
+if not __package__:  # run as a script (python3 plot_opacity.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
 
-def read_input_dat(path: Path) -> Tuple[int, int, float, float, float, float, float, float]:
-    """Read input.dat with log10 ranges: tmp_min tmp_max dtmp rho_min rho_max drho
-
-    Returns: (nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr)
-    """
-    tokens = []
-    with path.open("r") as f:
-        for line in f:
-            parts = line.strip().split()
-            for p in parts:
-                try:
-                    tokens.append(float(p))
-                except Exception:
-                    pass
-    if len(tokens) < 6:
-        raise ValueError("input.dat must contain at least 6 numbers: tmp_min tmp_max dtmp rho_min rho_max drho (log10 units)")
-    ltmin, ltmax, dlt, lrmin, lrmax, dlr = tokens[:6]
-    # Compute counts consistent with Fortran logic
-    nitt = int((ltmax - ltmin) / dlt) + 1
-    nidd = int((lrmax - lrmin) / dlr) + 1
-    return nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr
-
-
-def read_fortran_unformatted_matrix(
-    path: Path, nitt: int, nidd: int, dtype: np.dtype = np.dtype(">f8")
-) -> np.ndarray:
-    """Read a single-record Fortran unformatted array of shape (nitt, nidd).
-
-    Assumes big-endian 64-bit floats as written by gfortran with -fconvert=big-endian
-    and a single WRITE of the full array (adds 4-byte record markers around payload).
-    """
-    with path.open("rb") as f:
-        # Leading record marker (4 bytes, big-endian int32)
-        head = f.read(4)
-        if len(head) != 4:
-            raise ValueError(f"{path}: unexpected EOF reading record header")
-        (nbytes,) = struct.unpack(">i", head)
-        expected = dtype.itemsize * nitt * nidd
-        if nbytes != expected:
-            raise ValueError(
-                f"{path}: record size {nbytes} != expected {expected} for ({nitt}x{nidd})"
-            )
-        buf = f.read(nbytes)
-        if len(buf) != nbytes:
-            raise ValueError(f"{path}: unexpected EOF reading payload")
-        tail = f.read(4)
-        if len(tail) != 4:
-            raise ValueError(f"{path}: unexpected EOF reading record trailer")
-        (nbytes2,) = struct.unpack(">i", tail)
-        if nbytes2 != nbytes:
-            raise ValueError(f"{path}: trailer size {nbytes2} != header {nbytes}")
-
-    arr = np.frombuffer(buf, dtype=dtype, count=nitt * nidd)
-    # Shape as Fortran (temperature, density)
-    arr = np.reshape(arr, (nitt, nidd), order="F")
-    return arr
+from .contours import sublimation_line
+from .domain import read_border
+from .opacity_io import read_hybrid_table, source_dir
+from .opacity_lookup import OpacityTable
+from .slices import extract, isochores
+from .tracing import span
 
 
 def try_read_border(path: Path, has_index_col: bool = False):
@@ -91,44 +45,12 @@ def try_read_border(path: Path, has_index_col: bool = False):
     OP file: T, rho_min, rho_max
     Ferguson file: idx, T, rho_min, rho_max
     """
-    try:
-        with path.open("r") as f:
-            header = f.readline().strip()
-            try:
-                n = int(header)
-            except Exception:
-                n = None
-        data = np.loadtxt(path, skiprows=1 if n is not None else 0, max_rows=n)
-        if data.ndim == 1:
-            data = data[None, :]
-        if has_index_col:
-            T = data[:, 1]
-            rho_min = data[:, 2]
-            rho_max = data[:, 3]
-        else:
-            T = data[:, 0]
-            rho_min = data[:, 1]
-            rho_max = data[:, 2]
-        return T, rho_min, rho_max
-    except Exception:
-        return None
+    return read_border(path, has_index_col)
 
 
 def compute_sublimation_line(dust: np.ndarray, topmin: float, topmax: float, dopmin: float, dopmax: float):
     """Compute (tsubl, dsubl) as in opacity_table.pro (last T where dust==1 per density)."""
-    nitt, nidd = dust.shape
-    tsubl = np.full(nidd, np.nan)
-    dsubl = np.linspace(dopmin, dopmax, nidd)
-    for j in range(nidd):
-        # search from high temp to low temp
-        idx = None
-        for i in range(nitt - 1, -1, -1):
-            if dust[i, j] >= 0.5:
-                idx = i
-                break
-        if idx is not None:
-            tsubl[j] = topmin + (topmax - topmin) * (idx / (nitt - 1))
-    return tsubl, dsubl
+    return sublimation_line(dust, topmin, topmax, dopmin, dopmax)
 
 
 def imshow_with_colorbar(ax, img, extent, cmap, vmin=None, vmax=None, tick_size=8,
@@ -137,6 +59,8 @@ def imshow_with_colorbar(ax, img, extent, cmap, vmin=None, vmax=None, tick_size=
 
     Returns the image and colorbar objects.
     """
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+
     im = ax.imshow(
         img,
         origin="lower",
@@ -188,20 +112,35 @@ def add_overlays(ax, tsubl, dsubl, t_ferguson_max, op_border, fe_border):
         ax.plot(T, rho_max, color="white", linewidth=1, linestyle="--")
 
 
-def main():
-    root = Path(".")
-    header_path = root / "input.dat"
-    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(header_path)
-
-    kr = read_fortran_unformatted_matrix(root / "kR.dat", nitt, nidd)
-    kp = read_fortran_unformatted_matrix(root / "kP.dat", nitt, nidd)
-    dust = read_fortran_unformatted_matrix(root / "dust.dat", nitt, nidd)
-
-    # Convert opacities to log10; keep raw for slice plot, and clipped for images
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Plot kR/kP/dust maps and density slices.")
+    parser.add_argument("--slice-rho", type=float, action="append", default=None, metavar="LOG_RHO",
+                        help="log10 rho of a slice in slice.pdf (repeatable; default: -6)")
+    parser.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat, input.dat")
+    parser.add_argument("--out-dir", default=".", help="Directory for opacity_table.png/.pdf and slice.pdf")
+    parser.add_argument("--op-border", default=str(source_dir("OPCD_3.3") / "border.data"),
+                        help="OP border overlay ('' to skip)")
+    parser.add_argument("--fe-border", default=str(source_dir("Ferguson") / "border.data"),
+                        help="Ferguson border overlay ('' to skip)")
+    args = parser.parse_args(argv)
+    d_slices = args.slice_rho or [-6.0]
+
+    # Matplotlib is only needed here; importing it dominates the start-up time
+    with span("plot.import_matplotlib"):
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+
+    root = Path(args.root)
+    out_dir = Path(args.out_dir)
+    table = read_hybrid_table(root)
+    nitt, nidd = table.nitt, table.nidd
+    ltmin, ltmax, lrmin, lrmax = table.ltmin, table.ltmax, table.lrmin, table.lrmax
+    dust = table.dust
+
+    # Opacities come back as log10; keep raw for slice plot, and clipped for images
     value_min, value_max = -6.0, 7.0
-    with np.errstate(divide="ignore", invalid="ignore"):
-        lkr_raw = np.log10(kr)
-        lkp_raw = np.log10(kp)
+    lkr_raw = table.log_kr
+    lkp_raw = table.log_kp
     lkr = np.clip(lkr_raw, value_min, value_max)
     lkp = np.clip(lkp_raw, value_min, value_max)
 
@@ -216,8 +155,8 @@ def main():
         except Exception:
             t_ferguson_max = None
 
-    op_border = try_read_border(Path("../OPCD_3.3/border.data"), has_index_col=False)
-    fe_border = try_read_border(Path("../Ferguson/border.data"), has_index_col=True)
+    op_border = try_read_border(Path(args.op_border), has_index_col=False) if args.op_border else None
+    fe_border = try_read_border(Path(args.fe_border), has_index_col=True) if args.fe_border else None
 
     # Sublimation line from dust
     tsubl, dsubl = compute_sublimation_line(dust, ltmin, ltmax, lrmin, lrmax)
@@ -280,25 +219,21 @@ def main():
     # Increase right margin to avoid clipping colorbar tick labels on the last panel
     fig.subplots_adjust(top=0.97, bottom=0.12, left=0.08, right=0.90, wspace=0.45)
     # Save with transparent background
-    out_prefix = "opacity_table"
-    fig.savefig(f"{out_prefix}.png", dpi=300, transparent=True)
-    fig.savefig(f"{out_prefix}.pdf", transparent=True)
+    out_prefix = out_dir / "opacity_table"
+    with span("plot.savefig.png"):
+        fig.savefig(f"{out_prefix}.png", dpi=300, transparent=True)
+    with span("plot.savefig.pdf"):
+        fig.savefig(f"{out_prefix}.pdf", transparent=True)
     print(f"Saved {out_prefix}.png and {out_prefix}.pdf with transparent backgrounds.")
 
     # ------------------------------------------------------------------
     # Slice plot (transparent PDF), matching IDL's slice.eps behavior
     # ------------------------------------------------------------------
-    # density slice in log10 units
-    d_slice = -6.0
-    # build axes arrays in log10 units
+    # interpolate all requested density slices in one lookup on the table's T grid
     t_log = np.linspace(ltmin, ltmax, nitt)
-    # find first j where density >= d_slice
-    j_slice = 0
-    for j in range(nidd):
-        d = lrmin + (lrmax - lrmin) * (j / (nidd - 1))
-        j_slice = j
-        if d >= d_slice:
-            break
+    lookup = OpacityTable(table.ltmin, table.dlt, table.lrmin, table.dlr, table.log_kr, table.log_kp, dust)
+    with span("plot.slice_lookup", slices=len(d_slices)):
+        res = extract(lookup, isochores(d_slices, t_log))[0]
 
     fig2, ax = plt.subplots(figsize=(6, 4.5))
     fig2.patch.set_alpha(0.0)
@@ -310,19 +245,21 @@ def main():
     ax.set_xlabel(r"log T (K)")
     ax.set_ylabel(r"log $\kappa$ (cm$^2$ g$^{-1}$)")
 
-    # plot Planck (gray) and Rosseland (default) means at the slice
-    ax.plot(t_log, lkp_raw[:, j_slice], color="gray", linewidth=2.5)
-    ax.plot(t_log, lkr_raw[:, j_slice], color="C0", linewidth=2.5)
+    # plot Planck (gray) and Rosseland (default) means at each slice
+    for k in range(len(d_slices)):
+        ax.plot(t_log, res.log_kp[k], color="gray", linewidth=2.5)
+        ax.plot(t_log, res.log_kr[k], color=f"C{k}", linewidth=2.5)
 
     # additional guide lines from IDL script
     ax.plot([3.75, 4.10], [1.0, 1.0 + 9.0 * (4.10 - 3.75)], linestyle="--", color="k", linewidth=2)
     ax.plot([4.50, 5.30], [4.0, 4.0 - 3.5 * (5.30 - 4.50)], linestyle="--", color="k", linewidth=2)
 
     # annotate slice density
-    ax.text(0.02, 0.02, f"log $\\rho$ = {d_slice}", transform=ax.transAxes)
+    ax.text(0.02, 0.02, "log $\\rho$ = " + ", ".join(f"{d}" for d in d_slices), transform=ax.transAxes)
 
-    fig2.savefig("slice.pdf", transparent=True)
-    print("Saved slice.pdf (transparent).")
+    with span("plot.savefig.slice"):
+        fig2.savefig(out_dir / "slice.pdf", transparent=True)
+    print(f"Saved {out_dir / 'slice.pdf'} (transparent).")
 
 
 if __name__ == "__main__":
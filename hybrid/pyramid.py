@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution tile pyramid of a hybrid table for zoomable inspection.
+
+Level 0 is the table itself (log_kr, log_kp as float64, dust as uint8). Each
+coarser level halves both axes; a level-k cell covers up to 2^k x 2^k table
+cells and stores their min, max and (cell-count weighted) mean as float32, so
+thin features such as the dust boundary survive in the min/max layers.
+NaN cells are ignored by the reductions.
+
+File layout (native byte order), as in tiled.py:
+- magic b"OPTABPYR1\\n", 8-byte little-endian header length, JSON header
+  (grid, tile shape, and per level its shape, tile counts and the dtype and
+  byte offset of every "<field>/<stat>" array)
+- every array starts on a page boundary and holds its level's tiles of
+  ti x tj values in C order, edge tiles padded (NaN, 0 for dust)
+
+The reader picks the finest level at which a (log T, log rho) window fits in
+a given number of cells, or a requested level, and copies only the rows of
+the tiles that overlap the window; with small tiles a narrow zoom touches a
+few pages per tile. The build streams one tile row at a time (from kR.dat /
+kP.dat / dust.dat or a tiled.py file), so memory stays bounded by a strip.
+
+Usage:
+  python3 pyramid.py build [--root .] [--tiles hybrid.tiles] [--tile 64 64] [--out hybrid.pyr]
+  python3 pyramid.py window --pyramid hybrid.pyr --window 3.69 3.70 -8 -7.99 [--max-cells 512] [--out win.npz]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import struct
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 pyramid.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_io import read_hybrid_table
+from .tiled import PAGE, TiledTable, _page
+
+MAGIC = b"OPTABPYR1\n"
+FIELDS = ("log_kr", "log_kp", "dust")
+STATS = ("min", "max", "mean")
+LEVEL0_DTYPES = {"log_kr": "f8", "log_kp": "f8", "dust": "u1"}
+COARSE_DTYPE = "f4"
+
+RowReader = Callable[[str, int, int], np.ndarray]
+
+
+class PyramidWindow(NamedTuple):
+    """A window of one pyramid layer; ``t``/``rho`` are the cell-center coordinates."""
+
+    level: int
+    t: np.ndarray
+    rho: np.ndarray
+    data: np.ndarray
+    bytes_read: int
+
+
+def _key(field: str, stat: str) -> str:
+    return f"{field}/{stat}"
+
+
+def _level_shapes(nitt: int, nidd: int, tile: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """Shapes of all levels, down to the first that fits in one tile."""
+    shapes = [(nitt, nidd)]
+    while shapes[-1][0] > tile[0] or shapes[-1][1] > tile[1]:
+        n, m = shapes[-1]
+        shapes.append((-(-n // 2), -(-m // 2)))
+    return shapes
+
+
+def _layout(nitt: int, nidd: int, tile: Tuple[int, int]) -> Tuple[List[Dict], int]:
+    ti, tj = tile
+    levels = []
+    offset = 0
+    for k, (n, m) in enumerate(_level_shapes(nitt, nidd, tile)):
+        nt = [-(-n // ti), -(-m // tj)]
+        arrays = {}
+        for field in FIELDS:
+            if k == 0:
+                specs = [("value", LEVEL0_DTYPES[field])]
+            else:
+                specs = [(stat, COARSE_DTYPE) for stat in STATS]
+            for stat, dtype in specs:
+                dt = np.dtype(dtype).newbyteorder("=")
+                arrays[_key(field, stat)] = {"dtype": dt.str, "offset": offset}
+                offset += _page(nt[0] * nt[1] * ti * tj * dt.itemsize)
+        levels.append({"shape": [n, m], "ntiles": nt, "arrays": arrays})
+    return levels, offset
+
+
+def _counts(n0: int, level: int, i0: int, i1: int) -> np.ndarray:
+    """Number of level-0 rows covered by cells i0:i1 of ``level``."""
+    f = 1 << level
+    return np.minimum(f, n0 - f * np.arange(i0, i1)).astype(np.float64)
+
+
+def _pairs(a: np.ndarray, fill: float) -> np.ndarray:
+    """Pad to even sizes and reshape (h, w) -> (h/2, 2, w/2, 2)."""
+    h, w = a.shape
+    if h % 2 or w % 2:
+        a = np.pad(a, ((0, h % 2), (0, w % 2)), constant_values=fill)
+    return a.reshape(a.shape[0] // 2, 2, a.shape[1] // 2, 2)
+
+
+def reduce2(
+    lo: np.ndarray, hi: np.ndarray, mean: np.ndarray, weight: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Halve min / max / mean layers; ``weight`` is the cell count behind each mean."""
+    rmin = np.fmin.reduce(np.fmin.reduce(_pairs(lo, np.nan), axis=3), axis=1)
+    rmax = np.fmax.reduce(np.fmax.reduce(_pairs(hi, np.nan), axis=3), axis=1)
+    w = np.where(np.isnan(mean), 0.0, weight)
+    s = _pairs(np.where(w > 0, mean * w, 0.0), 0.0).sum(axis=(1, 3))
+    n = _pairs(w, 0.0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rmean = np.where(n > 0, s / n, np.nan)
+    return rmin, rmax, rmean
+
+
+class _Arrays:
+    """Tiled arrays of one level, written and read one tile row at a time with plain file I/O.
+
+    Plain reads and writes (rather than a writable mapping) keep the resident
+    size of the build bounded by a strip.
+    """
+
+    def __init__(self, f, data_start: int, level: Dict, tile: Tuple[int, int]):
+        self.f = f
+        self.shape = tuple(level["shape"])
+        self.ntr = level["ntiles"][1]
+        self.tile = tile
+        self.specs = {
+            key: (np.dtype(spec["dtype"]), data_start + spec["offset"]) for key, spec in level["arrays"].items()
+        }
+
+    def _row_offset(self, key: str, a: int) -> Tuple[np.dtype, int, int]:
+        dt, base = self.specs[key]
+        count = self.ntr * self.tile[0] * self.tile[1]
+        return dt, base + a * count * dt.itemsize, count
+
+    def write_row(self, key: str, a: int, values: np.ndarray) -> None:
+        """Store rows of tile row ``a`` (at most ti rows, full width)."""
+        ti, tj = self.tile
+        dt, off, _ = self._row_offset(key, a)
+        fill = 0 if dt.kind == "u" else np.nan
+        strip = np.full((ti, self.ntr * tj), fill, dtype=dt)
+        strip[: values.shape[0], : values.shape[1]] = values
+        self.f.seek(off)
+        self.f.write(strip.reshape(ti, self.ntr, tj).transpose(1, 0, 2).tobytes())
+
+    def read_rows(self, key: str, i0: int, i1: int) -> np.ndarray:
+        """Rows i0:i1 at full width as float64."""
+        ti, tj = self.tile
+        a0, a1 = i0 // ti, -(-i1 // ti)
+        dt, off, count = self._row_offset(key, a0)
+        self.f.seek(off)
+        block = np.frombuffer(self.f.read(count * (a1 - a0) * dt.itemsize), dtype=dt)
+        block = block.reshape(a1 - a0, self.ntr, ti, tj).transpose(0, 2, 1, 3).reshape((a1 - a0) * ti, -1)
+        return block[i0 - a0 * ti : i1 - a0 * ti, : self.shape[1]].astype(np.float64)
+
+
+def hybrid_rows(root: Path, input_path: Optional[Path] = None) -> Tuple[Dict, RowReader]:
+    """Grid and row reader of kR.dat / kP.dat / dust.dat in ``root``."""
+    t = read_hybrid_table(root, input_path)
+    grid = {"ltmin": t.ltmin, "dlt": t.dlt, "nitt": t.nitt, "lrmin": t.lrmin, "dlr": t.dlr, "nidd": t.nidd}
+    arrays = {"log_kr": t.log_kr, "log_kp": t.log_kp, "dust": t.dust}
+    return grid, lambda field, i0, i1: np.asarray(arrays[field][i0:i1], dtype=np.float64)
+
+
+def tiled_rows(path: Path) -> Tuple[Dict, RowReader]:
+    """Grid and row reader of a tiled.py file (out-of-core)."""
+    t = TiledTable(path)
+    grid = {"ltmin": t.ltmin, "dlt": t.dlt, "nitt": t.nitt, "lrmin": t.lrmin, "dlr": t.dlr, "nidd": t.nidd}
+
+    def rows(field: str, i0: int, i1: int) -> np.ndarray:
+        # drop the mapping after each strip so resident pages do not accumulate
+        try:
+            return t.window(field, i0, i1, 0, t.nidd)
+        finally:
+            t.close()
+
+    return grid, rows
+
+
+def build_pyramid(grid: Dict, rows: RowReader, out_path: Path, tile: Tuple[int, int] = (64, 64)) -> Dict:
+    """Write the pyramid of the table behind ``rows`` to ``out_path``; returns the header."""
+    nitt, nidd = grid["nitt"], grid["nidd"]
+    levels, size = _layout(nitt, nidd, tile)
+    header = {"grid": grid, "tile": list(tile), "levels": levels}
+    data_start = _page(len(MAGIC) + 8 + len(json.dumps(header)) + 64)
+    header["data_start"] = data_start
+    blob = json.dumps(header).encode()
+
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(blob)) + blob)
+        f.truncate(data_start + size)
+    ti = tile[0]
+    try:
+        with tmp_path.open("r+b") as f:
+            prev = _Arrays(f, data_start, levels[0], tile)
+            for a in range(levels[0]["ntiles"][0]):
+                i0, i1 = a * ti, min((a + 1) * ti, nitt)
+                for field in FIELDS:
+                    prev.write_row(_key(field, "value"), a, rows(field, i0, i1))
+            for k in range(1, len(levels)):
+                cur = _Arrays(f, data_start, levels[k], tile)
+                n_prev = prev.shape[0]
+                wcol = _counts(nidd, k - 1, 0, prev.shape[1])
+                for a in range(levels[k]["ntiles"][0]):
+                    i0, i1 = 2 * a * ti, min(2 * (a + 1) * ti, n_prev)
+                    weight = _counts(nitt, k - 1, i0, i1)[:, None] * wcol[None, :]
+                    for field in FIELDS:
+                        if k == 1:
+                            lo = hi = mean = prev.read_rows(_key(field, "value"), i0, i1)
+                        else:
+                            lo, hi, mean = (prev.read_rows(_key(field, s), i0, i1) for s in STATS)
+                        for stat, values in zip(STATS, reduce2(lo, hi, mean, weight)):
+                            cur.write_row(_key(field, stat), a, values)
+                prev = cur
+    except BaseException:
+        tmp_path.unlink()
+        raise
+    tmp_path.replace(out_path)
+    return header
+
+
+class Pyramid:
+    """Reader for pyramid files; maps only the tiles a window needs."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not an opacity pyramid")
+            (n,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(n))
+        self.grid = self.header["grid"]
+        self.tile = tuple(self.header["tile"])
+        self.levels = self.header["levels"]
+        self._maps: Dict[Tuple[int, str], np.memmap] = {}
+
+    def _map(self, level: int, key: str) -> np.memmap:
+        if (level, key) not in self._maps:
+            spec = self.levels[level]["arrays"][key]
+            self._maps[(level, key)] = np.memmap(
+                self.path, dtype=np.dtype(spec["dtype"]), mode="r",
+                offset=self.header["data_start"] + spec["offset"],
+                shape=tuple(self.levels[level]["ntiles"]) + self.tile,
+            )
+        return self._maps[(level, key)]
+
+    def centers(self, level: int, axis: int, i0: int, i1: int) -> np.ndarray:
+        """Coordinates (log T for axis 0, log rho for axis 1) of the centers of cells i0:i1."""
+        g = self.grid
+        lmin, step, n0 = (g["ltmin"], g["dlt"], g["nitt"]) if axis == 0 else (g["lrmin"], g["dlr"], g["nidd"])
+        f = 1 << level
+        first = f * np.arange(i0, i1)
+        return lmin + step * (first + (_counts(n0, level, i0, i1) - 1) / 2)
+
+    def index_window(self, level: int, ltmin: float, ltmax: float, lrmin: float, lrmax: float):
+        """Cell ranges (i0, i1, j0, j1) of ``level`` covering a (log T, log rho) rectangle."""
+        g = self.grid
+        n, m = self.levels[level]["shape"]
+        f = 1 << level
+        i0 = max(int(math.floor((ltmin - g["ltmin"]) / g["dlt"])) // f, 0)
+        i1 = min(int(math.ceil((ltmax - g["ltmin"]) / g["dlt"])) // f + 1, n)
+        j0 = max(int(math.floor((lrmin - g["lrmin"]) / g["dlr"])) // f, 0)
+        j1 = min(int(math.ceil((lrmax - g["lrmin"]) / g["dlr"])) // f + 1, m)
+        return i0, max(i1, i0), j0, max(j1, j0)
+
+    def choose_level(self, ltmin: float, ltmax: float, lrmin: float, lrmax: float, max_cells: int) -> int:
+        """Finest level at which the window is at most ``max_cells`` cells along each axis."""
+        for k in range(len(self.levels)):
+            i0, i1, j0, j1 = self.index_window(k, ltmin, ltmax, lrmin, lrmax)
+            if i1 - i0 <= max_cells and j1 - j0 <= max_cells:
+                return k
+        return len(self.levels) - 1
+
+    def read(self, field: str, stat: str, level: int, i0: int, i1: int, j0: int, j1: int) -> Tuple[np.ndarray, int]:
+        """Cells i0:i1, j0:j1 of one layer as float64, and the bytes of the file pages touched."""
+        key = _key(field, "value" if level == 0 else stat)
+        mm = self._map(level, key)
+        ti, tj = self.tile
+        size = mm.dtype.itemsize
+        out = np.empty((i1 - i0, j1 - j0))
+        pages = 0
+        for a in range(i0 // ti, -(-i1 // ti)):
+            r0, r1 = max(i0 - a * ti, 0), min(i1 - a * ti, ti)
+            for b in range(j0 // tj, -(-j1 // tj)):
+                c0, c1 = max(j0 - b * tj, 0), min(j1 - b * tj, tj)
+                out[a * ti + r0 - i0 : a * ti + r1 - i0, b * tj + c0 - j0 : b * tj + c1 - j0] = mm[a, b, r0:r1, c0:c1]
+                # pages spanned by the touched rows of this tile
+                base = mm.offset + ((a * mm.shape[1] + b) * ti * tj) * size
+                first = base + (r0 * tj + c0) * size
+                last = base + ((r1 - 1) * tj + c1) * size - 1
+                pages += last // PAGE - first // PAGE + 1
+        return out, pages * PAGE
+
+    def window(
+        self,
+        ltmin: float,
+        ltmax: float,
+        lrmin: float,
+        lrmax: float,
+        field: str = "log_kr",
+        stat: str = "mean",
+        level: Optional[int] = None,
+        max_cells: int = 512,
+    ) -> PyramidWindow:
+        """A (log T, log rho) window of ``field``/``stat`` at ``level`` (default: chosen by ``max_cells``)."""
+        if field not in FIELDS or stat not in STATS:
+            raise ValueError(f"field must be one of {FIELDS} and stat one of {STATS}")
+        if level is None:
+            level = self.choose_level(ltmin, ltmax, lrmin, lrmax, max_cells)
+        i0, i1, j0, j1 = self.index_window(level, ltmin, ltmax, lrmin, lrmax)
+        data, nbytes = self.read(field, stat, level, i0, i1, j0, j1)
+        return PyramidWindow(level, self.centers(level, 0, i0, i1), self.centers(level, 1, j0, j1), data, nbytes)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-resolution tile pyramid of a hybrid table.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Build the pyramid")
+    b.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat, input.dat")
+    b.add_argument("--tiles", default=None, help="Read a tiled.py file instead of --root")
+    b.add_argument("--tile", type=int, nargs=2, default=[64, 64], metavar=("NT", "NRHO"))
+    b.add_argument("--out", default="hybrid.pyr", help="Output pyramid file")
+    w = sub.add_parser("window", help="Read a window at a chosen zoom level")
+    w.add_argument("--pyramid", default="hybrid.pyr", help="Pyramid file")
+    w.add_argument("--window", type=float, nargs=4, required=True, metavar=("LTMIN", "LTMAX", "LRMIN", "LRMAX"))
+    w.add_argument("--level", type=int, default=None, help="Zoom level (default: chosen by --max-cells)")
+    w.add_argument("--max-cells", type=int, default=512, help="Max cells per axis when choosing the level")
+    w.add_argument("--out", default=None, help="Write every field/stat of the window to this .npz")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        grid, rows = tiled_rows(Path(args.tiles)) if args.tiles else hybrid_rows(Path(args.root))
+        header = build_pyramid(grid, rows, Path(args.out), tuple(args.tile))
+        shapes = ", ".join(f"{n}x{m}" for n, m in (lv["shape"] for lv in header["levels"]))
+        print(f"Wrote {args.out}: {len(header['levels'])} levels ({shapes}), "
+              f"{Path(args.out).stat().st_size / 2**20:.1f} MiB")
+        return 0
+
+    pyr = Pyramid(Path(args.pyramid))
+    win = pyr.window(*args.window, level=args.level, max_cells=args.max_cells)
+    arrays = {"t": win.t, "rho": win.rho}
+    total = 0
+    for field in FIELDS:
+        for stat in STATS if win.level else ("mean",):
+            w2 = pyr.window(*args.window, field=field, stat=stat, level=win.level)
+            arrays[f"{field}_{stat}" if win.level else field] = w2.data
+            total += w2.bytes_read
+    print(f"level {win.level}: {win.data.shape[0]}x{win.data.shape[1]} cells, {total / 1024:.1f} KiB read")
+    if args.out:
+        np.savez(args.out, level=win.level, **arrays)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Headless batch rendering of opacity maps for many tables.
+
+Each worker process builds one figure per layout and reuses it for every
+table it renders: images, the sublimation line and the Ferguson marker are
+updated in place (set_data) instead of rebuilding axes, colorbars and text.
+Two layouts are available:
+- hybrid: kR / kP / dust panels with overlays, as plot_opacity.py
+  (one directory with kR.dat, kP.dat, dust.dat, input.dat per table)
+- source: Rosseland / Planck panels, as ../Semenov/opacity_plot.py
+  (a pair of source tables such as semenov_ros.data semenov_pla.data)
+
+Image layers are rasterized in the PDF (at --pdf-dpi) while axes, labels
+and overlays stay vector. With --downsample, tables with more cells than the
+panel has output pixels are block-averaged to the pixel resolution first.
+
+Usage:
+  python3 render.py sweep/*/ --out-dir maps --workers 4
+  python3 render.py --manifest sweep/manifest.json --downsample --formats png
+  python3 render.py --source-pair ../Semenov/semenov_ros.data ../Semenov/semenov_pla.data
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+if not __package__:  # run as a script (python3 render.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .contours import sublimation_line  # noqa: E402
+from .domain import read_border  # noqa: E402
+from .opacity_io import read_hybrid_table, read_opacity_file, source_dir  # noqa: E402
+from .plot_opacity import imshow_with_colorbar  # noqa: E402
+from .tracing import span  # noqa: E402
+
+FORMATS = ("png", "pdf")
+
+
+class RenderJob(NamedTuple):
+    """One output: ``paths`` is (table_dir,) for the hybrid layout or (ros, pla) for source."""
+
+    name: str
+    layout: str
+    paths: Tuple[str, ...]
+
+
+class RenderOptions(NamedTuple):
+    out_dir: str = "."
+    formats: Tuple[str, ...] = FORMATS
+    dpi: int = 300
+    pdf_dpi: int = 100
+    downsample: bool = False
+    vmin: float = -6.0
+    vmax: float = 7.0
+    cmap_source: str = "turbo"
+    # border.data overlays: None = the one under opacity_io.source_dir() if present, "" = none
+    op_border: Optional[str] = None
+    fe_border: Optional[str] = None
+
+    def border_paths(self) -> List[Optional[Path]]:
+        """OP and Ferguson border files to draw (None where there is none)."""
+        paths = []
+        for path, source in ((self.op_border, "OPCD_3.3"), (self.fe_border, "Ferguson")):
+            if path is None:
+                default = source_dir(source) / "border.data"
+                paths.append(default if default.is_file() else None)
+            else:
+                paths.append(Path(path) if path else None)
+        return paths
+
+
+def downsample(data: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Block-average ``data`` to at most ``shape`` cells (edge blocks may be narrower)."""
+    out = np.asarray(data, dtype=np.float64)
+    for axis, n in enumerate(shape):
+        f = math.ceil(out.shape[axis] / max(n, 1))
+        if f <= 1:
+            continue
+        starts = np.arange(0, out.shape[axis], f)
+        counts = np.diff(np.append(starts, out.shape[axis]))
+        out = np.add.reduceat(out, starts, axis=axis)
+        out /= counts.reshape((-1, 1) if axis == 0 else (1, -1))
+    return out
+
+
+class _MapFigure:
+    """A figure whose image panels are updated in place."""
+
+    def __init__(self, opts: RenderOptions):
+        self.opts = opts
+        self.fig = None
+        self.axes: list = []
+        self.images: list = []
+
+    def _panel_pixels(self, ax) -> Tuple[int, int]:
+        """(width, height) of a panel in output pixels at the PNG resolution."""
+        bbox = ax.get_window_extent()
+        scale = self.opts.dpi / self.fig.dpi
+        return max(1, int(bbox.width * scale)), max(1, int(bbox.height * scale))
+
+    def _set_image(self, k: int, data: np.ndarray, extent) -> None:
+        """Show ``data`` (nt, nd) in panel ``k`` with T along x and rho along y."""
+        img = np.asarray(data)
+        if self.opts.downsample:
+            w, h = self._panel_pixels(self.axes[k])
+            img = downsample(img, (w, h))
+        self.images[k].set_data(img.T)
+        self.images[k].set_extent(extent)
+        self.axes[k].set_xlim(extent[0], extent[1])
+        self.axes[k].set_ylim(extent[2], extent[3])
+
+    def save(self, prefix: Path) -> List[str]:
+        written = []
+        for fmt in self.opts.formats:
+            path = f"{prefix}.{fmt}"
+            dpi = self.opts.pdf_dpi if fmt == "pdf" else self.opts.dpi
+            with span(f"render.savefig.{fmt}"):
+                self.fig.savefig(path, dpi=dpi, transparent=True)
+            written.append(path)
+        return written
+
+
+class HybridFigure(_MapFigure):
+    """kR / kP / dust panels with overlays, laid out as plot_opacity.py."""
+
+    def __init__(self, opts: RenderOptions):
+        super().__init__(opts)
+        borders = [
+            read_border(p, has_index_col=idx) if p else None
+            for p, idx in zip(opts.border_paths(), (False, True))
+        ]
+        fig, axes = plt.subplots(1, 3, figsize=(12, 3))
+        fig.patch.set_alpha(0.0)
+        extent = [0.0, 1.0, 0.0, 1.0]
+        blank = np.zeros((2, 2))
+        specs = (
+            (r"log $\kappa_R$ (cm$^2$ g$^{-1}$)", "viridis", opts.vmin, opts.vmax),
+            (r"log $\kappa_P$ (cm$^2$ g$^{-1}$)", "viridis", opts.vmin, opts.vmax),
+            ("dust (0 no, 1 yes)", "binary", 0.0, 1.0),
+        )
+        self.subl = []
+        self.fe_line = []
+        for ax, (title, cmap, vmin, vmax) in zip(axes, specs):
+            ax.set_facecolor((1, 1, 1, 0))
+            ax.set_box_aspect(3 / 4)
+            im, _ = imshow_with_colorbar(ax, blank, extent, cmap=cmap, vmin=vmin, vmax=vmax)
+            im.set_rasterized(True)
+            self.images.append(im)
+            ax.set_title(title)
+            ax.set_xlabel(r"log T (K)")
+            ax.set_ylabel(r"log $\rho$ (g cm$^{-3}$)")
+            (line,) = ax.plot([], [], color="white", linewidth=2, linestyle="--", alpha=0.9)
+            self.subl.append(line)
+            self.fe_line.append(ax.axvline(0.0, color="white", linewidth=2, linestyle=":", alpha=0.9))
+            for border in borders:
+                if border is not None:
+                    ax.plot(border.t, border.rho_min, color="white", linewidth=1, linestyle="--")
+                    ax.plot(border.t, border.rho_max, color="white", linewidth=1, linestyle="--")
+        for ax in axes[:2]:
+            ax.text(2.5, -12, "Semonov", color="white", fontsize=10, rotation=90)
+            ax.text(3.2, -15, "Ferguson", color="white", fontsize=10, rotation=90, va="bottom")
+            ax.text(4.5, -10, "OP", color="white", fontsize=10)
+        fig.subplots_adjust(top=0.97, bottom=0.12, left=0.08, right=0.90, wspace=0.45)
+        self.fig, self.axes = fig, list(axes)
+
+    def update(self, table_dir: Path) -> None:
+        table = read_hybrid_table(table_dir)
+        extent = [table.ltmin, table.ltmax, table.lrmin, table.lrmax]
+        lo, hi = self.opts.vmin, self.opts.vmax
+        self._set_image(0, np.clip(table.log_kr, lo, hi), extent)
+        self._set_image(1, np.clip(table.log_kp, lo, hi), extent)
+        self._set_image(2, table.dust, extent)
+        tsubl, dsubl = sublimation_line(table.dust, table.ltmin, table.ltmax, table.lrmin, table.lrmax)
+        t_fe = None
+        tf_path = table_dir / "temp_fe_op.data"
+        if tf_path.exists():
+            try:
+                t_fe = float(tf_path.read_text().split()[0])
+            except (ValueError, IndexError):
+                t_fe = None
+        for line, fe in zip(self.subl, self.fe_line):
+            line.set_data(tsubl, dsubl)
+            fe.set_xdata([t_fe, t_fe] if t_fe is not None else [np.nan, np.nan])
+
+
+class SourceFigure(_MapFigure):
+    """Rosseland / Planck panels of a source-table pair, laid out as opacity_plot.py."""
+
+    def __init__(self, opts: RenderOptions):
+        super().__init__(opts)
+        fig, axes = plt.subplots(1, 2, figsize=(10, 4), constrained_layout=True)
+        titles = (r"log ($\kappa_R$ / cm$^2$ g$^{-1}$)", r"log ($\kappa_P$ / cm$^2$ g$^{-1}$)")
+        for ax, title in zip(axes, titles):
+            im = ax.imshow(np.zeros((2, 2)), origin="lower", interpolation="nearest", extent=(0, 1, 0, 1),
+                           aspect="auto", cmap=opts.cmap_source, vmin=opts.vmin, vmax=opts.vmax)
+            im.set_rasterized(True)
+            ax.set_xlabel("log (T / K)")
+            ax.set_ylabel(r"log ($\rho$ / g cm$^{-3}$)")
+            ax.set_title(title)
+            fig.colorbar(im, ax=ax).set_label(title)
+            self.images.append(im)
+        self.fig, self.axes = fig, list(axes)
+
+    def update(self, ros: Path, pla: Path) -> None:
+        for k, path in enumerate((ros, pla)):
+            t, d, data = read_opacity_file(path)
+            self._set_image(k, data, [float(np.min(t)), float(np.max(t)), float(np.min(d)), float(np.max(d))])
+
+
+LAYOUTS = {"hybrid": HybridFigure, "source": SourceFigure}
+
+# Per-process figures, one per layout, reused across jobs
+_FIGURES: dict = {}
+
+
+def render_job(job: RenderJob, opts: RenderOptions) -> dict:
+    """Render one job on the reused figure of its layout; errors are reported in the record."""
+    record = {"name": job.name, "layout": job.layout, "paths": list(job.paths)}
+    t0 = time.perf_counter()
+    try:
+        with span("render.job", table=job.name):
+            fig = _FIGURES.get(job.layout)
+            if fig is None:
+                with span("render.figure", layout=job.layout):
+                    fig = _FIGURES[job.layout] = LAYOUTS[job.layout](opts)
+            with span("render.update"):
+                fig.update(*(Path(p) for p in job.paths))
+            record["outputs"] = fig.save(Path(opts.out_dir) / job.name)
+    except (OSError, ValueError) as exc:
+        record["error"] = str(exc)
+    record["seconds"] = round(time.perf_counter() - t0, 4)
+    return record
+
+
+def render_all(jobs: Sequence[RenderJob], opts: RenderOptions, workers: Optional[int] = None) -> List[dict]:
+    """Render every job over a process pool (in this process when workers == 1)."""
+    names = [j.name for j in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("output names must be unique")
+    Path(opts.out_dir).mkdir(parents=True, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) or 1
+    if workers == 1:
+        return [render_job(j, opts) for j in jobs]
+    # contiguous chunks so each worker reuses its figure for several tables
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_job, jobs, [opts] * len(jobs), chunksize=math.ceil(len(jobs) / workers)))
+
+
+def manifest_jobs(path: Path) -> List[RenderJob]:
+    """Hybrid jobs for the successfully built variants of a sweep.py manifest."""
+    manifest = json.loads(path.read_text())
+    return [
+        RenderJob(v["name"], "hybrid", (str(path.parent / v["dir"]),))
+        for v in manifest["variants"]
+        if "error" not in v
+    ]
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render opacity maps of many tables with reused figures.")
+    parser.add_argument("tables", nargs="*", help="Hybrid table directories (kR.dat, kP.dat, dust.dat, input.dat)")
+    parser.add_argument("--manifest", default=None, help="sweep.py manifest.json; renders every built variant")
+    parser.add_argument("--source-pair", nargs=2, action="append", default=[], metavar=("ROS", "PLA"),
+                        help="Source-table pair rendered with the opacity_plot.py layout (repeatable)")
+    parser.add_argument("--out-dir", default="maps", help="Output directory (<name>.png, <name>.pdf)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--dpi", type=int, default=300, help="PNG resolution")
+    parser.add_argument("--pdf-dpi", type=int, default=100, help="Resolution of the rasterized image layers in PDFs")
+    parser.add_argument("--downsample", action="store_true",
+                        help="Block-average tables larger than the panel's pixel count before drawing")
+    parser.add_argument("--vmin", type=float, default=-6.0, help="Color scale min (log kappa)")
+    parser.add_argument("--vmax", type=float, default=7.0, help="Color scale max (log kappa)")
+    parser.add_argument("--cmap-source", default="turbo", help="Colormap of the source layout")
+    parser.add_argument("--op-border", default=None,
+                        help="OP border overlay (default: OPCD_3.3/border.data under the sources, '' to skip)")
+    parser.add_argument("--fe-border", default=None,
+                        help="Ferguson border overlay (default: Ferguson/border.data under the sources, '' to skip)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    jobs = [RenderJob(Path(p).resolve().name, "hybrid", (p,)) for p in args.tables]
+    if args.manifest:
+        jobs += manifest_jobs(Path(args.manifest))
+    jobs += [RenderJob(Path(ros).stem, "source", (ros, pla)) for ros, pla in args.source_pair]
+    if not jobs:
+        parser.error("give table directories, --manifest or --source-pair")
+    opts = RenderOptions(
+        args.out_dir, tuple(args.formats), args.dpi, args.pdf_dpi, args.downsample,
+        args.vmin, args.vmax, args.cmap_source, args.op_border, args.fe_border,
+    )
+    t0 = time.perf_counter()
+    try:
+        records = render_all(jobs, opts, args.workers)
+    except ValueError as exc:
+        parser.error(str(exc))
+    failed = [r for r in records if "error" in r]
+    print(f"Rendered {len(records) - len(failed)}/{len(records)} tables in "
+          f"{time.perf_counter() - t0:.2f} s -> {args.out_dir}")
+    for r in failed:
+        print(f"  {r['name']}: {r['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Batch extraction of kappa along isochores, isotherms and (log T, log rho) tracks.
+
+Many slices are evaluated together: the points of every isochore (fixed
+log rho), isotherm (fixed log T) and polyline track (e.g. a disk
+vertical-structure model) are concatenated and interpolated bilinearly in
+one OpacityTable.lookup_all call, which returns log kappa_R, log kappa_P and
+the dust flag for all of them. Results come back as (nslice, npoint) arrays;
+tracks of different lengths are padded with NaN past their ``length``.
+
+Usage:
+  python3 slices.py --isochore=-20:0:101 --isotherm 3 --isotherm 3.5 --out slices.npz
+  python3 slices.py --track model1.txt --track model2.txt --resample 200 --out tracks.npz
+Values are numbers or LO:HI:N ranges (use --isochore=-20:0:101 when LO is negative).
+Track files are whitespace-separated text; columns 0 and 1 are log T and log rho
+(--track-cols to choose others, --track-linear when they are T [K] and rho [g/cc]).
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 slices.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .opacity_lookup import OpacityTable
+
+
+class SliceSet(NamedTuple):
+    """Sample points of a group of slices of one kind.
+
+    ``value`` is the fixed log rho (isochores) or log T (isotherms), NaN for
+    tracks. ``log_t``/``log_rho`` have shape (nslice, npoint); entries at or
+    past ``length`` are NaN padding.
+    """
+
+    kind: str
+    value: np.ndarray
+    log_t: np.ndarray
+    log_rho: np.ndarray
+    length: np.ndarray
+
+
+class SliceResult(NamedTuple):
+    """Interpolated values on a SliceSet; arrays have shape (nslice, npoint)."""
+
+    slices: SliceSet
+    log_kr: np.ndarray
+    log_kp: np.ndarray
+    dust: np.ndarray
+    outside: np.ndarray
+
+
+def parse_values(text: str) -> np.ndarray:
+    """Parse a number or an inclusive LO:HI:N range."""
+    parts = text.split(":")
+    if len(parts) == 1:
+        return np.array([float(text)])
+    if len(parts) != 3:
+        raise ValueError(f"expected a number or LO:HI:N, got {text!r}")
+    return np.linspace(float(parts[0]), float(parts[1]), int(parts[2]))
+
+
+def _full(values: np.ndarray, axis: np.ndarray, kind: str, fixed_is_rho: bool) -> SliceSet:
+    values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+    axis = np.asarray(axis, dtype=np.float64)
+    fixed = np.repeat(values[:, None], axis.size, axis=1)
+    along = np.broadcast_to(axis, fixed.shape).copy()
+    log_t, log_rho = (along, fixed) if fixed_is_rho else (fixed, along)
+    return SliceSet(kind, values, log_t, log_rho, np.full(values.size, axis.size))
+
+
+def isochores(log_rho: Sequence[float], log_t: np.ndarray) -> SliceSet:
+    """Slices at fixed log rho, sampled at ``log_t``."""
+    return _full(np.asarray(log_rho), log_t, "isochore", fixed_is_rho=True)
+
+
+def isotherms(log_t: Sequence[float], log_rho: np.ndarray) -> SliceSet:
+    """Slices at fixed log T, sampled at ``log_rho``."""
+    return _full(np.asarray(log_t), log_rho, "isotherm", fixed_is_rho=False)
+
+
+def resample_polyline(log_t: np.ndarray, log_rho: np.ndarray, n: int):
+    """``n`` points equally spaced in arc length (in the log T - log rho plane) along a polyline."""
+    seg = np.hypot(np.diff(log_t), np.diff(log_rho))
+    s = np.concatenate([[0.0], np.cumsum(seg)])
+    if s[-1] == 0.0:
+        return np.full(n, log_t[0]), np.full(n, log_rho[0])
+    keep = np.concatenate([[True], seg > 0.0])
+    targets = np.linspace(0.0, s[-1], n)
+    return np.interp(targets, s[keep], log_t[keep]), np.interp(targets, s[keep], log_rho[keep])
+
+
+def tracks(polylines: Sequence[tuple], resample: Optional[int] = None) -> SliceSet:
+    """Slices along (log T, log rho) polylines, as given or resampled to ``resample`` points each."""
+    pts = []
+    for lt, lr in polylines:
+        lt = np.asarray(lt, dtype=np.float64).reshape(-1)
+        lr = np.asarray(lr, dtype=np.float64).reshape(-1)
+        if lt.size != lr.size or lt.size == 0:
+            raise ValueError("track log T and log rho must be non-empty and of equal length")
+        if resample:
+            lt, lr = resample_polyline(lt, lr, resample)
+        pts.append((lt, lr))
+    length = np.array([lt.size for lt, _ in pts], dtype=np.int64)
+    npoint = int(length.max()) if length.size else 0
+    log_t = np.full((len(pts), npoint), np.nan)
+    log_rho = np.full((len(pts), npoint), np.nan)
+    for k, (lt, lr) in enumerate(pts):
+        log_t[k, : lt.size] = lt
+        log_rho[k, : lr.size] = lr
+    return SliceSet("track", np.full(len(pts), np.nan), log_t, log_rho, length)
+
+
+def read_track(path: Path, cols=(0, 1), linear: bool = False):
+    """Read (log T, log rho) columns of a text model file ('#' comments)."""
+    data = np.loadtxt(path, usecols=tuple(cols), ndmin=2, comments="#")
+    lt, lr = data[:, 0], data[:, 1]
+    if linear:
+        lt, lr = np.log10(lt), np.log10(lr)
+    return lt, lr
+
+
+def _valid(s: SliceSet) -> np.ndarray:
+    return np.arange(s.log_t.shape[1]) < s.length[:, None]
+
+
+def extract(table: OpacityTable, *sets: SliceSet) -> List[SliceResult]:
+    """Interpolate ``table`` on every point of every SliceSet with a single lookup.
+
+    Padding points get NaN values and outside=False.
+    """
+    masks = [_valid(s) for s in sets]
+    log_t = np.concatenate([s.log_t[m] for s, m in zip(sets, masks)]) if sets else np.empty(0)
+    log_rho = np.concatenate([s.log_rho[m] for s, m in zip(sets, masks)]) if sets else np.empty(0)
+    outside = np.empty(log_t.size, dtype=bool)
+    values = table.lookup_all(log_t, log_rho, outside=outside)
+    results = []
+    start = 0
+    for s, m in zip(sets, masks):
+        stop = start + int(m.sum())
+        fields = []
+        for v in values:
+            a = np.full(m.shape, np.nan)
+            a[m] = v[start:stop]
+            fields.append(a)
+        out = np.zeros(m.shape, dtype=bool)
+        out[m] = outside[start:stop]
+        results.append(SliceResult(s, *fields, out))
+        start = stop
+    return results
+
+
+def save_npz(path: Path, results: Sequence[SliceResult]) -> None:
+    """Write results to one .npz, with arrays named <kind>_<field> (e.g. isochore_log_kr)."""
+    arrays = {}
+    for r in results:
+        k = r.slices.kind
+        if f"{k}_value" in arrays:
+            raise ValueError(f"more than one {k} set")
+        arrays.update({
+            f"{k}_value": r.slices.value,
+            f"{k}_length": r.slices.length,
+            f"{k}_log_t": r.slices.log_t,
+            f"{k}_log_rho": r.slices.log_rho,
+            f"{k}_log_kr": r.log_kr,
+            f"{k}_log_kp": r.log_kp,
+            f"{k}_dust": r.dust,
+            f"{k}_outside": r.outside,
+        })
+    np.savez(path, **arrays)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Extract kappa along many isochores, isotherms and tracks at once.")
+    parser.add_argument("--root", default=".", help="Directory with kR.dat, kP.dat, dust.dat")
+    parser.add_argument("--input", default=None, help="input.dat (default: <root>/input.dat)")
+    parser.add_argument("--isochore", action="append", default=[], metavar="LOG_RHO",
+                        help="Fixed log rho: a number or LO:HI:N (repeatable)")
+    parser.add_argument("--isotherm", action="append", default=[], metavar="LOG_T",
+                        help="Fixed log T: a number or LO:HI:N (repeatable)")
+    parser.add_argument("--nt", type=int, default=None, help="Points along isochores (default: table T grid)")
+    parser.add_argument("--nrho", type=int, default=None, help="Points along isotherms (default: table rho grid)")
+    parser.add_argument("--track", action="append", default=[], help="Track file (repeatable)")
+    parser.add_argument("--track-cols", type=int, nargs=2, default=[0, 1], metavar=("T", "RHO"))
+    parser.add_argument("--track-linear", action="store_true", help="Track columns are T [K] and rho [g/cc]")
+    parser.add_argument("--resample", type=int, default=None, help="Resample each track to N points by arc length")
+    parser.add_argument("--out", default="slices.npz", help="Output .npz")
+    args = parser.parse_args(argv)
+
+    try:
+        rho_values = np.concatenate([parse_values(v) for v in args.isochore]) if args.isochore else None
+        t_values = np.concatenate([parse_values(v) for v in args.isotherm]) if args.isotherm else None
+    except ValueError as exc:
+        parser.error(str(exc))
+    if rho_values is None and t_values is None and not args.track:
+        parser.error("give at least one --isochore, --isotherm or --track")
+
+    table = OpacityTable.from_files(Path(args.root), Path(args.input) if args.input else None)
+    sets = []
+    if rho_values is not None:
+        nt = args.nt or table.nitt
+        sets.append(isochores(rho_values, np.linspace(table.ltmin, table.ltmax, nt)))
+    if t_values is not None:
+        nr = args.nrho or table.nidd
+        sets.append(isotherms(t_values, np.linspace(table.lrmin, table.lrmax, nr)))
+    if args.track:
+        sets.append(tracks([read_track(Path(p), args.track_cols, args.track_linear) for p in args.track],
+                           args.resample))
+
+    results = extract(table, *sets)
+    save_npz(Path(args.out), results)
+    for r in results:
+        n = int(r.slices.length.sum())
+        print(f"{r.slices.kind:9s} {r.slices.length.size:5d} slices, {n:9d} points "
+              f"({int(r.outside.sum())} outside the table)")
+    print(f"Saved {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
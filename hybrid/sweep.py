@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Parallel parameter sweep over hybrid-table variants.
+
+The six Semenov/Ferguson/OP source tables are read once and copied into one
+shared-memory block. Worker processes attach to that block (no per-variant
+reads or pickling of table data) and each builds one variant with
+build_hybrid.build_block, writing kR.dat, kP.dat, dust.dat, temp_fe_op.data
+and a copy of input.dat into <out-dir>/<variant>/. A manifest.json in
+<out-dir> lists every variant with its parameters, shape and build time.
+
+Variants are the Cartesian product of the list options, or an explicit JSON
+list given with --spec, e.g.
+  [{"name": "nodust", "use_dust": false},
+   {"name": "dep01", "depletion": 0.1, "temp_fe_op": 3.65, "tmpdfr": 0.02}]
+where keys other than name/use_dust are BlendParams fields.
+
+Usage:
+  python3 sweep.py --use-dust 1 0 --depletion 1 0.1 --temp-fe-op 3.6 3.7 --out-dir sweep
+  python3 sweep.py --spec variants.json --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 sweep.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .build_hybrid import BlendParams, HybridSources, build_hybrid, read_sources, write_outputs
+from .opacity_io import SourceTable, source_dir
+
+
+class Variant(NamedTuple):
+    name: str
+    use_dust: bool
+    params: BlendParams
+
+
+Layout = Dict[str, Tuple[int, Tuple[int, ...]]]
+
+# BlendParams fields that only act on dusty cells (no effect with use_dust = 0)
+DUST_ONLY_FIELDS = ("depletion", "tmp_dust")
+
+
+def share_sources(sources: HybridSources) -> Tuple[shared_memory.SharedMemory, Layout]:
+    """Copy all source arrays into one shared-memory block.
+
+    Returns the block and a layout mapping "<table>.<field>" to (offset, shape).
+    The caller owns the block and must close() and unlink() it.
+    """
+    layout: Layout = {}
+    offset = 0
+    for table, src in zip(HybridSources._fields, sources):
+        for field, arr in zip(SourceTable._fields, src):
+            layout[f"{table}.{field}"] = (offset, tuple(arr.shape))
+            offset += arr.size * 8
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for table, src in zip(HybridSources._fields, sources):
+        for field, arr in zip(SourceTable._fields, src):
+            off, shape = layout[f"{table}.{field}"]
+            np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=off)[...] = arr
+    return shm, layout
+
+
+def attach_sources(name: str, layout: Layout) -> Tuple[shared_memory.SharedMemory, HybridSources]:
+    """Attach to a block made by share_sources and return views of the tables."""
+    shm = shared_memory.SharedMemory(name=name)
+    tables = []
+    for table in HybridSources._fields:
+        fields = []
+        for field in SourceTable._fields:
+            off, shape = layout[f"{table}.{field}"]
+            arr = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=off)
+            arr.flags.writeable = False
+            fields.append(arr)
+        tables.append(SourceTable(*fields))
+    return shm, HybridSources(*tables)
+
+
+_WORKER: dict = {}
+
+
+def _init_worker(name: str, layout: Layout) -> None:
+    _WORKER["shm"], _WORKER["sources"] = attach_sources(name, layout)
+
+
+def _run_variant(variant: Variant, input_path: Path, out_dir: Path, text: bool) -> dict:
+    """Build and write one variant; errors are reported in the returned record."""
+    return run_variant(_WORKER["sources"], variant, input_path, out_dir, text)
+
+
+def run_variant(
+    sources: HybridSources, variant: Variant, input_path: Path, out_dir: Path, text: bool = False
+) -> dict:
+    record = {
+        "name": variant.name,
+        "use_dust": variant.use_dust,
+        "params": dataclasses.asdict(variant.params),
+        "dir": variant.name,
+    }
+    t0 = time.perf_counter()
+    try:
+        tmp, rho, opa_ros, opa_pla, dust = build_hybrid(
+            input_path, sources, variant.use_dust, variant.params
+        )
+    except ValueError as exc:
+        record["error"] = str(exc)
+        return record
+    vdir = out_dir / variant.name
+    write_outputs(vdir, tmp, rho, opa_ros, opa_pla, dust, variant.params, text=text)
+    shutil.copyfile(input_path, vdir / "input.dat")
+    record["shape"] = [len(tmp), len(rho)]
+    record["seconds"] = round(time.perf_counter() - t0, 4)
+    return record
+
+
+def variant_name(use_dust: bool, params: BlendParams) -> str:
+    """Readable directory name listing the parameters that differ from the defaults."""
+    parts = [f"dust{int(use_dust)}"]
+    default = BlendParams()
+    for f in dataclasses.fields(BlendParams):
+        value = getattr(params, f.name)
+        if value != getattr(default, f.name):
+            parts.append(f"{f.name}{value:g}")
+    return "_".join(parts)
+
+
+def effective_params(use_dust: bool, params: BlendParams) -> BlendParams:
+    """``params`` with the dust-only fields reset to their defaults when dust is off."""
+    if use_dust:
+        return params
+    default = BlendParams()
+    return dataclasses.replace(params, **{f: getattr(default, f) for f in DUST_ONLY_FIELDS})
+
+
+def unique_variants(variants: List[Variant]) -> List[Variant]:
+    """Drop variants that build the same table as an earlier one (same effective parameters)."""
+    seen = set()
+    out = []
+    for v in variants:
+        key = (v.use_dust, effective_params(v.use_dust, v.params))
+        if key not in seen:
+            seen.add(key)
+            out.append(v)
+    return out
+
+
+def grid_variants(
+    use_dust: List[int],
+    depletion: List[float],
+    temp_fe_op: List[float],
+    tmpdsr: List[float],
+    tmpdfr: List[float],
+    tmpdor: List[float],
+) -> List[Variant]:
+    """Cartesian product of parameter lists; widths apply to both means.
+
+    Without dust, variants differing only in dust-only fields collapse into one.
+    """
+    variants = []
+    for ud, dep, tfo, ds, df, do in itertools.product(
+        use_dust, depletion, temp_fe_op, tmpdsr, tmpdfr, tmpdor
+    ):
+        params = BlendParams(
+            temp_fe_op=tfo,
+            tmpdsr=ds,
+            tmpdsp=ds,
+            tmpdfr=df,
+            tmpdfp=df,
+            tmpdor=do,
+            tmpdop=do,
+            depletion=dep,
+        )
+        params = effective_params(bool(ud), params)
+        variants.append(Variant(variant_name(bool(ud), params), bool(ud), params))
+    return unique_variants(variants)
+
+
+def spec_variants(path: Path) -> List[Variant]:
+    """Variants from a JSON list of {name?, use_dust?, <BlendParams field>: value}."""
+    variants = []
+    for entry in json.loads(path.read_text()):
+        entry = dict(entry)
+        name = entry.pop("name", None)
+        use_dust = bool(entry.pop("use_dust", True))
+        params = dataclasses.replace(BlendParams(), **entry)
+        variants.append(Variant(name or variant_name(use_dust, params), use_dust, params))
+    return variants
+
+
+def run_sweep(
+    variants: List[Variant],
+    input_path: Path,
+    source_dirs: Tuple[Path, Path, Path],
+    out_dir: Path,
+    workers: Optional[int] = None,
+    text: bool = False,
+) -> dict:
+    """Build all variants over a process pool sharing one copy of the sources."""
+    names = [v.name for v in variants]
+    if len(set(names)) != len(names):
+        raise ValueError("variant names must be unique")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sources = read_sources(*source_dirs)
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    if workers == 1:
+        records = [run_variant(sources, v, input_path, out_dir, text) for v in variants]
+    else:
+        shm, layout = share_sources(sources)
+        del sources
+        try:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(variants)) or 1,
+                initializer=_init_worker,
+                initargs=(shm.name, layout),
+            ) as pool:
+                futures = [pool.submit(_run_variant, v, input_path, out_dir, text) for v in variants]
+                records = [f.result() for f in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+    manifest = {
+        "input": str(input_path),
+        "sources": [str(d) for d in source_dirs],
+        "workers": workers,
+        "seconds": round(time.perf_counter() - t0, 4),
+        "variants": records,
+    }
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2) + "\n")
+    return manifest
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build many hybrid-table variants in parallel.")
+    parser.add_argument("--input", default="input.dat", help="Grid ranges file (log10 units)")
+    parser.add_argument("--semenov-dir", default=str(source_dir("Semenov")), help="Directory with semenov_*.data")
+    parser.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")), help="Directory with ferguson_*.data")
+    parser.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")), help="Directory with op_*.data")
+    parser.add_argument("--out-dir", default="sweep", help="Output directory for variants and manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--text", action="store_true", help="Also write opacity_table.txt per variant")
+    parser.add_argument("--spec", default=None, help="JSON list of variants (overrides the list options)")
+    parser.add_argument("--use-dust", type=int, nargs="+", choices=(0, 1), default=[1])
+    parser.add_argument("--depletion", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--temp-fe-op", type=float, nargs="+", default=[BlendParams.temp_fe_op])
+    parser.add_argument("--tmpdsr", type=float, nargs="+", default=[BlendParams.tmpdsr])
+    parser.add_argument("--tmpdfr", type=float, nargs="+", default=[BlendParams.tmpdfr])
+    parser.add_argument("--tmpdor", type=float, nargs="+", default=[BlendParams.tmpdor])
+    args = parser.parse_args(argv)
+
+    if args.spec:
+        variants = spec_variants(Path(args.spec))
+    else:
+        variants = grid_variants(
+            args.use_dust, args.depletion, args.temp_fe_op, args.tmpdsr, args.tmpdfr, args.tmpdor
+        )
+    source_dirs = (Path(args.semenov_dir), Path(args.ferguson_dir), Path(args.op_dir))
+    manifest = run_sweep(variants, Path(args.input), source_dirs, Path(args.out_dir), args.workers, args.text)
+    failed = [r for r in manifest["variants"] if "error" in r]
+    print(
+        f"Built {len(variants) - len(failed)}/{len(variants)} variants in {manifest['seconds']} s "
+        f"-> {Path(args.out_dir) / 'manifest.json'}"
+    )
+    for r in failed:
+        print(f"  {r['name']}: {r['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,214 @@
+"""
+Native-endian binary cache for parsed opacity tables.
+
+Each entry holds the arrays of one parsed table (axes + data, already log10
+where applicable) in a single file:
+- 8-byte magic, 8-byte little-endian header length, JSON header
+- arrays in native byte order, each starting on a 64-byte boundary
+
+Entries are keyed by the resolved path, size and modification time (ns) of
+each source file (plus input.dat for hybrid tables), so opening a table costs
+a few stat calls and editing or regenerating an input invalidates its entry.
+With OPTAB_CACHE_VERIFY=1 a hit is also checked against a SHA-256 of the
+file contents stored in the entry (this reads every byte of the sources).
+Loading maps the file once and returns array views into that mapping.
+
+Entries are evicted least recently used first (a hit refreshes the entry's
+mtime) once the directory holds more than OPTAB_CACHE_MAX_MB.
+
+Environment:
+- OPTAB_CACHE=0 disables the cache
+- OPTAB_CACHE_DIR sets the cache directory (default: $XDG_CACHE_HOME/optab14
+  or ~/.cache/optab14)
+- OPTAB_CACHE_MAX_MB bounds its size (default 1024)
+- OPTAB_CACHE_VERIFY=1 checks the source contents on every hit
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+from .tracing import span
+
+MAGIC = b"OPTABC01"
+CACHE_VERSION = 2
+ALIGN = 64
+DEFAULT_MAX_MB = 1024.0
+
+
+def cache_dir() -> Optional[Path]:
+    """Cache directory from the environment, or None when caching is disabled."""
+    if os.environ.get("OPTAB_CACHE", "1").strip().lower() in ("0", "no", "off", "false"):
+        return None
+    if os.environ.get("OPTAB_CACHE_DIR"):
+        return Path(os.environ["OPTAB_CACHE_DIR"])
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "optab14"
+
+
+def _enabled(name: str) -> bool:
+    return os.environ.get(name, "0").strip().lower() not in ("", "0", "no", "off", "false")
+
+
+def max_bytes() -> int:
+    """Size bound of the cache directory from OPTAB_CACHE_MAX_MB."""
+    try:
+        mb = float(os.environ.get("OPTAB_CACHE_MAX_MB") or DEFAULT_MAX_MB)
+    except ValueError:
+        mb = DEFAULT_MAX_MB
+    return int(mb * 2**20)
+
+
+def stat_key(kind: str, paths: Sequence[Path], extra: str = "") -> str:
+    """SHA-256 over the reader kind, its options and the path, size and mtime of ``paths``."""
+    h = hashlib.sha256()
+    h.update(f"{kind}\0{CACHE_VERSION}\0{extra}\0".encode())
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{Path(path).resolve()}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+    return h.hexdigest()
+
+
+def content_key(kind: str, paths: Sequence[Path], extra: str = "") -> str:
+    """SHA-256 over the reader kind, its options and the contents of ``paths``."""
+    h = hashlib.sha256()
+    h.update(f"{kind}\0{CACHE_VERSION}\0{extra}\0".encode())
+    for path in paths:
+        with Path(path).open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _entry_path(key: str) -> Optional[Path]:
+    root = cache_dir()
+    return None if root is None else root / f"{key}.bin"
+
+
+def store(key: str, arrays: Dict[str, np.ndarray], content: Optional[str] = None) -> None:
+    """Write ``arrays`` under ``key`` (with the sources' ``content`` hash, if given).
+
+    Failures only mean the next run parses again.
+    """
+    path = _entry_path(key)
+    if path is None:
+        return
+    entries = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.asarray(arr)
+        order = "F" if arr.flags.f_contiguous and not arr.flags.c_contiguous else "C"
+        dtype = arr.dtype.newbyteorder("=")
+        entries[name] = {"dtype": dtype.str, "shape": list(arr.shape), "order": order, "offset": offset}
+        offset += -(-arr.size * dtype.itemsize // ALIGN) * ALIGN
+    header = json.dumps({"version": CACHE_VERSION, "content": content, "arrays": entries}).encode()
+    data_start = -(-(16 + len(header)) // ALIGN) * ALIGN
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, arr in arrays.items():
+                e = entries[name]
+                f.seek(data_start + e["offset"])
+                f.write(np.asarray(arr, dtype=e["dtype"]).tobytes(order=e["order"]))
+            f.truncate(data_start + offset)
+        os.replace(tmp, path)
+    except OSError:
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+        return
+    evict(path.parent, max_bytes(), keep=path)
+
+
+def evict(root: Path, limit: int, keep: Optional[Path] = None) -> None:
+    """Delete the least recently used entries until ``root`` holds at most ``limit`` bytes."""
+    entries = []
+    for p in root.glob("*.bin"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries, key=lambda e: e[0]):
+        if total <= limit:
+            break
+        if p == keep:
+            continue
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
+
+
+def load(key: str, content: Optional[str] = None) -> Optional[Dict[str, np.ndarray]]:
+    """Return the arrays stored under ``key`` as read-only views of one mmap, or None.
+
+    With ``content`` the entry must have been stored with that content hash.
+    A hit refreshes the entry's mtime (its rank for eviction).
+    """
+    path = _entry_path(key)
+    if path is None or not path.exists():
+        return None
+    try:
+        with path.open("rb") as f:
+            head = f.read(16)
+            if len(head) != 16 or head[:8] != MAGIC:
+                return None
+            (nheader,) = struct.unpack("<Q", head[8:])
+            meta = json.loads(f.read(nheader))
+        if meta.get("version") != CACHE_VERSION or (content is not None and meta.get("content") != content):
+            return None
+        data_start = -(-(16 + nheader) // ALIGN) * ALIGN
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        out = {}
+        for name, e in meta["arrays"].items():
+            out[name] = np.ndarray(
+                tuple(e["shape"]),
+                dtype=np.dtype(e["dtype"]),
+                buffer=mm,
+                offset=data_start + e["offset"],
+                order=e["order"],
+            )
+        os.utime(path)
+        return out
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def cached(
+    kind: str,
+    paths: Sequence[Path],
+    parse: Callable[[], Dict[str, np.ndarray]],
+    extra: str = "",
+) -> Dict[str, np.ndarray]:
+    """Load the parsed arrays for ``paths`` from the cache, parsing and storing on a miss."""
+    if cache_dir() is None:
+        return parse()
+    with span("cache.key", kind=kind):
+        key = stat_key(kind, paths, extra)
+    content = None
+    if _enabled("OPTAB_CACHE_VERIFY"):
+        with span("cache.hash", kind=kind):
+            content = content_key(kind, paths, extra)
+    with span("cache.load", kind=kind):
+        hit = load(key, content)
+    if hit is not None:
+        return hit
+    with span("cache.parse", kind=kind):
+        arrays = parse()
+    with span("cache.store", kind=kind):
+        store(key, arrays, content)
+    return load(key, content) or arrays
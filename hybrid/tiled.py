@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Out-of-core tiled build and reader for very high-resolution hybrid tables.
+
+The table is computed block by block with build_hybrid.build_block and each
+block is streamed into a memory-mapped tile file, so peak memory is bounded by
+the tile size rather than by the table size.
+
+Tile file layout (native byte order):
+- magic b"OPTABTILES1\\n", 8-byte little-endian header length, JSON header
+  (grid, tile shape, tile counts, per-field dtype and byte offset, and the
+  dependency digests of every tile)
+- one region per field (log_kr, log_kp as float64, dust as uint8), starting on
+  a page boundary; each region holds ntile_t x ntile_r tiles of ti x tj values
+  in C order, edge tiles padded (NaN for opacities, 0 for dust)
+
+Tile boundaries sit on a lattice fixed by the grid step (log T = k * dlt), so
+extending the range in input.dat keeps the interior tiles in place. Each tile
+records digests of what it depends on: its log T / log rho axes, the blend
+weights and dust parameters on its rows, and the part of each source table
+its bilinear gathers touch. With --incremental, tiles whose digests are all
+unchanged are copied from the previous file instead of recomputed.
+
+Digests use the lattice coordinates k * step. When the range start moves, a
+reused tile keeps the values computed at the previous run's min + step * i,
+which may differ from a fresh build in the last bit of the coordinate; build
+without --incremental for a byte-exact reproduction of hybrid.F90.
+
+Values are the log10 opacities of hybrid.F90 before exponentiation, identical
+to a full build_hybrid.py run on the same grid.
+
+Usage:
+  python3 tiled.py build [--input input.dat] [--tile 512 512] [--out hybrid.tiles] [--incremental]
+  python3 tiled.py extract --tiles hybrid.tiles --window 3.5 4.0 -10 -8 --out-dir zoom
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+if not __package__:  # run as a script (python3 tiled.py): import the siblings as the hybrid package
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    __package__ = "hybrid"
+
+from .build_hybrid import (
+    BlendParams,
+    HybridSources,
+    blend_weights,
+    build_block,
+    grid_axes,
+    pow10,
+    read_sources,
+    read_use_dust,
+)
+from .opacity_io import read_input_dat, source_dir, write_fortran_unformatted_matrix
+
+MAGIC = b"OPTABTILES1\n"
+PAGE = 4096
+FIELDS = {"log_kr": "f8", "log_kp": "f8", "dust": "u1"}
+PAD = {"log_kr": np.nan, "log_kp": np.nan, "dust": 0}
+
+
+def _page(n: int) -> int:
+    return -(-n // PAGE) * PAGE
+
+
+def _lattice(lmin: float, step: float) -> Optional[int]:
+    """Lattice index of the first grid point (lmin = k * step), or None if off-lattice."""
+    k = lmin / step
+    return int(round(k)) if abs(k - round(k)) < 1e-6 else None
+
+
+def _canonical(axis: np.ndarray, lmin: float, step: float) -> np.ndarray:
+    """Axis as lattice index times step, used to match tiles across input.dat ranges.
+
+    min + step * i (as in hybrid.F90) can differ in the last bit between two
+    ranges for the same grid point; the lattice form does not.
+    """
+    k0 = _lattice(lmin, step)
+    return axis if k0 is None else step * (k0 + np.arange(axis.size, dtype=np.float64))
+
+
+def _shift(lmin: float, step: float, tile: int) -> int:
+    """Offset of row 0 inside its tile on the global lattice (0 if off-lattice)."""
+    k0 = _lattice(lmin, step)
+    return 0 if k0 is None else k0 % tile
+
+
+def _spans(n: int, tile: int, shift: int) -> List[Tuple[int, int]]:
+    """(start, stop) row ranges of the tiles along one axis."""
+    count = -(-(n + shift) // tile)
+    return [(max(a * tile - shift, 0), min((a + 1) * tile - shift, n)) for a in range(count)]
+
+
+def _layout(nitt: int, nidd: int, tile: Tuple[int, int], shift: Tuple[int, int]) -> Dict:
+    """Tile counts and per-field offsets (relative to the data start)."""
+    ti, tj = tile
+    nta = -(-(nitt + shift[0]) // ti)
+    ntr = -(-(nidd + shift[1]) // tj)
+    fields = {}
+    offset = 0
+    for name, dtype in FIELDS.items():
+        dt = np.dtype(dtype).newbyteorder("=")
+        fields[name] = {"dtype": dt.str, "offset": offset}
+        offset += _page(nta * ntr * ti * tj * dt.itemsize)
+    return {"tile": [ti, tj], "shift": list(shift), "ntiles": [nta, ntr], "fields": fields, "size": offset}
+
+
+def _digest(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.tobytes() if isinstance(part, np.ndarray) else repr(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()[:32]
+
+
+def _source_digest(src, tmp: np.ndarray, rho: np.ndarray) -> str:
+    """Digest of the rows/columns of ``src`` that interpolate_source reads for a tile.
+
+    Also covers the table edges, which decide the -100 and density clamping branches.
+    """
+    t, d, opa = src
+    nt, nd = opa.shape
+    it = np.clip(np.searchsorted(t, tmp[[0, -1]], side="left"), 1, nt - 1)
+    jd = np.searchsorted(d, rho[[0, -1]], side="left")
+    r0, r1 = it[0] - 1, it[1] + 1
+    c0, c1 = max(jd[0] - 1, 0), min(jd[1], nd - 1) + 1
+    return _digest(
+        (nt, nd), t[[0, -1]], d[[0, -1]], t[r0:r1], d[c0:c1], np.ascontiguousarray(opa[r0:r1, c0:c1])
+    )
+
+
+def tile_deps(
+    sources: HybridSources, tmp: np.ndarray, rho: np.ndarray, use_dust: bool, params: BlendParams
+) -> Dict[str, str]:
+    """Digests of everything build_block reads for one tile.
+
+    "axes": the log T / log rho values; "params": the four blend weights on the
+    tile rows plus the dust settings; one entry per source table.
+    """
+    deps = {
+        "axes": _digest(tmp, rho),
+        "params": _digest(
+            np.stack(blend_weights(tmp, params)),
+            bool(use_dust),
+            params.opacity_dust,
+            params.tmp_dust,
+            params.depletion,
+        ),
+    }
+    for name, src in zip(HybridSources._fields, sources):
+        deps[name] = _source_digest(src, tmp, rho)
+    return deps
+
+
+def _tile_key(deps: Dict[str, str]) -> str:
+    return _digest(*(f"{k}={deps[k]}" for k in sorted(deps)))
+
+
+def build_tiled(
+    input_path: Path,
+    sources: HybridSources,
+    out_path: Path,
+    tile: Tuple[int, int] = (512, 512),
+    use_dust: bool = True,
+    params: BlendParams = BlendParams(),
+    previous: Optional[Path] = None,
+) -> Dict:
+    """Build the table described by input.dat tile by tile into ``out_path``.
+
+    With ``previous`` (an earlier tile file, may be ``out_path`` itself), tiles
+    whose dependency digests match a tile there are copied instead of computed.
+    Returns the header written to the file; header["report"] counts recomputed
+    and reused tiles and, for recomputed ones, which dependencies changed.
+    """
+    nitt, nidd, ltmin, ltmax, dlt, lrmin, lrmax, dlr = read_input_dat(input_path)
+    t_ser0 = sources.ros_se.t[0]
+    if use_dust and ltmin < t_ser0:
+        raise ValueError(
+            f"tmp_min (log10T={ltmin}) is below Semenov dust table min (log10T={t_ser0}). "
+            "Please raise tmp_min or disable dust via use_dust.in (set 0)."
+        )
+    tmp, rho = grid_axes(ltmin, dlt, nitt, lrmin, dlr, nidd)
+    shift = (_shift(ltmin, dlt, tile[0]), _shift(lrmin, dlr, tile[1]))
+    layout = _layout(nitt, nidd, tile, shift)
+    rows = _spans(nitt, tile[0], shift[0])
+    cols = _spans(nidd, tile[1], shift[1])
+    tmp_c = _canonical(tmp, ltmin, dlt)
+    rho_c = _canonical(rho, lrmin, dlr)
+    deps = [
+        [tile_deps(sources, tmp_c[i0:i1], rho_c[j0:j1], use_dust, params) for j0, j1 in cols] for i0, i1 in rows
+    ]
+
+    old = None
+    old_keys: Dict[str, Tuple[int, int]] = {}
+    old_axes: Dict[str, Dict[str, str]] = {}
+    if previous is not None and Path(previous).exists():
+        old = TiledTable(Path(previous))
+        for a, row in enumerate(old.header.get("deps", [])):
+            for b, d in enumerate(row):
+                old_keys[_tile_key(d)] = (a, b)
+                old_axes[d["axes"]] = d
+
+    header = {
+        "grid": {"ltmin": ltmin, "ltmax": ltmax, "dlt": dlt, "nitt": nitt,
+                 "lrmin": lrmin, "lrmax": lrmax, "dlr": dlr, "nidd": nidd},
+        "use_dust": bool(use_dust),
+        **layout,
+        "deps": deps,
+    }
+    blob = json.dumps(header).encode()
+    data_start = _page(len(MAGIC) + 8 + len(blob) + 64)
+    header["data_start"] = data_start
+    blob = json.dumps(header).encode()
+
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(blob)) + blob)
+        f.truncate(data_start + layout["size"])
+
+    ti, tj = tile
+    ntr = layout["ntiles"][1]
+    reasons: Dict[str, int] = {}
+    recomputed = 0
+    try:
+        for a, (i0, i1) in enumerate(rows):
+            for b, (j0, j1) in enumerate(cols):
+                ni, nj = i1 - i0, j1 - j0
+                hit = old_keys.get(_tile_key(deps[a][b]))
+                if hit is not None:
+                    # first tile on each axis starts at the lattice shift
+                    oi = old.shift[0] if hit[0] == 0 else 0
+                    oj = old.shift[1] if hit[1] == 0 else 0
+                    values = {name: old._tiles(name)[hit][oi : oi + ni, oj : oj + nj] for name in FIELDS}
+                else:
+                    recomputed += 1
+                    prev = old_axes.get(deps[a][b]["axes"])
+                    changed = [k for k, v in deps[a][b].items() if prev is None or prev.get(k) != v]
+                    for k in changed if prev is not None else ["grid"]:
+                        reasons[k] = reasons.get(k, 0) + 1
+                    opa_ros, opa_pla, dust = build_block(sources, tmp[i0:i1], rho[j0:j1], use_dust, params)
+                    values = {"log_kr": opa_ros, "log_kp": opa_pla, "dust": dust}
+                for name, spec in layout["fields"].items():
+                    dt = np.dtype(spec["dtype"])
+                    off = data_start + spec["offset"] + (a * ntr + b) * ti * tj * dt.itemsize
+                    mm = np.memmap(tmp_path, dtype=dt, mode="r+", offset=off, shape=(ti, tj))
+                    mm[...] = PAD[name]
+                    pi = shift[0] if a == 0 else 0
+                    pj = shift[1] if b == 0 else 0
+                    mm[pi : pi + ni, pj : pj + nj] = values[name]
+                    mm.flush()
+                    del mm
+    except BaseException:
+        tmp_path.unlink()
+        raise
+    if old is not None:
+        old.close()
+    os.replace(tmp_path, out_path)
+    total = len(rows) * len(cols)
+    header["report"] = {"tiles": total, "recomputed": recomputed, "reused": total - recomputed, "reasons": reasons}
+    return header
+
+
+class TiledTable:
+    """Reader for tile files made by build_tiled; maps sub-rectangles on demand."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a tiled opacity table")
+            (n,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(n))
+        g = self.header["grid"]
+        self.ltmin, self.dlt, self.nitt = g["ltmin"], g["dlt"], g["nitt"]
+        self.lrmin, self.dlr, self.nidd = g["lrmin"], g["dlr"], g["nidd"]
+        self.tile = tuple(self.header["tile"])
+        self.shift = tuple(self.header.get("shift", (0, 0)))
+        self.ntiles = tuple(self.header["ntiles"])
+        self._maps: Dict[str, np.memmap] = {}
+
+    def close(self) -> None:
+        """Drop the file mappings (views already returned stay valid)."""
+        self._maps.clear()
+
+    def _tiles(self, field: str) -> np.memmap:
+        """Lazy view of all tiles of ``field`` with shape (ntile_t, ntile_r, ti, tj)."""
+        if field not in self._maps:
+            spec = self.header["fields"][field]
+            self._maps[field] = np.memmap(
+                self.path,
+                dtype=np.dtype(spec["dtype"]),
+                mode="r",
+                offset=self.header["data_start"] + spec["offset"],
+                shape=self.ntiles + self.tile,
+            )
+        return self._maps[field]
+
+    def window(self, field: str, i0: int, i1: int, j0: int, j1: int) -> np.ndarray:
+        """Copy of ``field`` rows i0:i1 (log T) and columns j0:j1 (log rho).
+
+        Only the tiles overlapping the window are touched.
+        """
+        i0, i1 = max(i0, 0), min(i1, self.nitt)
+        j0, j1 = max(j0, 0), min(j1, self.nidd)
+        ti, tj = self.tile
+        # positions on the tile lattice
+        i0, i1 = i0 + self.shift[0], i1 + self.shift[0]
+        j0, j1 = j0 + self.shift[1], j1 + self.shift[1]
+        a0, a1 = i0 // ti, -(-i1 // ti)
+        b0, b1 = j0 // tj, -(-j1 // tj)
+        block = self._tiles(field)[a0:a1, b0:b1]
+        block = block.transpose(0, 2, 1, 3).reshape((a1 - a0) * ti, (b1 - b0) * tj)
+        out = block[i0 - a0 * ti : i1 - a0 * ti, j0 - b0 * tj : j1 - b0 * tj]
+        return np.array(out, dtype=np.float64)
+
+    def index_window(self, ltmin: float, ltmax: float, lrmin: float, lrmax: float) -> Tuple[int, int, int, int]:
+        """Index ranges (i0, i1, j0, j1) covering a (log T, log rho) rectangle."""
+        i0 = max(int(math.floor((ltmin - self.ltmin) / self.dlt)), 0)
+        i1 = min(int(math.ceil((ltmax - self.ltmin) / self.dlt)) + 1, self.nitt)
+        j0 = max(int(math.floor((lrmin - self.lrmin) / self.dlr)), 0)
+        j1 = min(int(math.ceil((lrmax - self.lrmin) / self.dlr)) + 1, self.nidd)
+        return i0, i1, j0, j1
+
+    def opacity_table(self, i0: int, i1: int, j0: int, j1: int):
+        """OpacityTable (runtime lookup) on a window of the tiled table."""
+        from .opacity_lookup import OpacityTable
+
+        return OpacityTable(
+            self.ltmin + self.dlt * i0,
+            self.dlt,
+            self.lrmin + self.dlr * j0,
+            self.dlr,
+            self.window("log_kr", i0, i1, j0, j1),
+            self.window("log_kp", i0, i1, j0, j1),
+            self.window("dust", i0, i1, j0, j1),
+        )
+
+    def extract(self, out_dir: Path, i0: int, i1: int, j0: int, j1: int) -> None:
+        """Write a window as kR.dat, kP.dat, dust.dat and input.dat for the other tools."""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        i1 = min(i1, self.nitt)
+        j1 = min(j1, self.nidd)
+        write_fortran_unformatted_matrix(out_dir / "kR.dat", pow10(self.window("log_kr", i0, i1, j0, j1)))
+        write_fortran_unformatted_matrix(out_dir / "kP.dat", pow10(self.window("log_kp", i0, i1, j0, j1)))
+        write_fortran_unformatted_matrix(out_dir / "dust.dat", self.window("dust", i0, i1, j0, j1))
+        ltmin = self.ltmin + self.dlt * i0
+        lrmin = self.lrmin + self.dlr * j0
+        # Half-step margins keep int((max - min) / step) + 1 equal to the window size
+        (out_dir / "input.dat").write_text(
+            f"{ltmin!r} {ltmin + self.dlt * (i1 - i0 - 1) + 0.5 * self.dlt!r} {self.dlt!r}  "
+            f"{lrmin!r} {lrmin + self.dlr * (j1 - j0 - 1) + 0.5 * self.dlr!r} {self.dlr!r}\n"
+        )
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Tiled out-of-core hybrid table build and reader.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Build the table tile by tile")
+    b.add_argument("--input", default="input.dat", help="Grid ranges file (log10 units)")
+    b.add_argument("--semenov-dir", default=str(source_dir("Semenov")))
+    b.add_argument("--ferguson-dir", default=str(source_dir("Ferguson")))
+    b.add_argument("--op-dir", default=str(source_dir("OPCD_3.3")))
+    b.add_argument("--tile", type=int, nargs=2, default=[512, 512], metavar=("NT", "NRHO"))
+    b.add_argument("--use-dust", type=int, choices=(0, 1), default=None)
+    b.add_argument("--out", default="hybrid.tiles", help="Output tile file")
+    b.add_argument("--incremental", action="store_true", help="Reuse unchanged tiles of an existing --out file")
+    b.add_argument("--previous", default=None, help="Reuse tiles from this file instead of --out")
+    for f in ("temp_fe_op", "tmpdsr", "tmpdsp", "tmpdfr", "tmpdfp", "tmpdor", "tmpdop", "depletion"):
+        b.add_argument("--" + f.replace("_", "-"), type=float, default=getattr(BlendParams, f))
+    e = sub.add_parser("extract", help="Write a window as kR.dat/kP.dat/dust.dat/input.dat")
+    e.add_argument("--tiles", default="hybrid.tiles", help="Tile file")
+    e.add_argument("--window", type=float, nargs=4, required=True,
+                   metavar=("LTMIN", "LTMAX", "LRMIN", "LRMAX"))
+    e.add_argument("--out-dir", required=True)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        input_path = Path(args.input)
+        use_dust = read_use_dust(input_path.parent) if args.use_dust is None else bool(args.use_dust)
+        sources = read_sources(Path(args.semenov_dir), Path(args.ferguson_dir), Path(args.op_dir))
+        params = BlendParams(
+            temp_fe_op=args.temp_fe_op,
+            tmpdsr=args.tmpdsr,
+            tmpdsp=args.tmpdsp,
+            tmpdfr=args.tmpdfr,
+            tmpdfp=args.tmpdfp,
+            tmpdor=args.tmpdor,
+            tmpdop=args.tmpdop,
+            depletion=args.depletion,
+        )
+        previous = Path(args.previous) if args.previous else (Path(args.out) if args.incremental else None)
+        t0 = time.perf_counter()
+        try:
+            header = build_tiled(input_path, sources, Path(args.out), tuple(args.tile), use_dust, params, previous)
+        except ValueError as exc:
+            print(f"ERROR: {exc}")
+            return 1
+        g = header["grid"]
+        r = header["report"]
+        print(
+            f"Wrote {args.out}: {g['nitt']}x{g['nidd']} in {header['ntiles'][0]}x{header['ntiles'][1]} "
+            f"tiles of {header['tile'][0]}x{header['tile'][1]} ({time.perf_counter() - t0:.2f} s)"
+        )
+        print(f"  recomputed {r['recomputed']}/{r['tiles']} tiles, reused {r['reused']}")
+        if r["reasons"]:
+            print("  changed: " + ", ".join(f"{k} ({n})" for k, n in sorted(r["reasons"].items())))
+    else:
+        table = TiledTable(Path(args.tiles))
+        i0, i1, j0, j1 = table.index_window(*args.window)
+        table.extract(Path(args.out_dir), i0, i1, j0, j1)
+        print(f"Wrote {i1 - i0}x{j1 - j0} window to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
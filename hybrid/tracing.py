@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Stage-level timing spans for the table tools, written as a Chrome trace.
+
+Disabled unless $OPTAB_TRACE names an output file (``optab --trace FILE``
+sets it). Each span becomes a complete event ("ph": "X") with wall time,
+byte count, throughput and memory (current RSS before/after, process peak
+RSS), plus an RSS counter sample, so the file opens as a flame chart in
+Perfetto (ui.perfetto.dev), chrome://tracing or speedscope.
+
+Events are appended to the file as they finish, one JSON object per line,
+using the JSON array format whose closing bracket is optional; worker
+processes of render.py and sweep.py inherit the variable and write to the
+same file. The first process to start tracing truncates it.
+
+In code:
+    with span("build.blend", nbytes=arr.nbytes):
+        ...
+    @traced("read.sources")
+    def read_sources(...): ...
+When tracing is off, span() returns a shared no-op object.
+
+Usage:
+  OPTAB_TRACE=trace.json python3 build_hybrid.py
+  python3 tracing.py summary trace.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+ENV = "OPTAB_TRACE"
+# pid of the process that started the trace (children append instead of truncating)
+_OWNER_ENV = "OPTAB_TRACE_PID"
+
+_fd: Optional[int] = None
+_pids = set()
+_lock = threading.Lock()
+
+
+def _rss_mib() -> Optional[float]:
+    """Current resident set size (Linux /proc), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_mib() -> Optional[float]:
+    """Peak resident set size of this process so far (ru_maxrss, KiB on Linux)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write(event: dict) -> None:
+    pid = os.getpid()
+    event["pid"] = pid
+    lines = []
+    if pid not in _pids:
+        _pids.add(pid)
+        lines.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"optab {pid}"}})
+    lines.append(event)
+    data = "".join(json.dumps(e, separators=(",", ":")) + ",\n" for e in lines).encode()
+    with _lock:
+        os.write(_fd, data)
+
+
+def enable(path: Optional[str] = None) -> None:
+    """Start tracing to ``path`` (default: $OPTAB_TRACE); child processes inherit it."""
+    global _fd
+    path = path or os.environ.get(ENV)
+    if not path:
+        return
+    owner = os.environ.get(_OWNER_ENV)
+    fresh = owner is None or os.environ.get(ENV) != path
+    os.environ[ENV] = path
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (os.O_TRUNC if fresh else 0)
+    if _fd is not None:
+        os.close(_fd)
+    _fd = os.open(path, flags, 0o644)
+    if fresh:
+        os.environ[_OWNER_ENV] = str(os.getpid())
+        os.write(_fd, b"[\n")
+
+
+def enabled() -> bool:
+    return _fd is not None
+
+
+class Span:
+    """An open span; set ``nbytes`` or add ``args`` before it closes."""
+
+    __slots__ = ("name", "nbytes", "args", "_t0", "_rss0")
+
+    def __init__(self, name: str, nbytes: int = 0, args: Optional[dict] = None):
+        self.name = name
+        self.nbytes = nbytes
+        self.args = args or {}
+
+    def __enter__(self) -> "Span":
+        self._rss0 = _rss_mib()
+        self._t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        t1 = time.perf_counter_ns()
+        dur = (t1 - self._t0) / 1000.0
+        rss = _rss_mib()
+        args = dict(self.args)
+        if self.nbytes:
+            args["bytes"] = int(self.nbytes)
+            if dur > 0:
+                args["MB/s"] = round(self.nbytes / dur, 1)
+        args["rss_mib"] = [None if self._rss0 is None else round(self._rss0, 1), None if rss is None else round(rss, 1)]
+        args["peak_rss_mib"] = _peak_rss_mib()
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        tid = threading.get_ident() & 0xFFFFFFFF
+        _write({"name": self.name, "cat": "optab", "ph": "X", "ts": self._t0 / 1000.0, "dur": dur,
+                "tid": tid, "args": args})
+        if rss is not None:
+            _write({"name": "rss_mib", "ph": "C", "ts": t1 / 1000.0, "tid": tid, "args": {"rss": round(rss, 1)}})
+
+
+class _NullSpan:
+    """Stand-in returned while tracing is off."""
+
+    nbytes = 0
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.args.clear()
+
+
+_NULL = _NullSpan()
+
+
+def span(name: str, nbytes: int = 0, **args):
+    """Context manager timing the enclosed stage (a no-op unless tracing is enabled)."""
+    if _fd is None:
+        return _NULL
+    return Span(name, nbytes, args)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping each call of a function in a span."""
+
+    def wrap(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def inner(*a, **kw):
+            if _fd is None:
+                return func(*a, **kw)
+            with Span(label):
+                return func(*a, **kw)
+
+        return inner
+
+    return wrap
+
+
+def load_trace(path: Path) -> List[dict]:
+    """Events of a trace file (array format, closing bracket optional)."""
+    text = Path(path).read_text().strip()
+    if text.endswith(","):
+        text = text[:-1]
+    if not text.endswith("]"):
+        text += "]"
+    data = json.loads(text)
+    return data["traceEvents"] if isinstance(data, dict) else data
+
+
+def summarize(events: List[dict]) -> Dict[str, dict]:
+    """Per span name: count, total/max seconds, bytes and the largest peak RSS."""
+    out: Dict[str, dict] = {}
+    for e in events:
+        if e.get("ph") != "X":
+            continue
+        s = out.setdefault(e["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "peak_rss_mib": 0.0})
+        sec = e["dur"] / 1e6
+        s["count"] += 1
+        s["seconds"] += sec
+        s["max_seconds"] = max(s["max_seconds"], sec)
+        s["bytes"] += e["args"].get("bytes", 0)
+        s["peak_rss_mib"] = max(s["peak_rss_mib"], e["args"].get("peak_rss_mib") or 0.0)
+    return out
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Summarize an OPTAB_TRACE file.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("summary", help="Time, bytes and peak RSS per span name")
+    s.add_argument("trace", help="Trace file")
+    s.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    stats = summarize(load_trace(Path(args.trace)))
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+    print(f"{'span':32s} {'count':>6s} {'total s':>9s} {'max s':>9s} {'MiB':>9s} {'MB/s':>9s} {'peak RSS MiB':>12s}")
+    for name, v in sorted(stats.items(), key=lambda kv: -kv[1]["seconds"]):
+        rate = f"{v['bytes'] / v['seconds'] / 1e6:9.1f}" if v["bytes"] and v["seconds"] > 0 else f"{'':9s}"
+        print(f"{name:32s} {v['count']:6d} {v['seconds']:9.3f} {v['max_seconds']:9.3f} "
+              f"{v['bytes'] / 2**20:9.2f} {rate} {v['peak_rss_mib']:12.1f}")
+    return 0
+
+
+if os.environ.get(ENV) and __name__ != "__main__":
+    enable()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,12 @@
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+DATA = Path(__file__).resolve().parent / "data"
+
+
+@pytest.fixture(autouse=True)
+def _no_table_cache(monkeypatch):
+    """Read every table from its source file (no ~/.cache/optab14 entries)."""
+    monkeypatch.setenv("OPTAB_CACHE", "0")
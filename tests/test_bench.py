@@ -0,0 +1,45 @@
+"""bench.py result comparison and results-file handling (no stages are timed)."""
+
+import json
+
+import pytest
+
+from hybrid.bench import compare, main, merge_results
+
+
+def _results(seconds):
+    return {"scales": {"1": {"shape": [401, 551], **{
+        stage: {"seconds": sec, "lookups_per_s": 1e6 / sec} for stage, sec in seconds.items()
+    }}}}
+
+
+def test_compare_flags_slower_stage():
+    baseline = _results({"lookup": 0.100, "build": 0.200})
+    rows = compare(_results({"lookup": 0.150, "build": 0.210}), baseline, threshold=1.25)
+    by_stage = {r["stage"]: r for r in rows}
+    assert by_stage["lookup"]["ratio"] == pytest.approx(1.5)
+    assert by_stage["lookup"]["regression"]
+    assert by_stage["build"]["ratio"] == pytest.approx(1.05)
+    assert not by_stage["build"]["regression"]
+
+
+def test_compare_skips_stages_missing_from_baseline():
+    rows = compare(_results({"lookup": 0.1, "render": 0.3}), _results({"lookup": 0.1}), threshold=1.25)
+    assert [r["stage"] for r in rows] == ["lookup"]
+
+
+def test_merge_keeps_stages_not_rerun(tmp_path):
+    path = tmp_path / "bench.json"
+    path.write_text(json.dumps(_results({"lookup": 0.1, "build": 0.2})))
+    merged = merge_results(path, _results({"lookup": 0.05}))
+    assert merged["scales"]["1"]["build"]["seconds"] == 0.2
+    assert merged["scales"]["1"]["lookup"]["seconds"] == 0.05
+
+
+def test_out_equal_to_baseline_is_refused(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "bench.json").write_text(json.dumps(_results({"lookup": 0.1})))
+    with pytest.raises(SystemExit) as exc:
+        main(["--baseline", str(tmp_path / "bench.json"), "--out", "bench.json"])
+    assert exc.value.code == 2
+    assert json.loads((tmp_path / "bench.json").read_text()) == _results({"lookup": 0.1})
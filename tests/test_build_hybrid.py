@@ -0,0 +1,54 @@
+"""
+build_hybrid.py against hybrid.F90 on a reduced grid.
+
+data/fortran/ holds input.dat (81 x 45 nodes, log T 2-6, log rho -22-0) and
+the kR.dat, kP.dat, dust.dat written for it by hybrid.F90 with use_dust = 1
+(gfortran -fconvert=big-endian -O2, run from a directory next to Semenov/,
+Ferguson/ and OPCD_3.3/). The use_dust = 0 outputs of the same run are
+pinned by their SHA-256.
+"""
+
+import hashlib
+
+import pytest
+
+from conftest import DATA, ROOT
+from hybrid.build_hybrid import build_hybrid, read_sources, write_outputs
+
+FORTRAN_FILES = ("kR.dat", "kP.dat", "dust.dat")
+
+NODUST_SHA256 = {
+    "kR.dat": "9b8405b1e7bc38dd9655fae031804747c3920f8ab55a2ff83d6bdf0ee744e7e5",
+    "kP.dat": "36fd42b01a7dd82190376ac410c1cfa98d42d0fe32ed3caa0d25e03cde261d71",
+    "dust.dat": "03f8f7d0686ad652b00dee90e5b4a4a1696fc7d1965fd67a1331b586656adda4",
+}
+
+
+@pytest.fixture(scope="module")
+def sources():
+    return read_sources(ROOT / "Semenov", ROOT / "Ferguson", ROOT / "OPCD_3.3")
+
+
+def _build(sources, use_dust, out_dir):
+    tmp, rho, opa_ros, opa_pla, dust = build_hybrid(DATA / "fortran" / "input.dat", sources, use_dust)
+    write_outputs(out_dir, tmp, rho, opa_ros, opa_pla, dust, text=False)
+    return out_dir
+
+
+@pytest.mark.parametrize("name", FORTRAN_FILES)
+def test_matches_fortran_reference(sources, tmp_path, name):
+    out = _build(sources, True, tmp_path)
+    assert (out / name).read_bytes() == (DATA / "fortran" / name).read_bytes()
+
+
+@pytest.mark.parametrize("name", FORTRAN_FILES)
+def test_nodust_matches_pinned_sha256(sources, tmp_path, name):
+    out = _build(sources, False, tmp_path)
+    assert hashlib.sha256((out / name).read_bytes()).hexdigest() == NODUST_SHA256[name]
+
+
+def test_dust_below_semenov_grid_is_rejected(sources, tmp_path):
+    path = tmp_path / "input.dat"
+    path.write_text("0.3 6.0 0.05 -22.0 0.0 0.5\n")
+    with pytest.raises(ValueError, match="below Semenov"):
+        build_hybrid(path, sources, True)
@@ -0,0 +1,38 @@
+"""
+OPCD_3.3/ingest_op.py against read_op.F90 on a small OP subset.
+
+data/op/mixv.gs98 is mixv.gs98 cut to the temperature indices 140-160
+(11 blocks). op_ros.data, op_pla.data (gzipped) and border.data are what
+read_op.F90 (gfortran -fconvert=big-endian -O2, as in its Makefile) writes
+for that file on its default grid.
+"""
+
+import gzip
+import subprocess
+import sys
+
+import pytest
+
+from conftest import DATA, ROOT
+
+OP = DATA / "op"
+
+
+@pytest.fixture(scope="module")
+def ingested(tmp_path_factory):
+    out = tmp_path_factory.mktemp("op")
+    subprocess.run(
+        [sys.executable, str(ROOT / "OPCD_3.3" / "ingest_op.py"), str(OP / "mixv.gs98"), "--out-dir", str(out)],
+        check=True,
+        capture_output=True,
+    )
+    return out
+
+
+@pytest.mark.parametrize("name", ("op_ros.data", "op_pla.data"))
+def test_tables_match_fortran_reference(ingested, name):
+    assert (ingested / name).read_bytes() == gzip.decompress((OP / f"{name}.gz").read_bytes())
+
+
+def test_border_matches_fortran_reference(ingested):
+    assert (ingested / "border.data").read_bytes() == (OP / "border.data").read_bytes()
@@ -0,0 +1,70 @@
+"""OpacityTable and CompactTable lookups on the Fortran reference table in data/fortran/."""
+
+import numpy as np
+import pytest
+
+from conftest import DATA
+from hybrid.compact import CompactTable, error_report
+from hybrid.energy import GasParams, log_energy, log_temperature
+from hybrid.opacity_lookup import OpacityTable
+
+
+@pytest.fixture(scope="module")
+def table():
+    return OpacityTable.from_files(DATA / "fortran")
+
+
+def _nodes(table):
+    lt = table.ltmin + table.dlt * np.arange(table.nitt)
+    lr = table.lrmin + table.dlr * np.arange(table.nidd)
+    return np.meshgrid(lt, lr, indexing="ij")
+
+
+def test_lookup_reproduces_nodes(table):
+    lt, lr = _nodes(table)
+    outside = np.ones(lt.shape, dtype=bool)
+    values = table.lookup_all(lt, lr, outside=outside)
+    for got, want in zip(values, (table.log_kr, table.log_kp, table.dust)):
+        np.testing.assert_allclose(got, want, rtol=0, atol=1e-12)
+    assert not outside.any()
+
+
+def test_lookup_clamps_outside_points(table):
+    lt = np.array([table.ltmin - 1.0, table.ltmax + 1.0, np.nan])
+    lr = np.array([table.lrmin, table.lrmax + 1.0, table.lrmin])
+    outside = np.zeros(3, dtype=bool)
+    lkr, lkp = table.lookup(lt, lr, outside=outside)
+    assert outside.all()
+    np.testing.assert_allclose(lkr, table.log_kr[[0, -1, 0], [0, -1, 0]], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(lkp, table.log_kp[[0, -1, 0], [0, -1, 0]], rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("gas", (GasParams(), GasParams(mmw=2.34, gamma=1.4)))
+def test_lookup_energy_matches_lookup_all(table, gas):
+    rng = np.random.default_rng(1)
+    lr = rng.uniform(table.lrmin - 0.5, table.lrmax + 0.5, 1000)
+    le = log_energy(rng.uniform(table.ltmin - 0.5, table.ltmax + 0.5, 1000), lr, gas)
+    want_outside = np.empty(1000, dtype=bool)
+    want = table.lookup_all(log_temperature(le, lr, gas), lr, outside=want_outside)
+    out = np.empty((3, 1000))
+    outside = np.empty(1000, dtype=bool)
+    got = table.lookup_energy(le, lr, gas, out=out, outside=outside, work=table.workspace(1000))
+    np.testing.assert_array_equal(np.stack(got), np.stack(want))
+    np.testing.assert_array_equal(outside, want_outside)
+    assert want_outside.any() and not want_outside.all()
+
+
+def test_q16_error_within_bound(table, tmp_path):
+    compact = CompactTable.from_table(table, "q16")
+    report = error_report(table, compact)
+    for key in ("kR", "kP"):
+        assert report[key]["max_abs_dex"] <= report[key]["bound_dex"]
+        assert report[key]["nan_mismatch"] == 0
+    assert report["dust_mismatch"] == 0
+
+    path = tmp_path / "opacity_q16.tab"
+    compact.save(path, report)
+    loaded = CompactTable.load(path)
+    lt, lr = _nodes(table)
+    for got, want in zip(loaded.lookup_all(lt, lr), compact.lookup_all(lt, lr)):
+        np.testing.assert_array_equal(got, want)
@@ -0,0 +1,35 @@
+"""Every command-line tool starts: ``--help`` as a script from its own directory and as a module."""
+
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+SCRIPTS = sorted(
+    p
+    for d in ("hybrid", "Semenov", "Ferguson", "OPCD_3.3")
+    for p in (ROOT / d).glob("*.py")
+    if 'if __name__ == "__main__":' in p.read_text()
+)
+
+
+def _help(args, cwd):
+    proc = subprocess.run(
+        [sys.executable, *args, "--help"], cwd=cwd, capture_output=True, text=True, timeout=60
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert "usage:" in proc.stdout
+
+
+@pytest.mark.parametrize("path", SCRIPTS, ids=lambda p: f"{p.parent.name}/{p.name}")
+def test_script_help(path):
+    _help([path.name], path.parent)
+
+
+@pytest.mark.parametrize(
+    "path", [p for p in SCRIPTS if p.parent.name == "hybrid"], ids=lambda p: p.stem
+)
+def test_module_help(path):
+    _help(["-m", f"hybrid.{path.stem}"], ROOT)
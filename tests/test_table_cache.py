@@ -0,0 +1,68 @@
+"""table_cache.cached(): stat-based keys, content verification and size-bounded eviction."""
+
+import os
+
+import numpy as np
+import pytest
+
+from hybrid import table_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    root = tmp_path / "cache"
+    monkeypatch.setenv("OPTAB_CACHE", "1")
+    monkeypatch.setenv("OPTAB_CACHE_DIR", str(root))
+    return root
+
+
+def _source(path, value, mtime_ns=None):
+    path.write_bytes(np.full(1000, value, dtype=np.float64).tobytes())
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def _cached(path, calls):
+    def parse():
+        calls.append(path)
+        return {"data": np.frombuffer(path.read_bytes(), dtype=np.float64).copy()}
+
+    return table_cache.cached("test", [path], parse)["data"]
+
+
+def test_hit_until_the_file_changes(cache, tmp_path):
+    src = _source(tmp_path / "a.data", 1.0, mtime_ns=10**18)
+    calls = []
+    assert _cached(src, calls)[0] == 1.0
+    assert _cached(src, calls)[0] == 1.0
+    assert len(calls) == 1
+    _source(src, 2.0, mtime_ns=10**18 + 1)
+    assert _cached(src, calls)[0] == 2.0
+    assert len(calls) == 2
+
+
+def test_verify_catches_content_change_with_same_stat(cache, tmp_path, monkeypatch):
+    src = _source(tmp_path / "a.data", 1.0, mtime_ns=10**18)
+    calls = []
+    _cached(src, calls)
+    _source(src, 2.0, mtime_ns=10**18)  # same size and mtime
+    assert _cached(src, calls)[0] == 1.0  # stat key alone cannot tell
+    monkeypatch.setenv("OPTAB_CACHE_VERIFY", "1")
+    assert _cached(src, calls)[0] == 2.0
+    assert _cached(src, calls)[0] == 2.0
+    assert len(calls) == 2
+
+
+def test_eviction_keeps_directory_bounded(cache, tmp_path, monkeypatch):
+    monkeypatch.setenv("OPTAB_CACHE_MAX_MB", str(3 * 8500 / 2**20))  # about three 8 kB entries
+    calls = []
+    srcs = [_source(tmp_path / f"{k}.data", float(k)) for k in range(6)]
+    for src in srcs:
+        _cached(src, calls)
+    entries = list(cache.glob("*.bin"))
+    assert len(entries) == 3
+    assert sum(p.stat().st_size for p in entries) <= table_cache.max_bytes()
+    # the most recent entries survive
+    _cached(srcs[-1], calls)
+    assert len(calls) == 6